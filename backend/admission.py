@@ -0,0 +1,283 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import Counter
+
+import asyncpg
+from fastapi import HTTPException, Request
+
+from database import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+
+# Admission control for the token endpoints, checked before the request borrows a database
+# connection. Two limits per route:
+#   rate         "N/S": at most N failed attempts (4xx answers: unknown or used token, bad ballot)
+#                per client per S seconds (sliding window counter: this window's failures plus the
+#                previous window's, weighted by how much of it still overlaps); once over, every
+#                request from the client gets 429 with Retry-After until the count drops. Successful
+#                logins and votes are not counted, so a whole lab behind one NAT address can vote
+#                while a guessing script is stopped after a few dozen misses
+#   concurrency  at most this many requests of the route in flight on this worker; the rest are shed
+#                at once rather than queued for a connection -> 503 with Retry-After
+# Rate counts live in a store. "local" keeps them in this process (tests, single worker); "postgres"
+# shares them across workers through an UNLOGGED table. A worker does not ask Postgres per request:
+# it adds its own failures to the totals it last read and syncs both ways every ADMISSION_SYNC_MS, so
+# a client spreading requests over W workers can overshoot by at most what W workers admit in one
+# sync interval.
+ADMISSION = os.environ.get("ADMISSION", "1") == "1"
+ADMISSION_BACKEND = os.environ.get("ADMISSION_BACKEND", "local").lower()  # local | postgres
+ADMISSION_SYNC_MS = float(os.environ.get("ADMISSION_SYNC_MS", "100"))
+ADMISSION_TRUST_FORWARDED = os.environ.get("ADMISSION_TRUST_FORWARDED", "0") == "1"  # behind a proxy: key on X-Forwarded-For
+
+ROUTE_LIMITS = {
+    # route: (failed attempts "N/S", max concurrent)
+    "login": (os.environ.get("RATE_LIMIT_LOGIN", "60/60"), int(os.environ.get("ADMISSION_LOGIN_CONCURRENCY", "200"))),
+    "vote": (os.environ.get("RATE_LIMIT_VOTE", "60/60"), int(os.environ.get("ADMISSION_VOTE_CONCURRENCY", "400"))),
+}
+
+def parse_rate(rate):
+    """"60/60" -> (60, 60.0); "0" or "" -> None (no rate limit)."""
+    if not rate or rate == "0":
+        return None
+    count, _, seconds = rate.partition("/")
+    return int(count), float(seconds or 60)
+
+class LocalRateStore:
+    """Hit counts per (key, window start) in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def count(self, key, start):
+        with self._lock:
+            return self._counts[(key, start)]
+
+    def hit(self, key, start):
+        with self._lock:
+            self._counts[(key, start)] += 1
+
+    def expire(self, before):
+        with self._lock:
+            for k in [k for k in self._counts if k[1] < before]:
+                del self._counts[k]
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+class PostgresRateStore(LocalRateStore):
+    """Counts shared across workers: last totals read from rate_limit_hits plus hits not yet sent."""
+
+    def __init__(self, sync_ms=ADMISSION_SYNC_MS):
+        super().__init__()               # self._counts: totals as of the last sync
+        self.sync_ms = sync_ms
+        self._pending = Counter()        # hits admitted here since the last sync
+        self._conn = None
+        self._task = None
+        self.syncs = 0
+        self.sync_errors = 0
+
+    def count(self, key, start):
+        with self._lock:
+            return self._counts[(key, start)] + self._pending[(key, start)]
+
+    def hit(self, key, start):
+        with self._lock:
+            self._pending[(key, start)] += 1
+
+    async def sync(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            tracked = set(self._counts) | set(pending)
+        if not tracked:
+            return
+        keys = list({k for k, _ in tracked})
+        oldest = min(s for _, s in tracked)
+        try:
+            if self._conn is None or self._conn.is_closed():
+                self._conn = await asyncpg.connect(database=DB_NAME, user=DB_USER, password=DB_PASSWORD,
+                                                   host=DB_HOST, port=int(DB_PORT))
+            async with self._conn.transaction():
+                if pending:
+                    items = sorted(pending.items())
+                    await self._conn.execute("""
+                        INSERT INTO rate_limit_hits (key, window_start, hits)
+                        SELECT * FROM unnest($1::text[], $2::bigint[], $3::int[])
+                        ON CONFLICT (key, window_start) DO UPDATE SET hits = rate_limit_hits.hits + EXCLUDED.hits
+                    """, [k for (k, _), _ in items], [s for (_, s), _ in items], [n for _, n in items])
+                rows = await self._conn.fetch(
+                    "SELECT key, window_start, hits FROM rate_limit_hits WHERE key = ANY($1::text[]) AND window_start >= $2",
+                    keys, oldest)
+        except Exception as e:
+            # Keep the hits for the next attempt; meanwhile limits hold per worker
+            with self._lock:
+                self._pending.update(pending)
+            self.sync_errors += 1
+            if self._conn is not None:
+                self._conn.terminate()
+                self._conn = None
+            raise e
+        with self._lock:
+            for r in rows:
+                self._counts[(r['key'], r['window_start'])] = r['hits']
+        self.syncs += 1
+
+    def expire(self, before):
+        super().expire(before)
+        with self._lock:
+            for k in [k for k in self._pending if k[1] < before]:
+                del self._pending[k]
+
+    async def _sync_forever(self):
+        last_cleanup = 0.0
+        while True:
+            await asyncio.sleep(self.sync_ms / 1000)
+            try:
+                await self.sync()
+                now = time.time()
+                if now - last_cleanup > 60:
+                    # Windows that can no longer be the current or previous one of any route
+                    await self._conn.execute("DELETE FROM rate_limit_hits WHERE window_start < $1",
+                                             int(now - 2 * max_window_seconds()))
+                    last_cleanup = now
+            except Exception as e:
+                print(f"Rate limit sync failed: {e}")
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sync_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+class RouteGate:
+    """Rate limit + concurrency cap of one route."""
+
+    def __init__(self, name, rate, max_concurrent, store):
+        self.name = name
+        self.rate = parse_rate(rate)
+        self.max_concurrent = max_concurrent
+        self.store = store
+        self.in_flight = 0
+        self.admitted = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.shed = 0
+
+    def retry_after(self, key, now):
+        """Seconds until the client's sliding-window count drops below the limit (at least 1)."""
+        limit, seconds = self.rate
+        start = int(now // seconds * seconds)
+        elapsed = (now - start) / seconds
+        current = self.store.count(key, start)
+        previous = self.store.count(key, int(start - seconds))
+        if current >= limit:
+            return max(1, math.ceil(start + seconds - now))
+        # previous * (1 - f) < limit - current once the window fraction f passes this point
+        f = 1 - (limit - current) / previous if previous else elapsed
+        return max(1, math.ceil((f - elapsed) * seconds))
+
+    def over_limit(self, key, now):
+        limit, seconds = self.rate
+        start = int(now // seconds * seconds)
+        elapsed = (now - start) / seconds
+        return self.store.count(key, start) + self.store.count(key, int(start - seconds)) * (1 - elapsed) >= limit
+
+    def record_failure(self, key, now):
+        _, seconds = self.rate
+        self.store.hit(key, int(now // seconds * seconds))
+        self.failures += 1
+
+    def stats(self):
+        return {
+            "rate": f"{self.rate[0]}/{self.rate[1]:g}s" if self.rate else None,
+            "maxConcurrent": self.max_concurrent,
+            "inFlight": self.in_flight,
+            "admitted": self.admitted,
+            "failures": self.failures,
+            "rateLimited": self.rate_limited,
+            "shed": self.shed,
+        }
+
+def max_window_seconds():
+    return max((parse_rate(rate) or (0, 0))[1] for rate, _ in ROUTE_LIMITS.values())
+
+def client_key(request):
+    if ADMISSION_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+class Admission:
+    def __init__(self, enabled=ADMISSION, backend=ADMISSION_BACKEND):
+        self.enabled = enabled
+        self.backend = backend
+        self.store = PostgresRateStore() if backend == "postgres" else LocalRateStore()
+        self.gates = {name: RouteGate(name, rate, cap, self.store) for name, (rate, cap) in ROUTE_LIMITS.items()}
+        self._last_expire = 0.0
+
+    def dependency(self, route):
+        """FastAPI dependency admitting one request of `route` (declare it before the session)."""
+        gate = self.gates[route]
+
+        async def admit(request: Request):
+            if not self.enabled:
+                yield
+                return
+            if gate.max_concurrent and gate.in_flight >= gate.max_concurrent:
+                gate.shed += 1
+                raise HTTPException(status_code=503, detail="Server is busy, please try again", headers={"Retry-After": "1"})
+            now = time.time()
+            self._expire(now)
+            key = f"{route}:{client_key(request)}"
+            if gate.rate and gate.over_limit(key, now):
+                gate.rate_limited += 1
+                raise HTTPException(status_code=429, detail="Too many attempts, please wait and try again",
+                                    headers={"Retry-After": str(gate.retry_after(key, now))})
+            gate.admitted += 1
+            gate.in_flight += 1
+            try:
+                yield
+            except HTTPException as e:
+                if gate.rate and 400 <= e.status_code < 500:
+                    gate.record_failure(key, time.time())
+                raise
+            finally:
+                gate.in_flight -= 1
+
+        return admit
+
+    def _expire(self, now):
+        if now - self._last_expire > 10:
+            self._last_expire = now
+            self.store.expire(int(now - 2 * max_window_seconds()))
+
+    def stats(self):
+        stats = {"enabled": self.enabled, "backend": self.backend, "routes": {n: g.stats() for n, g in self.gates.items()}}
+        if isinstance(self.store, PostgresRateStore):
+            stats["syncs"] = self.store.syncs
+            stats["syncErrors"] = self.store.sync_errors
+        return stats
+
+    async def start(self):
+        if self.enabled:
+            await self.store.start()
+
+    async def stop(self):
+        await self.store.stop()
+
+admission = Admission()
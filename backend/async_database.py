@@ -0,0 +1,188 @@
+import asyncio
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+import asyncpg
+from starlette.concurrency import run_in_threadpool
+
+from database import (
+    DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT,
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT,
+    db_pool, PoolTimeoutError
+)
+
+# "async" runs the hot endpoints on asyncpg; "sync" runs the very same statements on the
+# psycopg2 pool inside the threadpool, so both modes can be benchmarked under identical load.
+DB_ENGINE = os.environ.get("DB_ENGINE", "async").lower()
+
+_pool = None
+_sync_slots = None
+_checkouts = 0
+_timeouts = 0
+_total_wait = 0.0
+_max_wait = 0.0
+
+async def open_async_pool():
+    global _pool
+    if DB_ENGINE != "async" or _pool is not None:
+        return
+    _pool = await asyncpg.create_pool(
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=int(DB_PORT),
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+    )
+
+async def close_async_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+def async_pool_stats():
+    if _pool is None:
+        return None
+    size = _pool.get_size()
+    idle = _pool.get_idle_size()
+    return {
+        "minSize": _pool.get_min_size(),
+        "maxSize": _pool.get_max_size(),
+        "inUse": size - idle,
+        "idle": idle,
+        "checkouts": _checkouts,
+        "timeouts": _timeouts,
+        "avgWaitMs": round(_total_wait / _checkouts * 1000, 3) if _checkouts else 0.0,
+        "maxWaitMs": round(_max_wait * 1000, 3),
+    }
+
+@lru_cache(maxsize=256)
+def _to_pyformat(query):
+    """Translates asyncpg-style $n placeholders into psycopg2 %s plus the argument order."""
+    order = []
+    def repl(m):
+        order.append(int(m.group(1)) - 1)
+        return "%s"
+    sql = re.sub(r"\$(\d+)", repl, query.replace("%", "%%"))
+    return sql, tuple(order)
+
+class AsyncSession:
+    """Session on an asyncpg connection. Rows are returned as plain dicts."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def fetch(self, query, *args):
+        return [dict(r) for r in await self.conn.fetch(query, *args)]
+
+    async def fetchrow(self, query, *args):
+        row = await self.conn.fetchrow(query, *args)
+        return dict(row) if row is not None else None
+
+    async def fetchval(self, query, *args):
+        return await self.conn.fetchval(query, *args)
+
+    async def execute(self, query, *args):
+        return await self.conn.execute(query, *args)
+
+    def transaction(self):
+        return self.conn.transaction()
+
+class ThreadedSession:
+    """Same interface as AsyncSession, backed by a pooled psycopg2 connection run in the threadpool."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _run(self, query, args, mode):
+        sql, order = _to_pyformat(query)
+        cur = self.conn.cursor()
+        try:
+            cur.execute(sql, tuple(args[i] for i in order))
+            if mode == "execute":
+                return cur.statusmessage
+            if mode == "fetch":
+                return cur.fetchall()
+            row = cur.fetchone()
+            if mode == "fetchval":
+                return next(iter(row.values())) if row else None
+            return row
+        finally:
+            cur.close()
+
+    async def fetch(self, query, *args):
+        return await run_in_threadpool(self._run, query, args, "fetch")
+
+    async def fetchrow(self, query, *args):
+        return await run_in_threadpool(self._run, query, args, "fetchrow")
+
+    async def fetchval(self, query, *args):
+        return await run_in_threadpool(self._run, query, args, "fetchval")
+
+    async def execute(self, query, *args):
+        return await run_in_threadpool(self._run, query, args, "execute")
+
+    @asynccontextmanager
+    async def transaction(self):
+        try:
+            yield
+        except BaseException:
+            await run_in_threadpool(self.conn.rollback)
+            raise
+        else:
+            await run_in_threadpool(self.conn.commit)
+
+async def acquire_session():
+    """Borrows a connection from the pool of the configured engine."""
+    global _checkouts, _timeouts, _total_wait, _max_wait, _sync_slots
+    if DB_ENGINE != "async":
+        # Wait for a free connection on the event loop, not inside a worker thread: threads blocked
+        # in getconn would starve the threads of the sessions that hold the connections.
+        if _sync_slots is None:
+            _sync_slots = asyncio.Semaphore(db_pool.max_size)
+        try:
+            await asyncio.wait_for(_sync_slots.acquire(), DB_POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise PoolTimeoutError(f"No database connection available within {DB_POOL_TIMEOUT}s")
+        try:
+            return ThreadedSession(await run_in_threadpool(db_pool.getconn))
+        except BaseException:
+            _sync_slots.release()
+            raise
+
+    start = time.monotonic()
+    try:
+        conn = await _pool.acquire(timeout=DB_POOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        _timeouts += 1
+        raise PoolTimeoutError(f"No database connection available within {DB_POOL_TIMEOUT}s")
+    waited = time.monotonic() - start
+    _checkouts += 1
+    _total_wait += waited
+    _max_wait = max(_max_wait, waited)
+    return AsyncSession(conn)
+
+async def release_session(session):
+    """Returns the session's connection to its pool. Safe to call more than once."""
+    conn, session.conn = session.conn, None
+    if conn is None:
+        return
+    if isinstance(session, AsyncSession):
+        await _pool.release(conn)
+    else:
+        await run_in_threadpool(db_pool.putconn, conn)
+        _sync_slots.release()
+
+@asynccontextmanager
+async def session():
+    """Context-manager form of acquire_session/release_session for code outside a request."""
+    db = await acquire_session()
+    try:
+        yield db
+    finally:
+        await release_session(db)
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+
+from pydantic import TypeAdapter
+
+from models import CandidateResponse, ElectionResponse
+
+# Ballot cache for token login and the ?token= variants of /elections and /candidates. Every token
+# of a batch shares one election set, so the ballot (its elections and their candidates) is built
+# and serialized once per set and kept in memory. Entries are tagged with the catalog version
+# (data_versions, bumped by triggers on elections, candidates, set members and tokens); the token
+# lookup reads the current version in the same round trip, so an entry built before an edit is
+# never served, whichever worker made the edit. Vote counts are not part of the ballot: /candidates
+# reads them fresh for the ballot's candidate ids.
+BALLOT_CACHE_SETS = int(os.environ.get("BALLOT_CACHE_SETS", "1000"))  # 0 = off
+
+# One row even for an unknown token (token columns NULL), so the versions are always there
+TOKEN_BALLOT_SQL = """
+    SELECT cv.version AS catalog, tv.version AS tallies, vt.token, vt.is_used, vt.election_set_id
+    FROM data_versions cv
+    JOIN data_versions tv ON tv.name = 'tallies'
+    LEFT JOIN voting_tokens vt ON vt.token = $1
+    WHERE cv.name = 'catalog'
+"""
+
+_elections_json = TypeAdapter(List[ElectionResponse])
+
+class Ballot:
+    """Pre-serialized ballot of one election set."""
+
+    def __init__(self, set_id, catalog, elections, candidates):
+        self.set_id = set_id
+        self.catalog = catalog
+        # /tokens/login: the two keys spliced into the response object
+        self.login_json = '"authorizedElections": {}, "candidates": {}'.format(
+            json.dumps([{"id": str(e['id']), "name": e['name']} for e in elections]),
+            json.dumps([{"id": c['id'], "name": c['name'], "position": c['position'], "party": c['party'],
+                         "election_id": c['election_id'], "image_url": c['image_url'], "image": c['image_url'],
+                         "image_variants": json.loads(c['image_variants']) if c['image_variants'] else None}
+                        for c in candidates]))
+        # /elections?token=: the ElectionResponse list as FastAPI would render it
+        self.elections_json = _elections_json.dump_json(
+            _elections_json.validate_python([dict(e) for e in elections]), by_alias=True).decode()
+        # /candidates?token=: each CandidateResponse without its voteCount, which is read per request
+        self.candidate_ids = [c['id'] for c in candidates]
+        self._candidate_heads = [
+            CandidateResponse.model_validate(dict(c, image=c['image_url'], vote_count=0))
+            .model_dump_json(by_alias=True, exclude={"vote_count"})
+            for c in candidates
+        ]
+
+    def candidates_json(self, vote_counts):
+        """CandidateResponse list with the given {candidate id: votes} filled in."""
+        return "[" + ",".join(f'{head[:-1]},"voteCount":{vote_counts.get(c_id, 0)}}}'
+                              for c_id, head in zip(self.candidate_ids, self._candidate_heads)) + "]"
+
+EMPTY_BALLOT = Ballot(None, None, [], [])
+
+class BallotCache:
+    """Ballots by election set id, LRU, each valid for the catalog version it was built at."""
+
+    def __init__(self, max_sets=BALLOT_CACHE_SETS):
+        self.max_sets = max_sets
+        self._lock = threading.Lock()
+        self._ballots = OrderedDict()    # set id -> Ballot
+        self._load_lock = None
+
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, db, set_id, catalog):
+        """The ballot of `set_id` at catalog version `catalog` (as read by TOKEN_BALLOT_SQL)."""
+        if set_id is None:
+            return EMPTY_BALLOT
+        if self.max_sets <= 0:
+            with self._lock:
+                self.misses += 1
+            return await self._load(db, set_id, catalog)
+        ballot = self._lookup(set_id, catalog)
+        if ballot is None:
+            # One load at a time: when a batch starts logging in, the rest wait for the first load
+            if self._load_lock is None:
+                self._load_lock = asyncio.Lock()
+            async with self._load_lock:
+                ballot = self._lookup(set_id, catalog)
+                if ballot is None:
+                    ballot = await self._load(db, set_id, catalog)
+                    with self._lock:
+                        self.misses += 1
+                    return ballot
+        with self._lock:
+            self.hits += 1
+        return ballot
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "maxSets": self.max_sets,
+                "sets": len(self._ballots),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+    def _lookup(self, set_id, catalog):
+        with self._lock:
+            ballot = self._ballots.get(set_id)
+            if ballot is not None and ballot.catalog == catalog:
+                self._ballots.move_to_end(set_id)
+                return ballot
+        return None
+
+    async def _load(self, db, set_id, catalog):
+        # Read after `catalog` was, so the rows are at least that new; a later version reloads
+        elections = await db.fetch("""
+            SELECT e.*
+            FROM election_set_members m
+            JOIN elections e ON e.id = m.election_id
+            WHERE m.set_id = $1
+            ORDER BY e.created_at DESC
+        """, set_id)
+        candidates = await db.fetch("""
+            SELECT c.id, c.name, c.position, c.party, c.election_id::text AS election_id, c.image_url, c.image_variants::text
+            FROM election_set_members m
+            JOIN candidates c ON c.election_id = m.election_id
+            WHERE m.set_id = $1
+            ORDER BY c.id
+        """, set_id)
+        ballot = Ballot(set_id, catalog, elections, candidates)
+        with self._lock:
+            current = self._ballots.get(set_id)
+            if self.max_sets > 0 and (current is None or current.catalog <= catalog):
+                self._ballots[set_id] = ballot
+                self._ballots.move_to_end(set_id)
+                while len(self._ballots) > self.max_sets:
+                    self._ballots.popitem(last=False)
+        return ballot
+
+ballot_cache = BallotCache()
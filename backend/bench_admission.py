@@ -0,0 +1,134 @@
+"""Admission control: legitimate voters while a script floods /tokens/login with guesses.
+
+Runs the real app in-process (httpx ASGI transport) against the configured database, seeds its own
+election, candidate and tokens, and cleans them up afterwards. In each run a bot at one address
+posts random 9-digit codes to /tokens/login at BOT_RATE requests per second (BOT_CONCURRENCY
+tasks, each pacing itself; the bot shares this process's event loop, so an unpaced one would
+measure the client rather than the server) for as long as VOTERS voters (all behind one other
+address, like a lab behind NAT) log in and vote, VOTER_CONCURRENCY at a time.
+The token filter is switched off so every guess reaches Postgres, as it would before the filter's
+first build. Reports voter latency and failures, what the bot got back, and connection pool
+checkouts / timeouts, with admission off and on.
+Run: python bench_admission.py
+"""
+import asyncio
+import random
+import time
+import uuid
+
+import httpx
+
+import main
+from admission import admission
+from database import get_db_connection, resolve_election_set
+from token_filter import token_filter
+
+VOTERS = 400
+VOTER_CONCURRENCY = 20
+BOT_CONCURRENCY = 300
+BOT_RATE = 1500
+LAB = ("10.20.0.1", 40000)
+BOT = ("203.0.113.66", 50000)
+
+def seed():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    batch_id = f"BENCH-{uuid.uuid4().hex[:8].upper()}"
+    cur.execute("""
+        INSERT INTO elections (name, start_date, end_date, status)
+        VALUES (%s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP + INTERVAL '1 day', 'active') RETURNING id
+    """, (batch_id,))
+    election_id = cur.fetchone()['id']
+    cur.execute("INSERT INTO candidates (name, position, party, election_id) VALUES ('Bench', 'President', 'Bench', %s) RETURNING id",
+                (election_id,))
+    candidate_id = cur.fetchone()['id']
+    cur.execute("""
+        INSERT INTO voting_tokens (token, batch_id, election_set_id)
+        SELECT %s || '-' || g, %s, %s FROM generate_series(1, %s) g RETURNING token
+    """, (batch_id, batch_id, resolve_election_set(cur, [election_id]), VOTERS * 2))
+    tokens = [r['token'] for r in cur.fetchall()]
+    conn.commit()
+    cur.close()
+    conn.close()
+    return batch_id, election_id, candidate_id, tokens
+
+def cleanup(batch_id, election_id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM candidates WHERE election_id = %s", (election_id,))
+    cur.execute("DELETE FROM voting_tokens WHERE batch_id = %s", (batch_id,))
+    cur.execute("DELETE FROM elections WHERE id = %s", (election_id,))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+def pool_counters():
+    stats = main.admin_db_pool_stats()
+    pool = stats["async"] if stats["engine"] == "async" else stats["sync"]
+    return pool["checkouts"], pool["timeouts"]
+
+async def run(lab, bot, tokens, candidate_id):
+    queue = list(tokens)
+    latencies, voter_failures, bot_statuses = [], [], []
+    done = asyncio.Event()
+
+    async def voter():
+        while queue:
+            token = queue.pop()
+            start = time.perf_counter()
+            login = await lab.post("/tokens/login", json={"token": token})
+            vote = await lab.post("/vote", json={"token": token, "candidateId": candidate_id})
+            latencies.append(time.perf_counter() - start)
+            if login.status_code != 200 or vote.status_code != 200:
+                voter_failures.append((login.status_code, vote.status_code))
+
+    async def guesser():
+        # A well-behaved client would honour Retry-After; the bot keeps its pace whatever it gets
+        interval = BOT_CONCURRENCY / BOT_RATE
+        await asyncio.sleep(random.random() * interval)
+        while not done.is_set():
+            sent = time.perf_counter()
+            r = await bot.post("/tokens/login", json={"token": f"{random.randrange(10 ** 9):09d}"})
+            bot_statuses.append(r.status_code)
+            await asyncio.sleep(max(0.0, interval - (time.perf_counter() - sent)))
+
+    checkouts, timeouts = pool_counters()
+    bots = [asyncio.create_task(guesser()) for _ in range(BOT_CONCURRENCY)]
+    start = time.perf_counter()
+    await asyncio.gather(*(voter() for _ in range(VOTER_CONCURRENCY)))
+    took = time.perf_counter() - start
+    done.set()
+    await asyncio.gather(*bots)
+    after_checkouts, after_timeouts = pool_counters()
+    latencies.sort()
+    return {
+        "took": took,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p99": latencies[int(len(latencies) * 0.99)] * 1000,
+        "voter_failures": len(voter_failures),
+        "bot": {s: bot_statuses.count(s) for s in sorted(set(bot_statuses))},
+        "checkouts": after_checkouts - checkouts,
+        "timeouts": after_timeouts - timeouts,
+    }
+
+async def bench():
+    batch_id, election_id, candidate_id, tokens = seed()
+    await main.startup_event()
+    await token_filter.stop()
+    try:
+        print(f"{VOTERS} voters ({VOTER_CONCURRENCY} at a time, one address) vs a bot at {BOT_RATE} guesses/s "
+              f"({BOT_CONCURRENCY} tasks, one address), engine={main.DB_ENGINE}, limits {admission.stats()['routes']['login']['rate']} failed logins")
+        lab = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app, client=LAB), base_url="http://bench", timeout=60)
+        bot = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app, client=BOT), base_url="http://bench", timeout=60)
+        async with lab, bot:
+            for label, enabled, share in (("admission off", False, tokens[:VOTERS]), ("admission on", True, tokens[VOTERS:])):
+                admission.enabled = enabled
+                r = await run(lab, bot, share, candidate_id)
+                print(f"{label:<14} voters {r['took']:>6.2f} s  p50 {r['p50']:>7.1f} ms  p99 {r['p99']:>7.1f} ms  "
+                      f"failed {r['voter_failures']:>3}  pool checkouts {r['checkouts']:>6}  timeouts {r['timeouts']:>4}  bot {r['bot']}")
+    finally:
+        await main.shutdown_event()
+        cleanup(batch_id, election_id)
+
+if __name__ == "__main__":
+    asyncio.run(bench())
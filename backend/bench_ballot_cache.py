@@ -0,0 +1,104 @@
+"""Token login and the ?token= catalog endpoints with the ballot cache off and on.
+
+Seeds one batch of TOKENS tokens eligible for ELECTIONS elections of CANDIDATES_PER_ELECTION
+candidates each, then runs the real app in-process (httpx ASGI transport): POST /tokens/login with
+a different token per request, and GET /candidates?token= and /elections?token=. With the cache
+off every request rebuilds the ballot from Postgres (set members, elections, candidates), as
+login used to. Everything is removed afterwards.
+Run: python bench_ballot_cache.py
+"""
+import asyncio
+import time
+
+import httpx
+
+import main
+from ballot_cache import ballot_cache
+from database import _connect, resolve_election_set
+
+TOKENS = 3000
+ELECTIONS = 4
+CANDIDATES_PER_ELECTION = 10
+CONCURRENCY = 50
+BATCH = "BENCH-BALLOT"
+
+def seed():
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO elections (name, start_date, end_date) SELECT 'BENCH-BALLOT-' || g, now(), now() FROM generate_series(1, %s) g RETURNING id
+    """, (ELECTIONS,))
+    election_ids = [r['id'] for r in cur.fetchall()]
+    cur.execute("""
+        INSERT INTO candidates (name, position, party, election_id, image_url)
+        SELECT 'Bench ' || g, 'P', 'B', e, '/uploads/bench_' || g || '.jpg' FROM unnest(%s::int[]) e, generate_series(1, %s) g
+    """, (election_ids, CANDIDATES_PER_ELECTION))
+    cur.execute("""
+        INSERT INTO voting_tokens (token, batch_id, election_set_id)
+        SELECT 'BB' || lpad(g::text, 8, '0'), %s, %s FROM generate_series(1, %s) g RETURNING token
+    """, (BATCH, resolve_election_set(cur, election_ids), TOKENS))
+    tokens = [r['token'] for r in cur.fetchall()]
+    conn.commit()
+    conn.close()
+    return election_ids, tokens
+
+def cleanup(election_ids):
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM voting_tokens WHERE batch_id = %s", (BATCH,))
+    cur.execute("DELETE FROM candidates WHERE election_id = ANY(%s)", (election_ids,))
+    cur.execute("DELETE FROM elections WHERE id = ANY(%s)", (election_ids,))
+    cur.execute("DELETE FROM election_sets s WHERE NOT EXISTS (SELECT 1 FROM election_set_members m WHERE m.set_id = s.id)"
+                " AND NOT EXISTS (SELECT 1 FROM voting_tokens vt WHERE vt.election_set_id = s.id)")
+    conn.commit()
+    conn.close()
+
+async def run(client, send, tokens):
+    queue = list(tokens)
+    latencies = []
+    statuses = []
+
+    async def worker():
+        while queue:
+            token = queue.pop()
+            start = time.perf_counter()
+            r = await send(client, token)
+            latencies.append(time.perf_counter() - start)
+            statuses.append(r.status_code)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    took = time.perf_counter() - start
+    latencies.sort()
+    return len(tokens) / took, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000, statuses.count(200)
+
+REQUESTS = {
+    "POST /tokens/login": lambda client, t: client.post("/tokens/login", json={"token": t}),
+    "GET /candidates?token=": lambda client, t: client.get("/candidates", params={"token": t}),
+    "GET /elections?token=": lambda client, t: client.get("/elections", params={"token": t}),
+}
+
+async def bench():
+    election_ids, tokens = seed()
+    await main.startup_event()
+    max_sets = ballot_cache.max_sets
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            print(f"{TOKENS} tokens, {ELECTIONS} elections x {CANDIDATES_PER_ELECTION} candidates, "
+                  f"{CONCURRENCY} concurrent clients, engine={main.DB_ENGINE}")
+            for name, send in REQUESTS.items():
+                for label, sets in (("no cache", 0), ("ballot cache", max_sets or 1000)):
+                    ballot_cache.max_sets = sets
+                    before = ballot_cache.stats()
+                    rate, p50, p99, ok = await run(client, send, tokens)
+                    after = ballot_cache.stats()
+                    print(f"{name:<24} {label:<13} {rate:>7.0f} req/s  p50 {p50:>6.1f} ms  p99 {p99:>6.1f} ms  ok={ok}  "
+                          f"misses={after['misses'] - before['misses']}")
+    finally:
+        ballot_cache.max_sets = max_sets
+        await main.shutdown_event()
+        cleanup(election_ids)
+
+if __name__ == "__main__":
+    asyncio.run(bench())
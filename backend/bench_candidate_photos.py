@@ -0,0 +1,102 @@
+"""Candidate photos: base64 inside the JSON body vs. the streamed PUT /candidates/{id}/photo.
+
+Runs the real app in-process (httpx ASGI transport) against the configured database with one
+throwaway election and candidate, and uploads a JPEG-headed photo of each of SIZES_MB twice:
+as a data URL through PUT /candidates/{id} (the old path), and as the raw body of PUT
+/candidates/{id}/photo, sent in 64 KB pieces as a browser / curl would. PHOTO_MAX_BYTES is
+raised so the big sizes are accepted. Reports bytes on the wire, time, and the peak Python
+memory (tracemalloc) the request added on top of the client's own copy of the payload.
+Everything is removed afterwards.
+Run: python bench_candidate_photos.py
+"""
+import asyncio
+import base64
+import json
+import os
+import time
+import tracemalloc
+import uuid
+
+import httpx
+
+import candidate_photos
+import main
+from database import get_db_connection
+
+SIZES_MB = (1, 5, 20)
+PIECE = 64 * 1024
+
+def seed():
+    name = f"BENCH-{uuid.uuid4().hex[:8].upper()}"
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO elections (name, start_date, end_date, status)
+        VALUES (%s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP + INTERVAL '1 day', 'active') RETURNING id
+    """, (name,))
+    election_id = cur.fetchone()['id']
+    cur.execute("INSERT INTO candidates (name, position, party, election_id) VALUES ('Bench', 'President', 'Bench', %s) RETURNING id",
+                (election_id,))
+    candidate_id = cur.fetchone()['id']
+    conn.commit()
+    cur.close()
+    conn.close()
+    return election_id, candidate_id
+
+def cleanup(election_id, candidate_id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT image_url FROM candidates WHERE id = %s", (candidate_id,))
+    row = cur.fetchone()
+    if row:
+        candidate_photos.remove_photo(row['image_url'], main.UPLOAD_DIR)
+    cur.execute("DELETE FROM candidates WHERE election_id = %s", (election_id,))
+    cur.execute("DELETE FROM elections WHERE id = %s", (election_id,))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+async def measure(send):
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    r = await send()
+    took = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    r.raise_for_status()
+    return took, peak
+
+async def bench():
+    election_id, candidate_id = seed()
+    candidate_photos.PHOTO_MAX_BYTES = max(SIZES_MB) * 1024 * 1024 + 1
+    await main.startup_event()
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            print(f"{'photo':>6}  {'path':<22} {'sent':>9} {'time':>9} {'peak memory':>12}")
+            for mb in SIZES_MB:
+                photo = b"\xff\xd8\xff\xe0" + os.urandom(mb * 1024 * 1024 - 4)
+                body = {"name": "Bench", "position": "President", "party": "Bench", "electionId": str(election_id),
+                        "image": "data:image/jpeg;base64," + base64.b64encode(photo).decode()}
+                payload = json.dumps(body).encode()
+
+                async def stream():
+                    for i in range(0, len(photo), PIECE):
+                        yield photo[i:i + PIECE]
+
+                runs = (
+                    ("JSON base64", len(payload), lambda: client.put(f"/candidates/{candidate_id}", content=payload,
+                                                                     headers={"content-type": "application/json"})),
+                    ("streamed /photo", len(photo), lambda: client.put(f"/candidates/{candidate_id}/photo", content=stream(),
+                                                                       headers={"content-type": "image/jpeg"})),
+                )
+                for label, sent, send in runs:
+                    took, peak = await measure(send)
+                    print(f"{mb:>4} MB  {label:<22} {sent / 2**20:>6.1f} MB {took * 1000:>6.0f} ms {peak / 2**20:>9.1f} MB")
+    finally:
+        await main.shutdown_event()
+        cleanup(election_id, candidate_id)
+
+if __name__ == "__main__":
+    asyncio.run(bench())
@@ -0,0 +1,55 @@
+"""Full responses vs 304 Not Modified for the catalog and results endpoints.
+
+Seeds ELECTIONS elections with CANDIDATES candidates in-process (TestClient), then for each
+endpoint times REQUESTS plain GETs and REQUESTS GETs that send back the ETag of the first one.
+Reports median latency and bytes on the wire for both. Removes its candidates and elections afterwards.
+Run: python bench_conditional_get.py
+"""
+import statistics
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+
+ELECTIONS = 20
+CANDIDATES = 2000
+REQUESTS = 200
+
+def timed(client, url, headers=None):
+    times, size, status = [], 0, None
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        r = client.get(url, headers=headers)
+        times.append(time.perf_counter() - start)
+        size, status = len(r.content), r.status_code
+    return statistics.median(times) * 1000, size, status
+
+def bench():
+    with TestClient(main.app) as client:
+        election_ids, candidate_ids = [], []
+        try:
+            for i in range(ELECTIONS):
+                election = client.post("/elections", json={"name": f"BENCH-ETAG-{i}", "startDate": "2026-01-01T00:00:00",
+                                                            "endDate": "2026-12-31T00:00:00", "status": "active"}).json()
+                election_ids.append(election['id'])
+            for i in range(CANDIDATES):
+                candidate = client.post("/candidates", json={"name": f"Bench {i}", "position": "P", "party": "B",
+                                                             "electionId": str(election_ids[i % ELECTIONS])}).json()
+                candidate_ids.append(candidate['id'])
+            print(f"{ELECTIONS} elections, {CANDIDATES} candidates, median of {REQUESTS} requests")
+            print(f"{'endpoint':<28} {'200 ms':>8} {'bytes':>9} {'304 ms':>8} {'bytes':>6}")
+            for url in ("/elections", "/candidates", f"/elections/{election_ids[0]}/candidates", "/results", "/admin/results"):
+                full_ms, full_bytes, _ = timed(client, url)
+                etag = client.get(url).headers["etag"]
+                cond_ms, cond_bytes, status = timed(client, url, {"If-None-Match": etag})
+                assert status == 304, f"{url} answered {status} to its own ETag"
+                print(f"{url:<28} {full_ms:>8.2f} {full_bytes:>9} {cond_ms:>8.2f} {cond_bytes:>6}")
+        finally:
+            for candidate_id in candidate_ids:
+                client.delete(f"/candidates/{candidate_id}")
+            for election_id in election_ids:
+                client.delete(f"/elections/{election_id}")
+
+if __name__ == "__main__":
+    bench()
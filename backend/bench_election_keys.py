@@ -0,0 +1,143 @@
+"""EXPLAIN ANALYZE comparison of the old TEXT election joins against the integer-key equi-joins.
+
+Seeds a throwaway schema with both table shapes and prints planner choice and execution time
+for the token-login and token-filtered election queries. Run: python bench_election_keys.py
+"""
+import json
+import sys
+
+from database import get_db_connection
+
+ELECTIONS = 500
+CANDIDATES = 10000
+TOKENS = 50000
+ELECTIONS_PER_TOKEN = 5
+
+OLD_QUERIES = {
+    "token login elections": """
+        SELECT te.election_id as id, COALESCE(e.name, te.election_id) as name
+        FROM old_token_elections te
+        LEFT JOIN elections e ON te.election_id::text = e.id::text OR te.election_id = e.name
+        WHERE te.token_id = %(token_id)s
+    """,
+    "elections by token": """
+        SELECT e.*
+        FROM elections e
+        JOIN old_token_elections te ON (e.id::text = te.election_id OR e.name = te.election_id)
+        JOIN old_voting_tokens vt ON te.token_id = vt.id
+        WHERE vt.token = %(token)s
+    """,
+    "candidates by token": """
+        SELECT c.* FROM old_candidates c
+        WHERE c.election_id IN (
+            SELECT te.election_id FROM old_token_elections te
+            JOIN old_voting_tokens vt ON te.token_id = vt.id WHERE vt.token = %(token)s)
+    """,
+}
+
+NEW_QUERIES = {
+    "token login elections": """
+        SELECT e.id::text as id, e.name
+        FROM new_token_elections te
+        JOIN elections e ON e.id = te.election_id
+        WHERE te.token_id = %(token_id)s
+    """,
+    "elections by token": """
+        SELECT e.*
+        FROM new_voting_tokens vt
+        JOIN new_token_elections te ON te.token_id = vt.id
+        JOIN elections e ON e.id = te.election_id
+        WHERE vt.token = %(token)s
+    """,
+    "candidates by token": """
+        SELECT c.*
+        FROM new_voting_tokens vt
+        JOIN new_token_elections te ON te.token_id = vt.id
+        JOIN new_candidates c ON c.election_id = te.election_id
+        WHERE vt.token = %(token)s
+    """,
+}
+
+def seed(cur):
+    cur.execute("DROP SCHEMA IF EXISTS bench_keys CASCADE")
+    cur.execute("CREATE SCHEMA bench_keys")
+    cur.execute("SET search_path TO bench_keys")
+    cur.execute("""
+        CREATE TABLE elections (id SERIAL PRIMARY KEY, name TEXT NOT NULL, description TEXT,
+                                start_date TIMESTAMP, end_date TIMESTAMP, status TEXT, created_at TIMESTAMP DEFAULT now())
+    """)
+    cur.execute("INSERT INTO elections (name) SELECT 'Election ' || g FROM generate_series(1, %s) g", (ELECTIONS,))
+
+    # Old shape: free TEXT references, half stored as ids and half as names, no indexes
+    cur.execute("CREATE TABLE old_candidates (id SERIAL PRIMARY KEY, name TEXT, election_id TEXT, vote_count INTEGER DEFAULT 0)")
+    cur.execute("CREATE TABLE old_voting_tokens (id SERIAL PRIMARY KEY, token TEXT UNIQUE NOT NULL, batch_id TEXT)")
+    cur.execute("CREATE TABLE old_token_elections (id SERIAL PRIMARY KEY, token_id INTEGER, election_id TEXT)")
+    cur.execute("""
+        INSERT INTO old_candidates (name, election_id)
+        SELECT 'Candidate ' || g, CASE WHEN g %% 2 = 0 THEN (g %% %(e)s + 1)::text ELSE 'Election ' || (g %% %(e)s + 1) END
+        FROM generate_series(1, %(c)s) g
+    """, {"e": ELECTIONS, "c": CANDIDATES})
+    cur.execute("""
+        INSERT INTO old_voting_tokens (token, batch_id)
+        SELECT lpad(g::text, 7, '0'), 'B-' || (g / 1000) FROM generate_series(1, %s) g
+    """, (TOKENS,))
+    cur.execute("""
+        INSERT INTO old_token_elections (token_id, election_id)
+        SELECT t.id, ((t.id / 1000 * %(k)s + k) %% %(e)s + 1)::text
+        FROM old_voting_tokens t, generate_series(0, %(k)s - 1) k
+    """, {"e": ELECTIONS, "k": ELECTIONS_PER_TOKEN})
+
+    # New shape: integer foreign keys plus the indexes created by init_db
+    cur.execute("CREATE TABLE new_candidates (id SERIAL PRIMARY KEY, name TEXT, election_id INTEGER REFERENCES elections(id), vote_count INTEGER DEFAULT 0)")
+    cur.execute("CREATE TABLE new_voting_tokens (id SERIAL PRIMARY KEY, token TEXT UNIQUE NOT NULL, batch_id TEXT)")
+    cur.execute("CREATE TABLE new_token_elections (id SERIAL PRIMARY KEY, token_id INTEGER REFERENCES new_voting_tokens(id), election_id INTEGER REFERENCES elections(id))")
+    cur.execute("""
+        INSERT INTO new_candidates (id, name, election_id)
+        SELECT c.id, c.name, COALESCE(e1.id, e2.id)
+        FROM old_candidates c
+        LEFT JOIN elections e1 ON e1.id::text = c.election_id
+        LEFT JOIN elections e2 ON e2.name = c.election_id
+    """)
+    cur.execute("INSERT INTO new_voting_tokens SELECT * FROM old_voting_tokens")
+    cur.execute("INSERT INTO new_token_elections (token_id, election_id) SELECT token_id, election_id::integer FROM old_token_elections")
+    cur.execute("CREATE INDEX ON new_candidates (election_id)")
+    cur.execute("CREATE INDEX ON new_token_elections (token_id)")
+    cur.execute("CREATE INDEX ON new_token_elections (election_id)")
+    cur.execute("CREATE INDEX ON new_voting_tokens (batch_id)")
+    cur.execute("ANALYZE")
+
+def explain(cur, query, params):
+    best = None
+    for _ in range(5):
+        cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query, params)
+        row = cur.fetchone()
+        plan = list(row.values())[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        plan = plan[0]
+        if best is None or plan["Execution Time"] < best["Execution Time"]:
+            best = plan
+    return best
+
+def main():
+    conn = get_db_connection()
+    if not conn:
+        sys.exit(1)
+    cur = conn.cursor()
+    try:
+        print(f"Seeding: {ELECTIONS} elections, {CANDIDATES} candidates, {TOKENS} tokens x {ELECTIONS_PER_TOKEN} elections")
+        seed(cur)
+        params = {"token_id": TOKENS // 2, "token": str(TOKENS // 2).zfill(7)}
+        print(f"{'query':<24}{'before (ms)':>14}{'after (ms)':>14}   top plan node before -> after")
+        for name in OLD_QUERIES:
+            old = explain(cur, OLD_QUERIES[name], params)
+            new = explain(cur, NEW_QUERIES[name], params)
+            print(f"{name:<24}{old['Execution Time']:>14.3f}{new['Execution Time']:>14.3f}   "
+                  f"{old['Plan']['Node Type']} -> {new['Plan']['Node Type']}")
+    finally:
+        conn.rollback()
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    main()
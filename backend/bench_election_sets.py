@@ -0,0 +1,122 @@
+"""Per-token token_elections rows vs. batch-level election sets, for one batch of TOKENS tokens
+eligible for ELECTIONS elections.
+
+Seeds the batch once and stores its eligibility both ways: in a copy of the old junction table
+(one row per token per election) and as one election set. Reports rows and on-disk size of each
+layout, then median times of the token-side joins:
+  login      the candidates a token may vote for (token_login, /candidates?token=)
+  admin      the elections of every batch (/admin/get-tokens)
+  eligible   how many tokens may vote in one election
+Everything is removed afterwards.
+Run: python bench_election_sets.py
+"""
+import random
+import statistics
+import time
+
+from database import _connect, resolve_election_set
+
+TOKENS = 50_000
+ELECTIONS = 6
+CANDIDATES_PER_ELECTION = 5
+RUNS = 200
+BATCH = "BENCH-SETS"
+
+QUERIES = {
+    "login": (
+        """SELECT c.id FROM voting_tokens vt
+           JOIN bench_token_elections te ON te.token_id = vt.id
+           JOIN candidates c ON c.election_id = te.election_id
+           WHERE vt.token = %s""",
+        """SELECT c.id FROM voting_tokens vt
+           JOIN election_set_members m ON m.set_id = vt.election_set_id
+           JOIN candidates c ON c.election_id = m.election_id
+           WHERE vt.token = %s""",
+    ),
+    "admin": (
+        """SELECT vt.batch_id, e.id FROM voting_tokens vt
+           JOIN bench_token_elections te ON vt.id = te.token_id
+           JOIN elections e ON e.id = te.election_id
+           WHERE vt.batch_id = %s
+           GROUP BY vt.batch_id, e.id""",
+        """SELECT b.batch_id, e.id FROM (SELECT DISTINCT batch_id, election_set_id FROM voting_tokens WHERE batch_id = %s) b
+           JOIN election_set_members m ON m.set_id = b.election_set_id
+           JOIN elections e ON e.id = m.election_id
+           GROUP BY b.batch_id, e.id""",
+    ),
+    "eligible": (
+        "SELECT COUNT(*) FROM bench_token_elections te WHERE te.election_id = %s",
+        """SELECT COUNT(*) FROM voting_tokens vt
+           WHERE vt.election_set_id IN (SELECT m.set_id FROM election_set_members m WHERE m.election_id = %s)""",
+    ),
+}
+
+def timed(cur, query, args):
+    times = []
+    for a in args:
+        start = time.perf_counter()
+        cur.execute(query, (a,))
+        cur.fetchall()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+def bench():
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO elections (name, start_date, end_date) SELECT 'BENCH-SETS-' || g, now(), now() FROM generate_series(1, %s) g RETURNING id
+    """, (ELECTIONS,))
+    election_ids = [r['id'] for r in cur.fetchall()]
+    try:
+        cur.execute("""
+            INSERT INTO candidates (name, position, party, election_id)
+            SELECT 'Bench ' || g, 'P', 'B', e FROM unnest(%s::int[]) e, generate_series(1, %s) g
+        """, (election_ids, CANDIDATES_PER_ELECTION))
+        set_id = resolve_election_set(cur, election_ids)
+        cur.execute("""
+            INSERT INTO voting_tokens (token, batch_id, election_set_id)
+            SELECT 'BS' || lpad(g::text, 8, '0'), %s, %s FROM generate_series(1, %s) g RETURNING id, token
+        """, (BATCH, set_id, TOKENS))
+        tokens = cur.fetchall()
+        cur.execute("""
+            CREATE TABLE bench_token_elections (
+                id SERIAL PRIMARY KEY,
+                token_id INTEGER REFERENCES voting_tokens(id) ON DELETE CASCADE,
+                election_id INTEGER REFERENCES elections(id) ON DELETE CASCADE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.execute("INSERT INTO bench_token_elections (token_id, election_id) SELECT t, e FROM unnest(%s::int[]) t, unnest(%s::int[]) e",
+                    ([t['id'] for t in tokens], election_ids))
+        cur.execute("CREATE INDEX ON bench_token_elections (token_id)")
+        cur.execute("CREATE INDEX ON bench_token_elections (election_id)")
+        cur.execute("ANALYZE bench_token_elections")
+        cur.execute("ANALYZE voting_tokens")
+        conn.commit()
+
+        cur.execute("SELECT COUNT(*) AS n, pg_total_relation_size('bench_token_elections') AS size FROM bench_token_elections")
+        old = cur.fetchone()
+        cur.execute("SELECT COUNT(*) AS n FROM election_set_members WHERE set_id = %s", (set_id,))
+        members = cur.fetchone()['n']
+        print(f"{TOKENS} tokens x {ELECTIONS} elections")
+        print(f"token_elections: {old['n']} rows, {old['size'] / 1e6:.1f} MB")
+        print(f"election sets:   1 set + {members} member rows (+ election_set_id on each token)")
+
+        sample = [t['token'] for t in random.sample(tokens, RUNS)]
+        args = {"login": sample, "admin": [BATCH] * 20, "eligible": [election_ids[0]] * 20}
+        print(f"{'query':<10} {'token_elections':>16} {'election sets':>14}")
+        for name, (old_sql, new_sql) in QUERIES.items():
+            print(f"{name:<10} {timed(cur, old_sql, args[name]):>13.3f} ms {timed(cur, new_sql, args[name]):>11.3f} ms")
+    finally:
+        conn.rollback()
+        cur.execute("DROP TABLE IF EXISTS bench_token_elections")
+        cur.execute("DELETE FROM voting_tokens WHERE batch_id = %s", (BATCH,))
+        cur.execute("DELETE FROM candidates WHERE election_id = ANY(%s)", (election_ids,))
+        cur.execute("DELETE FROM elections WHERE id = ANY(%s)", (election_ids,))
+        cur.execute("DELETE FROM election_sets s WHERE NOT EXISTS (SELECT 1 FROM election_set_members m WHERE m.set_id = s.id)"
+                    " AND NOT EXISTS (SELECT 1 FROM voting_tokens vt WHERE vt.election_set_id = s.id)")
+        conn.commit()
+        conn.close()
+
+if __name__ == "__main__":
+    bench()
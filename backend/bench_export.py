@@ -0,0 +1,71 @@
+"""Worker memory while exporting TOKENS tokens: streamed exports vs. the fetchall() /tokens list.
+
+Starts one uvicorn worker on BENCH_PORT, seeds TOKENS tokens in their own batch, downloads
+/admin/export/tokens in every available format and finally the old /tokens JSON list, reading
+the worker's peak RSS (VmHWM) after each. The streamed exports run first since the peak only grows.
+Run: python bench_export.py
+"""
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+import psycopg2
+
+from database import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+from exports import export_formats
+
+TOKENS = 1_000_000
+BATCH = "BENCH-EXPORT"
+BENCH_PORT = 8766
+BASE = f"http://127.0.0.1:{BENCH_PORT}"
+
+def rss_mb(pid, field):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+
+def download(client, url, params):
+    start = time.perf_counter()
+    size = 0
+    with client.stream("GET", url, params=params) as r:
+        r.raise_for_status()
+        for chunk in r.iter_bytes():
+            size += len(chunk)
+    return time.perf_counter() - start, size
+
+def bench():
+    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO voting_tokens (token, batch_id)
+        SELECT 'BX' || lpad(g::text, 8, '0'), %s FROM generate_series(1, %s) g
+    """, (BATCH, TOKENS))
+    conn.commit()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(BENCH_PORT), "--log-level", "warning"],
+                              stdout=subprocess.DEVNULL)
+    try:
+        with httpx.Client(base_url=BASE, timeout=600) as client:
+            for _ in range(100):
+                try:
+                    client.get("/admin/db-pool")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.2)
+            print(f"{TOKENS} tokens, worker RSS at start {rss_mb(server.pid, 'VmRSS'):.0f} MB")
+            runs = [(f"export {fmt}", "/admin/export/tokens", {"format": fmt, "batch_id": BATCH}) for fmt in export_formats()]
+            runs.append(("/tokens (fetchall JSON)", "/tokens", None))
+            for label, url, params in runs:
+                took, size = download(client, url, params)
+                print(f"{label:<24} {took:>6.1f} s {size / 1e6:>8.1f} MB  peak RSS {rss_mb(server.pid, 'VmHWM'):>6.0f} MB")
+    finally:
+        server.terminate()
+        server.wait()
+        cur.execute("DELETE FROM voting_tokens WHERE batch_id = %s", (BATCH,))
+        conn.commit()
+        conn.close()
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,71 @@
+"""Candidate photo variants: bytes a voter downloads, and time to make them (no database).
+
+Writes PHOTOS camera-sized JPEGs (PHOTO_SIZE pixels, a gradient with some grain; real photos
+keep more detail when shrunk, so expect their variants to be a few times larger) to a temp
+directory, then makes their IMAGE_VARIANTS with image_variants.make_variants: one photo at a
+time in this process, as the upload pool does, and all of them through a process pool of 1 and
+of IMAGE_BACKFILL_WORKERS processes, as the backfill job does. Reports the bytes a /candidates
+list of PHOTOS candidates costs a phone with the originals vs. each variant, ms per photo, and
+backfill photos per second.
+Run: python bench_image_variants.py
+"""
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from image_variants import IMAGE_BACKFILL_WORKERS, IMAGE_VARIANT_FORMAT, IMAGE_VARIANTS, make_variants, variant_filename
+
+PHOTOS = 30
+PHOTO_SIZE = (3000, 4000)
+
+def camera_photo(seed):
+    gradient = Image.linear_gradient("L").rotate(seed * 12).resize(PHOTO_SIZE)
+    grain = Image.effect_noise(PHOTO_SIZE, 12)
+    img = Image.merge("RGB", (gradient, Image.blend(gradient, grain, 0.3), grain))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+def backfill_rate(paths, workers):
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        list(executor.map(make_variants, paths[:workers]))  # start the processes first
+        start = time.perf_counter()
+        list(executor.map(make_variants, paths))
+        return len(paths) / (time.perf_counter() - start)
+
+def bench():
+    directory = tempfile.mkdtemp()
+    try:
+        paths = []
+        for i in range(PHOTOS):
+            path = os.path.join(directory, f"cand_{i}.jpg")
+            with open(path, "wb") as f:
+                f.write(camera_photo(i))
+            paths.append(path)
+
+        start = time.perf_counter()
+        for path in paths:
+            make_variants(path)
+        per_photo = (time.perf_counter() - start) / PHOTOS * 1000
+
+        original = sum(os.path.getsize(p) for p in paths)
+        print(f"{PHOTOS} candidates, {PHOTO_SIZE[0]}x{PHOTO_SIZE[1]} JPEG photos, {IMAGE_VARIANT_FORMAT} variants, "
+              f"{os.cpu_count()} CPUs")
+        print(f"{'original':<10} {original / 2**20:>8.2f} MB per list")
+        for name, size in IMAGE_VARIANTS:
+            total = sum(os.path.getsize(os.path.join(directory, variant_filename(os.path.basename(p), name))) for p in paths)
+            print(f"{name:<10} {total / 2**20:>8.2f} MB per list  ({size}px, {original / total:>5.0f}x smaller)")
+        print(f"making the variants: {per_photo:.0f} ms per photo in one thread")
+        for workers in sorted({1, IMAGE_BACKFILL_WORKERS}):
+            print(f"backfill, {workers} processes: {backfill_rate(paths, workers):>6.1f} photos/s")
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    bench()
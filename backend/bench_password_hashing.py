@@ -0,0 +1,124 @@
+"""bcrypt off the request path: /vote latency during a login storm.
+
+Runs the real app in-process (httpx ASGI transport) against the configured database, seeds
+LOGIN_USERS users (one bcrypt hash at BCRYPT_ROUNDS, shared) plus an election and voting tokens,
+and cleans them up afterwards. VOTERS voters vote one after another, VOTER_CONCURRENCY at a time:
+first with nothing else going on, then while STORM_CONCURRENCY clients log in over and over
+through /login, with the hashes in the threadpool (PASSWORD_HASH_WORKERS=0, as inline hashing
+did before) and in the process pool. Reports /vote p50 / p99, logins completed per second and
+503s, plus the pool's average hash time.
+Run: python bench_password_hashing.py
+"""
+import asyncio
+import time
+import uuid
+
+import httpx
+
+import main
+from database import get_db_connection, resolve_election_set
+from password_hashing import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, password_hasher, _hash
+
+LOGIN_USERS = 50
+VOTERS = 300
+VOTER_CONCURRENCY = 5
+STORM_CONCURRENCY = 50
+PASSWORD = "bench-password"
+
+def seed():
+    prefix = f"BENCH-{uuid.uuid4().hex[:8].upper()}"
+    hashed = _hash(PASSWORD, BCRYPT_ROUNDS)
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO users (username, email, password)
+        SELECT %s || '-' || g, %s || '-' || g || '@example.com', %s FROM generate_series(1, %s) g
+    """, (prefix, prefix, hashed, LOGIN_USERS))
+    cur.execute("""
+        INSERT INTO elections (name, start_date, end_date, status)
+        VALUES (%s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP + INTERVAL '1 day', 'active') RETURNING id
+    """, (prefix,))
+    election_id = cur.fetchone()['id']
+    cur.execute("INSERT INTO candidates (name, position, party, election_id) VALUES ('Bench', 'President', 'Bench', %s) RETURNING id",
+                (election_id,))
+    candidate_id = cur.fetchone()['id']
+    cur.execute("""
+        INSERT INTO voting_tokens (token, batch_id, election_set_id)
+        SELECT %s || '-' || g, %s, %s FROM generate_series(1, %s) g RETURNING token
+    """, (prefix, prefix, resolve_election_set(cur, [election_id]), VOTERS * 3))
+    tokens = [r['token'] for r in cur.fetchall()]
+    conn.commit()
+    cur.close()
+    conn.close()
+    return prefix, election_id, candidate_id, tokens
+
+def cleanup(prefix, election_id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM users WHERE username LIKE %s", (f"{prefix}-%",))
+    cur.execute("DELETE FROM candidates WHERE election_id = %s", (election_id,))
+    cur.execute("DELETE FROM voting_tokens WHERE batch_id = %s", (prefix,))
+    cur.execute("DELETE FROM elections WHERE id = %s", (election_id,))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+async def run(client, prefix, tokens, candidate_id, storm):
+    queue = list(tokens)
+    latencies, login_statuses = [], []
+    done = asyncio.Event()
+
+    async def voter():
+        while queue:
+            token = queue.pop()
+            start = time.perf_counter()
+            r = await client.post("/vote", json={"token": token, "candidateId": candidate_id})
+            latencies.append(time.perf_counter() - start)
+            r.raise_for_status()
+
+    async def login(i):
+        while not done.is_set():
+            r = await client.post("/login", json={"email": f"{prefix}-{i % LOGIN_USERS + 1}@example.com", "password": PASSWORD})
+            login_statuses.append(r.status_code)
+
+    logins = [asyncio.create_task(login(i)) for i in range(STORM_CONCURRENCY if storm else 0)]
+    start = time.perf_counter()
+    await asyncio.gather(*(voter() for _ in range(VOTER_CONCURRENCY)))
+    took = time.perf_counter() - start
+    done.set()
+    await asyncio.gather(*logins)
+    latencies.sort()
+    return {
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p99": latencies[int(len(latencies) * 0.99)] * 1000,
+        "logins": login_statuses.count(200) / took,
+        "busy": login_statuses.count(503),
+    }
+
+async def bench():
+    prefix, election_id, candidate_id, tokens = seed()
+    await main.startup_event()
+    try:
+        print(f"{VOTERS} votes ({VOTER_CONCURRENCY} at a time) per run, storm of {STORM_CONCURRENCY} looping /login clients, "
+              f"bcrypt rounds {BCRYPT_ROUNDS}, engine={main.DB_ENGINE}")
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            runs = (("no storm", None), ("storm, threadpool", 0), (f"storm, {PASSWORD_HASH_WORKERS} processes", PASSWORD_HASH_WORKERS))
+            for n, (label, workers) in enumerate(runs):
+                if workers is not None:
+                    await password_hasher.stop()
+                    password_hasher.workers = workers
+                    await password_hasher.start()
+                before = password_hasher.stats()
+                r = await run(client, prefix, tokens[n * VOTERS:(n + 1) * VOTERS], candidate_id, workers is not None)
+                after = password_hasher.stats()
+                hashes = after['completed'] - before['completed']
+                hash_ms = (after['avgMs'] * after['completed'] - before['avgMs'] * before['completed']) / hashes if hashes else 0.0
+                print(f"{label:<22} /vote p50 {r['p50']:>7.1f} ms  p99 {r['p99']:>7.1f} ms  "
+                      f"logins {r['logins']:>5.1f}/s  503s {r['busy']:>4}  avg wait for hash {hash_ms:>6.1f} ms")
+    finally:
+        await main.shutdown_event()
+        cleanup(prefix, election_id)
+
+if __name__ == "__main__":
+    asyncio.run(bench())
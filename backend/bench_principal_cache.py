@@ -0,0 +1,111 @@
+"""Principal cache: /users/me latency with and without the bearer-token cache.
+
+Registers USERS users, logs each in once, then runs the real app in-process (httpx ASGI transport)
+against the configured database: REQUESTS authenticated /users/me calls spread over the users'
+tokens, CONCURRENCY at a time, with the cache off and on. Reports requests per second, p50 / p99
+latency, the per-request time saved, pool checkouts and the cache's hit rate. Also times the two
+steps a hit skips on their own: JWT verification and the users lookup. The users are removed
+afterwards.
+Run: python bench_principal_cache.py
+"""
+import asyncio
+import random
+import time
+import uuid
+
+import httpx
+from jose import jwt
+
+import main
+from database import get_db_connection
+from principal_cache import principal_cache
+
+USERS = 20
+REQUESTS = 5000
+CONCURRENCY = 20
+
+def cleanup(prefix):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM users WHERE email LIKE %s", (f"{prefix}%",))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+def sync_checkouts():
+    return main.db_pool.stats()["checkouts"]
+
+def per_call_us(fn, runs=2000):
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - start) / runs * 1e6
+
+async def run(client, tokens):
+    latencies = []
+    remaining = [REQUESTS]
+
+    async def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            token = random.choice(tokens)
+            start = time.perf_counter()
+            r = await client.get("/users/me", headers={"Authorization": f"Bearer {token}"})
+            latencies.append(time.perf_counter() - start)
+            r.raise_for_status()
+
+    checkouts = sync_checkouts()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    took = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": REQUESTS / took,
+        "mean": sum(latencies) / len(latencies) * 1000,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p99": latencies[int(len(latencies) * 0.99)] * 1000,
+        "checkouts": sync_checkouts() - checkouts,
+    }
+
+async def bench():
+    prefix = f"bench-{uuid.uuid4().hex[:8]}-"
+    await main.startup_event()
+    try:
+        for _ in range(100):
+            if principal_cache.ready:
+                break
+            await asyncio.sleep(0.05)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            tokens = []
+            for i in range(USERS):
+                email = f"{prefix}{i}@example.com"
+                (await client.post("/register", json={"username": email, "email": email, "password": "bench"})).raise_for_status()
+                r = await client.post("/login", json={"email": email, "password": "bench"})
+                r.raise_for_status()
+                tokens.append(r.json()["accessToken"])
+
+            conn = get_db_connection()
+            cur = conn.cursor()
+            decode_us = per_call_us(lambda: jwt.decode(tokens[0], main.SECRET_KEY, algorithms=[main.ALGORITHM]))
+            query_us = per_call_us(lambda: (cur.execute("SELECT * FROM users WHERE email = %s", (f"{prefix}0@example.com",)), cur.fetchone()), runs=500)
+            conn.close()
+            print(f"{USERS} users, {REQUESTS} /users/me requests, {CONCURRENCY} concurrent, engine={main.DB_ENGINE}")
+            print(f"skipped on a hit: jwt.decode {decode_us:.0f} us + users lookup {query_us:.0f} us (direct connection)")
+
+            results = {}
+            for label, on in (("cache off", False), ("cache on", True)):
+                principal_cache.clear()
+                principal_cache.ready = on
+                results[label] = r = await run(client, tokens)
+                print(f"{label:<10} {r['rps']:>7.0f} req/s  mean {r['mean']:>6.2f} ms  p50 {r['p50']:>6.2f} ms  "
+                      f"p99 {r['p99']:>6.2f} ms  pool checkouts {r['checkouts']:>5}")
+            stats = principal_cache.stats()
+            print(f"saved per request: {results['cache off']['mean'] - results['cache on']['mean']:.2f} ms mean, "
+                  f"hit rate {stats['hitRate']:.3f} ({stats['hits']} hits / {stats['misses']} misses)")
+    finally:
+        await main.shutdown_event()
+        cleanup(prefix)
+
+if __name__ == "__main__":
+    asyncio.run(bench())
@@ -0,0 +1,100 @@
+"""Cost of building the /admin/results JSON body for 500 elections and 10k candidates, three ways.
+
+  nested scan   the original code: fetch all rows, then scan every candidate for every election
+  hash group    fetch all rows, group them in one pass over a dict
+  grouped SQL   results_cache's single query: Postgres groups, totals, orders and builds the
+                candidates JSON, which is spliced into the body unparsed
+
+Seeds its own elections and candidates (with random vote counts) and removes them afterwards.
+Run: python bench_results_aggregation.py
+"""
+import asyncio
+import json
+import statistics
+import time
+from collections import defaultdict
+
+import asyncpg
+
+from async_database import AsyncSession
+from database import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+from results_cache import ResultsCache
+from vote_counters import VOTE_COUNT_SQL
+
+ELECTIONS = 500
+CANDIDATES = 10_000
+RUNS = 15
+
+ELECTIONS_SQL = "SELECT id, name, description, status, created_at FROM elections ORDER BY created_at DESC"
+CANDIDATES_SQL = f"""
+    SELECT c.id, c.name, c.position, c.party, c.election_id::text AS election_id, c.image_url, {VOTE_COUNT_SQL} AS vote_count, c.image_url as image
+    FROM candidates c
+    ORDER BY vote_count DESC
+"""
+
+async def nested_scan(db):
+    elections = await db.fetch(ELECTIONS_SQL)
+    all_candidates = await db.fetch(CANDIDATES_SQL)
+    results = []
+    for e in elections:
+        e_id = str(e['id'])
+        candidates = [c for c in all_candidates if c['election_id'] == e_id]
+        results.append({"electionId": e['id'], "totalVotes": sum(c['vote_count'] for c in candidates), "candidates": candidates})
+    return json.dumps(results, default=str)
+
+async def hash_group(db):
+    elections = await db.fetch(ELECTIONS_SQL)
+    by_election = defaultdict(list)
+    for c in await db.fetch(CANDIDATES_SQL):
+        by_election[c['election_id']].append(c)
+    results = []
+    for e in elections:
+        candidates = by_election.get(str(e['id']), [])
+        results.append({"electionId": e['id'], "totalVotes": sum(c['vote_count'] for c in candidates), "candidates": candidates})
+    return json.dumps(results, default=str)
+
+async def grouped_sql(db):
+    cache = ResultsCache(ttl=0)
+    entries = await cache._load_entries(db)
+    return cache.render(entries, "bench", lambda e: {"electionId": e['id'], "totalVotes": e['totalVotes']})
+
+async def timed(fn, db):
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = await fn(db)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+async def bench():
+    conn = await asyncpg.connect(database=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=int(DB_PORT))
+    db = AsyncSession(conn)
+    election_ids = [r['id'] for r in await conn.fetch("""
+        INSERT INTO elections (name, start_date, end_date, status)
+        SELECT 'BENCH-AGG-' || g, now(), now() + interval '1 day', 'active' FROM generate_series(1, $1) g RETURNING id
+    """, ELECTIONS)]
+    await conn.execute("""
+        INSERT INTO candidates (name, position, party, election_id, vote_count)
+        SELECT 'Bench ' || g, 'Member', 'Bench', ($1::int[])[1 + g % cardinality($1::int[])], (random() * 1000)::int
+        FROM generate_series(1, $2) g
+    """, election_ids, CANDIDATES)
+    await conn.execute("ANALYZE candidates")
+    try:
+        elections = await conn.fetchval("SELECT COUNT(*) FROM elections")
+        candidates = await conn.fetchval("SELECT COUNT(*) FROM candidates")
+        print(f"{elections} elections, {candidates} candidates (median of {RUNS} runs)")
+        baseline = None
+        for label, fn in (("nested scan", nested_scan), ("hash group", hash_group), ("grouped SQL", grouped_sql)):
+            took, body = await timed(fn, db)
+            totals = {r['electionId']: (r['totalVotes'], [c['vote_count'] for c in r['candidates']]) for r in json.loads(body)}
+            if baseline is None:
+                baseline = totals
+            assert totals == baseline, f"{label} totals differ"
+            print(f"{label:<12} {took * 1000:>9.1f} ms")
+    finally:
+        await conn.execute("DELETE FROM candidates WHERE election_id = ANY($1::int[])", election_ids)
+        await conn.execute("DELETE FROM elections WHERE id = ANY($1::int[])", election_ids)
+        await conn.close()
+
+if __name__ == "__main__":
+    asyncio.run(bench())
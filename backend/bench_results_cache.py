@@ -0,0 +1,54 @@
+"""/results and /admin/results requests per second with and without the results cache.
+
+Runs the real app in-process (httpx ASGI transport) against whatever elections are in the configured
+database.
+Run: python bench_results_cache.py
+"""
+import asyncio
+import time
+
+import httpx
+
+import main
+from results_cache import results_cache
+
+REQUESTS = 3000
+CONCURRENCY = 100
+
+async def run(client, path):
+    remaining = [REQUESTS]
+    statuses = []
+
+    async def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            r = await client.get(path)
+            statuses.append(r.status_code)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return REQUESTS / (time.perf_counter() - start), statuses.count(200)
+
+async def bench():
+    await main.startup_event()
+    ttl = results_cache.ttl
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            elections = len((await client.get("/admin/results")).json())
+            print(f"{REQUESTS} requests, {CONCURRENCY} concurrent clients, {elections} elections, engine={main.DB_ENGINE}")
+            for path in ("/results", "/admin/results"):
+                for label, cache_ttl in (("no cache", 0), (f"cache ttl={ttl:g}s", ttl)):
+                    results_cache.ttl = cache_ttl
+                    results_cache.invalidate()
+                    before = results_cache.stats()
+                    rate, ok = await run(client, path)
+                    after = results_cache.stats()
+                    print(f"{path:<16} {label:<16} {rate:>8.0f} req/s  ok={ok}  "
+                          f"hits={after['hits'] - before['hits']} misses={after['misses'] - before['misses']}")
+    finally:
+        results_cache.ttl = ttl
+        await main.shutdown_event()
+
+if __name__ == "__main__":
+    asyncio.run(bench())
@@ -0,0 +1,99 @@
+"""Idle /results/stream connections per worker, and how fast a vote reaches all of them.
+
+Starts one uvicorn worker on BENCH_PORT, seeds its own election, opens SUBSCRIBERS Server-Sent
+Events connections, then casts VOTES votes and records when each subscriber sees the delta.
+Reports the worker's memory per connection, delivery latency and broadcaster counters.
+Run: python bench_results_stream.py
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+SUBSCRIBERS = 2000
+VOTES = 5
+BENCH_PORT = 8765
+BASE = f"http://127.0.0.1:{BENCH_PORT}"
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+
+async def subscribe(election_id, deltas, ready):
+    reader, writer = await asyncio.open_connection("127.0.0.1", BENCH_PORT)
+    writer.write(f"GET /results/stream?electionIds={election_id} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+    await writer.drain()
+    event = None
+    try:
+        while True:
+            line = (await reader.readline()).decode()
+            if not line:
+                return
+            if line.startswith("event: "):
+                event = line[7:].strip()
+                if event == "snapshot":
+                    ready.append(1)
+            elif line.startswith("data: ") and event == "delta":
+                deltas.append((time.perf_counter(), json.loads(line[6:])))
+    finally:
+        writer.close()
+
+async def bench():
+    env = dict(os.environ, RESULTS_STREAM_INTERVAL_MS=os.environ.get("RESULTS_STREAM_INTERVAL_MS", "250"))
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(BENCH_PORT), "--log-level", "warning"],
+                              env=env, stdout=subprocess.DEVNULL)
+    client = httpx.AsyncClient(base_url=BASE, timeout=30)
+    election_id = None
+    try:
+        for _ in range(100):
+            try:
+                await client.get("/admin/results-stream")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+        election = (await client.post("/elections", json={"name": "BENCH-STREAM", "startDate": "2026-01-01T00:00:00",
+                                                          "endDate": "2026-12-31T00:00:00", "status": "active"})).json()
+        election_id = election['id']
+        candidate = (await client.post("/candidates", json={"name": "Bench", "position": "P", "party": "B",
+                                                            "electionId": str(election_id)})).json()
+        tokens = [t['token'] for t in (await client.post("/tokens/generate", json={"electionIds": [election_id], "count": VOTES})).json()['tokens']]
+
+        base_rss = rss_mb(server.pid)
+        deltas, ready = [], []
+        readers = [asyncio.create_task(subscribe(election_id, deltas, ready)) for _ in range(SUBSCRIBERS)]
+        while len(ready) < SUBSCRIBERS:
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(1)
+        rss = rss_mb(server.pid)
+        print(f"{SUBSCRIBERS} idle subscribers: worker RSS {base_rss:.0f} MB -> {rss:.0f} MB "
+              f"({(rss - base_rss) * 1024 / SUBSCRIBERS:.1f} KB per connection)")
+
+        latencies = []
+        for token in tokens:
+            deltas.clear()
+            sent = time.perf_counter()
+            await client.post("/vote", json={"token": token, "candidateId": candidate['id']})
+            while len(deltas) < SUBSCRIBERS and time.perf_counter() - sent < 10:
+                await asyncio.sleep(0.01)
+            latencies.append(sorted(t - sent for t, _ in deltas))
+        for i, lat in enumerate(latencies, 1):
+            print(f"vote {i}: delivered to {len(lat)}/{SUBSCRIBERS}, first {lat[0] * 1000:.0f} ms, "
+                  f"median {lat[len(lat) // 2] * 1000:.0f} ms, last {lat[-1] * 1000:.0f} ms")
+        print("broadcaster:", (await client.get("/admin/results-stream")).json())
+        for r in readers:
+            r.cancel()
+    finally:
+        if election_id is not None:
+            await client.delete(f"/elections/{election_id}")
+        await client.aclose()
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    asyncio.run(bench())
@@ -0,0 +1,94 @@
+"""Roster onboarding: /register one user at a time vs. roster_import's bulk path.
+
+Registers REGISTER_USERS users through /register (the real app in-process, httpx ASGI transport,
+one request after another as a script would), then writes a ROSTER-row CSV to a temp file and
+imports it with roster_import.import_roster on one connection. Both hash at ROUNDS (each bcrypt
+round doubles the cost; the import's hashes are upgraded to BCRYPT_ROUNDS at first login).
+Reports users per second, the projected time for a 30k roster, and the process's peak RSS before
+and after the import (the roster is streamed, so it should not move). The users are removed
+afterwards.
+Run: python bench_roster_import.py
+"""
+import asyncio
+import os
+import resource
+import tempfile
+import time
+import uuid
+
+import httpx
+
+import main
+from database import get_db_connection
+from password_hashing import password_hasher
+from roster_import import ROSTER_IMPORT_CHUNK, ROSTER_IMPORT_WORKERS, ImportJob, import_roster
+
+REGISTER_USERS = 100
+ROSTER = 5_000
+ROUNDS = 8
+PROJECTED = 30_000
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def cleanup(prefix):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM users WHERE username LIKE %s", (f"{prefix}%",))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+async def register_one_by_one(prefix):
+    await main.startup_event()
+    password_hasher.rounds = ROUNDS
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            start = time.perf_counter()
+            for i in range(REGISTER_USERS):
+                r = await client.post("/register", json={"username": f"{prefix}r{i}", "email": f"{prefix}r{i}@example.com",
+                                                         "password": f"pw-{i}"})
+                r.raise_for_status()
+            return time.perf_counter() - start
+    finally:
+        await main.shutdown_event()
+
+def bulk_import(prefix):
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    with os.fdopen(fd, "w") as f:
+        f.write("username,email,password\n")
+        for i in range(ROSTER):
+            f.write(f"{prefix}b{i},{prefix}b{i}@example.com,pw-{i}\n")
+    conn = get_db_connection()
+    try:
+        job = ImportJob("bench", "csv", ROUNDS)
+        with open(path, newline="") as lines:
+            import_roster(conn, lines, "csv", job, ROUNDS)
+        return job.to_dict()
+    finally:
+        conn.close()
+        os.unlink(path)
+
+def bench():
+    prefix = f"roster-{uuid.uuid4().hex[:6]}-"
+    try:
+        took = asyncio.run(register_one_by_one(prefix))
+        rate = REGISTER_USERS / took
+        print(f"bcrypt rounds {ROUNDS}, {os.cpu_count()} CPUs")
+        print(f"{'/register one by one':<24} {REGISTER_USERS:>6} users {took:>7.1f} s {rate:>8.1f} users/s  "
+              f"30k roster ~{PROJECTED / rate / 60:>6.1f} min")
+        before = peak_rss_mb()
+        report = bulk_import(prefix)
+        rate = report['imported'] / (report['elapsedMs'] / 1000)
+        print(f"{'bulk import':<24} {report['imported']:>6} users {report['elapsedMs'] / 1000:>7.1f} s {rate:>8.1f} users/s  "
+              f"30k roster ~{PROJECTED / rate / 60:>6.1f} min  ({ROSTER_IMPORT_WORKERS} hashing processes, "
+              f"{ROSTER_IMPORT_CHUNK} rows/chunk; waiting on hashes {report['hashSeconds']:.1f} s, writing {report['writeSeconds']:.1f} s)")
+        print(f"{'  COPY + merge alone':<24} {report['imported'] / report['writeSeconds']:>29.0f} users/s "
+              f"(the rest is bcrypt, which scales with the hashing processes)")
+        print(f"peak RSS {before:.0f} MB before the import, {peak_rss_mb():.0f} MB after")
+    finally:
+        cleanup(prefix)
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,93 @@
+"""Token administration: the all-tokens /admin/get-tokens vs. batch summaries + keyset pages.
+
+Seeds BATCHES batches of TOKENS_PER_BATCH tokens (USED_SHARE of them marked used) and runs the
+real app in-process (httpx ASGI transport). Times /admin/token-batches, the first and a deep page
+of /admin/token-batches/{id}/tokens (all / used / unused), and finally /admin/get-tokens, with
+response sizes and the process's peak RSS after each (the new endpoints run first since the peak
+only grows). Everything is removed afterwards.
+Run: python bench_token_admin.py
+"""
+import asyncio
+import resource
+import time
+
+import httpx
+
+import main
+from database import _connect
+
+BATCHES = 4
+TOKENS_PER_BATCH = 250_000
+USED_SHARE = 0.3
+PAGE = 100
+DEEP_PAGES = 500  # the "deep" page starts DEEP_PAGES * PAGE tokens into the batch
+BATCH = "BENCH-ADMIN-{}"
+
+def seed():
+    conn = _connect()
+    cur = conn.cursor()
+    for b in range(BATCHES):
+        cur.execute("""
+            INSERT INTO voting_tokens (token, batch_id, is_used, used_at)
+            SELECT 'BA' || %s || lpad(g::text, 7, '0'), %s, g %% 10 < %s, CASE WHEN g %% 10 < %s THEN now() END
+            FROM generate_series(1, %s) g
+        """, (b, BATCH.format(b), USED_SHARE * 10, USED_SHARE * 10, TOKENS_PER_BATCH))
+    conn.commit()
+    cur.execute("ANALYZE voting_tokens")
+    conn.commit()
+    cur.execute("SELECT COUNT(*) AS n FROM voting_tokens")
+    total = cur.fetchone()['n']
+    conn.close()
+    return total
+
+def cleanup():
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM voting_tokens WHERE batch_id LIKE 'BENCH-ADMIN-%'")
+    conn.commit()
+    conn.close()
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def timed(client, url, params=None, runs=5):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        r = await client.get(url, params=params)
+        times.append(time.perf_counter() - start)
+        r.raise_for_status()
+    times.sort()
+    return times[len(times) // 2] * 1000, len(r.content), r.json()
+
+async def bench():
+    total = seed()
+    await main.startup_event()
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+            print(f"{total} tokens in the database ({BATCHES} x {TOKENS_PER_BATCH} seeded), peak RSS {peak_rss_mb():.0f} MB")
+
+            def report(label, ms, size):
+                print(f"{label:<40} {ms:>9.1f} ms {size / 1e3:>10.1f} KB  peak RSS {peak_rss_mb():>6.0f} MB")
+
+            ms, size, _ = await timed(client, "/admin/token-batches")
+            report("/admin/token-batches (summary)", ms, size)
+            url = f"/admin/token-batches/{BATCH.format(0)}/tokens"
+            for status in (None, "used", "unused"):
+                params = {"limit": PAGE, **({"status": status} if status else {})}
+                ms, size, page = await timed(client, url, params)
+                report(f"batch tokens {status or 'all'}, first page", ms, size)
+                # Walk to the deep page through the cursors, then time that page alone
+                for _ in range(DEEP_PAGES):
+                    page = (await client.get(url, params={**params, "after": page['nextCursor']})).json()
+                ms, size, _ = await timed(client, url, {**params, "after": page['nextCursor']})
+                report(f"batch tokens {status or 'all'}, page {DEEP_PAGES + 2}", ms, size)
+            ms, size, _ = await timed(client, "/admin/get-tokens", runs=1)
+            report("/admin/get-tokens (every token)", ms, size)
+    finally:
+        await main.shutdown_event()
+        cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(bench())
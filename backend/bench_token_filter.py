@@ -0,0 +1,87 @@
+"""Token membership filter: memory and false positives for TOKENS tokens, and rejected guesses per second.
+
+1. In memory (no database): adds TOKENS distinct 9-digit codes to a Bloom filter sized exactly for
+   them and one sized as the server does (TOKEN_FILTER_HEADROOM), then probes TOKENS codes that
+   were never added. Reports bytes, hash count, measured vs. expected false-positive rate, build
+   and lookup time, next to a Python set of the same codes.
+2. Through the real app (httpx ASGI transport, configured database): GUESSES random codes sent to
+   /tokens/login with the filter off (every guess is a voting_tokens lookup) and on. Admission
+   control is switched off, since all guesses come from one client and would be rate limited.
+Run: python bench_token_filter.py
+"""
+import asyncio
+import random
+import sys
+import time
+
+import httpx
+
+from token_filter import TOKEN_FILTER_FP_RATE, TOKEN_FILTER_HEADROOM, BloomFilter
+
+TOKENS = 1_000_000
+GUESSES = 3000
+CONCURRENCY = 50
+
+def in_memory():
+    codes = random.sample(range(10 ** 9), 2 * TOKENS)
+    members = [f"{c:09d}" for c in codes[:TOKENS]]
+    others = [f"{c:09d}" for c in codes[TOKENS:]]
+
+    plain = set(members)
+    set_bytes = sys.getsizeof(plain) + sum(sys.getsizeof(m) for m in members)
+    print(f"{TOKENS} tokens, target fp rate {TOKEN_FILTER_FP_RATE}")
+    print(f"{'python set':<26} {set_bytes / 1e6:>8.1f} MB")
+    for label, capacity in (("bloom, exact capacity", TOKENS), (f"bloom, {TOKEN_FILTER_HEADROOM:g}x headroom", int(TOKENS * TOKEN_FILTER_HEADROOM))):
+        bloom = BloomFilter(capacity, TOKEN_FILTER_FP_RATE)
+        start = time.perf_counter()
+        bloom.update(members)
+        built = time.perf_counter() - start
+        assert all(m in bloom for m in members[:10000])  # never a false "no"
+        start = time.perf_counter()
+        false_positives = sum(1 for o in others if o in bloom)
+        lookup_us = (time.perf_counter() - start) / len(others) * 1e6
+        print(f"{label:<26} {bloom.nbytes / 1e6:>8.1f} MB  k={bloom.hashes:<2}  fp {false_positives / len(others):.5f} "
+              f"(expected {bloom.expected_fp_rate():.5f})  build {built:.1f} s  lookup {lookup_us:.2f} us")
+
+async def through_app():
+    import main
+    from admission import admission
+    from token_filter import token_filter
+
+    await main.startup_event()
+    admission.enabled = False
+    try:
+        for _ in range(600):
+            if token_filter.ready:
+                break
+            await asyncio.sleep(0.1)
+        stats = token_filter.stats()
+        print(f"\n/tokens/login with {GUESSES} random guesses, {CONCURRENCY} concurrent clients, engine={main.DB_ENGINE}, "
+              f"{stats['unusedTokens']} unused tokens in the filter ({stats['bytes'] / 1e6:.1f} MB)")
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for label, ready in (("filter off", False), ("filter on", True)):
+                token_filter.ready = ready
+                guesses = [f"{random.randrange(10 ** 9):09d}" for _ in range(GUESSES)]
+                latencies, statuses = [], []
+
+                async def worker():
+                    while guesses:
+                        code = guesses.pop()
+                        start = time.perf_counter()
+                        r = await client.post("/tokens/login", json={"token": code})
+                        latencies.append(time.perf_counter() - start)
+                        statuses.append(r.status_code)
+
+                start = time.perf_counter()
+                await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+                took = time.perf_counter() - start
+                latencies.sort()
+                print(f"{label:<11} {GUESSES / took:>7.0f} req/s  p50 {latencies[len(latencies) // 2] * 1000:>6.2f} ms  "
+                      f"404s {statuses.count(404)}")
+    finally:
+        await main.shutdown_event()
+
+if __name__ == "__main__":
+    in_memory()
+    asyncio.run(through_app())
@@ -0,0 +1,82 @@
+"""Token batch generation: the old per-token loop vs. token_batches' COPY + set-based insert.
+
+Seeds ELECTIONS elections, then generates batches linked to all of them (plus BULK_COUNT linked
+to one). The per-token loop (a uniqueness SELECT, an INSERT and one junction-table INSERT per
+election for every token, into a copy of the old junction table) runs OLD_COUNT tokens only,
+since it is slow; the bulk engine runs OLD_COUNT and BULK_COUNT.
+Every batch is rolled back, so nothing is left behind.
+Run: python bench_token_generation.py
+"""
+import random
+import string
+import time
+
+from database import _connect, resolve_election_set
+from token_batches import BatchJob, generate_batch
+
+ELECTIONS = 5
+OLD_COUNT = 5_000
+BULK_COUNT = 100_000
+
+def per_token_loop(cur, election_ids, count):
+    for _ in range(count):
+        attempts = 0
+        while attempts < 10:
+            token_str = ''.join(random.choices(string.digits, k=6))
+            cur.execute("SELECT id FROM voting_tokens WHERE token = %s", (token_str,))
+            if not cur.fetchone():
+                break
+            attempts += 1
+        cur.execute("INSERT INTO voting_tokens (token, batch_id) VALUES (%s, %s) RETURNING id, token, created_at",
+                    (token_str, "BENCH-GEN"))
+        token_id = cur.fetchone()['id']
+        for eid in election_ids:
+            cur.execute("INSERT INTO bench_token_elections (token_id, election_id) VALUES (%s, %s)", (token_id, eid))
+
+def bulk(cur, election_ids, count):
+    job = BatchJob("BENCH-GEN", election_ids, count, resolve_election_set(cur, election_ids))
+    generate_batch(cur, job)
+    return job
+
+def bench():
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO elections (name, start_date, end_date) SELECT 'BENCH-GEN-' || g, now(), now() FROM generate_series(1, %s) g RETURNING id
+    """, (ELECTIONS,))
+    election_ids = [r['id'] for r in cur.fetchall()]
+    conn.commit()
+    # The per-token junction table that election sets replaced, for the old loop
+    cur.execute("""
+        CREATE TABLE bench_token_elections (
+            id SERIAL PRIMARY KEY,
+            token_id INTEGER REFERENCES voting_tokens(id) ON DELETE CASCADE,
+            election_id INTEGER REFERENCES elections(id) ON DELETE CASCADE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("CREATE INDEX ON bench_token_elections (token_id)")
+    cur.execute("CREATE INDEX ON bench_token_elections (election_id)")
+    conn.commit()
+    try:
+        cur.execute("SELECT COUNT(*) AS n FROM voting_tokens")
+        print(f"{cur.fetchone()['n']} existing tokens")
+        for label, fn, count, linked in (("per-token loop", per_token_loop, OLD_COUNT, ELECTIONS),
+                                         ("bulk COPY", bulk, OLD_COUNT, ELECTIONS),
+                                         ("bulk COPY", bulk, BULK_COUNT, ELECTIONS),
+                                         ("bulk COPY", bulk, BULK_COUNT, 1)):
+            start = time.perf_counter()
+            job = fn(cur, election_ids[:linked], count)
+            took = time.perf_counter() - start
+            conn.rollback()
+            extra = f", {job.collisions} collisions redrawn" if job else ""
+            print(f"{label:<15} {count:>7} tokens x {linked} elections {took:>7.2f} s  {count / took:>9.0f} tokens/s{extra}")
+    finally:
+        conn.rollback()
+        cur.execute("DROP TABLE IF EXISTS bench_token_elections")
+        cur.execute("DELETE FROM elections WHERE id = ANY(%s)", (election_ids,))
+        conn.commit()
+        conn.close()
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,63 @@
+"""Vote-counter throughput as concurrency rises: single-row candidates.vote_count vs. sharded slots.
+
+Each worker holds its own connection and commits one-vote transactions against a two-candidate
+race for a fixed time. Seeds its own election and removes it afterwards.
+Run: python bench_vote_counters.py
+"""
+import asyncio
+import random
+import time
+
+import asyncpg
+
+from database import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+from vote_counters import tally_sql
+
+CONCURRENCY_LEVELS = [1, 4, 16, 32, 64]
+SHARDS = 16
+SECONDS_PER_RUN = 3.0
+
+async def connect():
+    return await asyncpg.connect(database=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=int(DB_PORT))
+
+async def run(conns, candidate_ids, shards):
+    sql = tally_sql(shards=shards)
+    deadline = time.perf_counter() + SECONDS_PER_RUN
+    done = [0]
+
+    async def worker(conn):
+        while time.perf_counter() < deadline:
+            async with conn.transaction():
+                await conn.execute(sql, [random.choice(candidate_ids)], [1])
+            done[0] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(c) for c in conns))
+    return done[0] / (time.perf_counter() - start)
+
+async def bench():
+    admin = await connect()
+    election_id = await admin.fetchval("""
+        INSERT INTO elections (name, start_date, end_date) VALUES ('BENCH-COUNTERS', now(), now()) RETURNING id
+    """)
+    candidate_ids = [r['id'] for r in await admin.fetch("""
+        INSERT INTO candidates (name, position, party, election_id)
+        SELECT 'Bench ' || g, 'President', 'Bench', $1 FROM generate_series(1, 2) g RETURNING id
+    """, election_id)]
+    conns = [await connect() for _ in range(max(CONCURRENCY_LEVELS))]
+    try:
+        print(f"two-candidate race, {SECONDS_PER_RUN:.0f}s per run, {SHARDS} slots per candidate when sharded")
+        print(f"{'workers':>8}{'single row (tx/s)':>20}{'sharded (tx/s)':>18}")
+        for level in CONCURRENCY_LEVELS:
+            single = await run(conns[:level], candidate_ids, 0)
+            sharded = await run(conns[:level], candidate_ids, SHARDS)
+            print(f"{level:>8}{single:>20.0f}{sharded:>18.0f}")
+    finally:
+        for c in conns:
+            await c.close()
+        await admin.execute("DELETE FROM candidates WHERE election_id = $1", election_id)
+        await admin.execute("DELETE FROM elections WHERE id = $1", election_id)
+        await admin.close()
+
+if __name__ == "__main__":
+    asyncio.run(bench())
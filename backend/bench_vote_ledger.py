@@ -0,0 +1,95 @@
+"""Vote ledger: hot-path throughput against the single-row counter, and full recount cost vs. ledger size.
+
+Part 1 commits one-vote transactions from concurrent workers into a two-candidate race, either
+incrementing candidates.vote_count or appending to vote_ledger, then checks that the materialized
+totals match what was committed. Part 2 appends growing numbers of ledger rows and times a full
+recount. Seeds its own election and removes it afterwards. Run: python bench_vote_ledger.py
+"""
+import asyncio
+import random
+import time
+
+import asyncpg
+
+from async_database import AsyncSession
+from database import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+from vote_counters import tally_sql
+from vote_ledger import materialize, recount
+
+WORKERS = 64
+SECONDS_PER_RUN = 3.0
+RECOUNT_SIZES = [100_000, 200_000, 400_000, 800_000]
+
+LEDGER_SQL = """
+    INSERT INTO vote_ledger (election_id, candidate_id, token_id)
+    VALUES ($3, $1, $2)
+"""
+
+async def connect():
+    return await asyncpg.connect(database=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=int(DB_PORT))
+
+async def run(conns, candidate_ids, election_id, ledger):
+    sql = LEDGER_SQL if ledger else tally_sql(weighted=False)
+    deadline = time.perf_counter() + SECONDS_PER_RUN
+    done = [0]
+    voter = iter(range(1, 10 ** 9))
+
+    async def worker(conn):
+        while time.perf_counter() < deadline:
+            async with conn.transaction():
+                if ledger:
+                    await conn.execute(sql, random.choice(candidate_ids), -next(voter), election_id)
+                else:
+                    await conn.execute(sql, [random.choice(candidate_ids)])
+            done[0] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(c) for c in conns))
+    return done[0], done[0] / (time.perf_counter() - start)
+
+async def bench():
+    admin = await connect()
+    db = AsyncSession(admin)
+    election_id = await admin.fetchval("""
+        INSERT INTO elections (name, start_date, end_date) VALUES ('BENCH-LEDGER', now(), now()) RETURNING id
+    """)
+    candidate_ids = [r['id'] for r in await admin.fetch("""
+        INSERT INTO candidates (name, position, party, election_id)
+        SELECT 'Bench ' || g, 'President', 'Bench', $1 FROM generate_series(1, 2) g RETURNING id
+    """, election_id)]
+    conns = [await connect() for _ in range(WORKERS)]
+    try:
+        print(f"two-candidate race, {WORKERS} workers, {SECONDS_PER_RUN:.0f}s per run")
+        _, counter_rate = await run(conns, candidate_ids, election_id, ledger=False)
+        committed, ledger_rate = await run(conns, candidate_ids, election_id, ledger=True)
+        start = time.perf_counter()
+        consumed = await materialize(db)
+        took = time.perf_counter() - start
+        tallied = await admin.fetchval("SELECT COALESCE(SUM(votes), 0) FROM candidate_tallies WHERE candidate_id = ANY($1::int[])", candidate_ids)
+        print(f"single-row counter {counter_rate:>8.0f} tx/s")
+        print(f"ledger append      {ledger_rate:>8.0f} tx/s")
+        print(f"materialized {consumed} rows in {took * 1000:.1f} ms; tallied={tallied} committed={committed}")
+
+        print(f"\n{'ledger rows':>12}{'recount (ms)':>15}{'us/row':>9}")
+        for size in RECOUNT_SIZES:
+            await admin.execute("DELETE FROM vote_ledger WHERE election_id = $1", election_id)
+            await admin.execute("""
+                INSERT INTO vote_ledger (election_id, candidate_id, token_id)
+                SELECT $1, ($2::int[])[1 + g % 2], -g FROM generate_series(1, $3) g
+            """, election_id, candidate_ids, size)
+            await materialize(db)
+            await admin.execute("ANALYZE vote_ledger")
+            start = time.perf_counter()
+            await recount(db)
+            took = time.perf_counter() - start
+            print(f"{size:>12}{took * 1000:>15.1f}{took / size * 1e6:>9.2f}")
+    finally:
+        for c in conns:
+            await c.close()
+        await admin.execute("DELETE FROM vote_ledger WHERE election_id = $1", election_id)
+        await admin.execute("DELETE FROM candidates WHERE election_id = $1", election_id)
+        await admin.execute("DELETE FROM elections WHERE id = $1", election_id)
+        await admin.close()
+
+if __name__ == "__main__":
+    asyncio.run(bench())
@@ -0,0 +1,93 @@
+"""Votes per second through /vote with and without the group-commit pipeline.
+
+Runs the real app in-process (httpx ASGI transport) against the configured database, seeds its own
+election, candidates and tokens, and cleans them up afterwards. Run: python bench_vote_pipeline.py
+"""
+import asyncio
+import time
+import uuid
+
+import httpx
+
+import main
+from database import get_db_connection, resolve_election_set
+from vote_pipeline import vote_pipeline
+
+VOTES = 4000
+CONCURRENCY = 200
+CANDIDATES = 4
+
+def seed():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    batch_id = f"BENCH-{uuid.uuid4().hex[:8].upper()}"
+    cur.execute("""
+        INSERT INTO elections (name, start_date, end_date, status)
+        VALUES (%s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP + INTERVAL '1 day', 'active') RETURNING id
+    """, (batch_id,))
+    election_id = cur.fetchone()['id']
+    cur.execute("""
+        INSERT INTO candidates (name, position, party, election_id)
+        SELECT 'Bench ' || g, 'President', 'Bench', %s FROM generate_series(1, %s) g RETURNING id
+    """, (election_id, CANDIDATES))
+    candidate_ids = [r['id'] for r in cur.fetchall()]
+    cur.execute("""
+        INSERT INTO voting_tokens (token, batch_id, election_set_id)
+        SELECT %s || '-' || g, %s, %s FROM generate_series(1, %s) g RETURNING id, token
+    """, (batch_id, batch_id, resolve_election_set(cur, [election_id]), VOTES * 2))
+    tokens = [r['token'] for r in cur.fetchall()]
+    conn.commit()
+    cur.close()
+    conn.close()
+    return batch_id, election_id, candidate_ids, tokens
+
+def cleanup(batch_id, election_id):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM candidates WHERE election_id = %s", (election_id,))
+    cur.execute("DELETE FROM voting_tokens WHERE batch_id = %s", (batch_id,))
+    cur.execute("DELETE FROM elections WHERE id = %s", (election_id,))
+    conn.commit()
+    cur.close()
+    conn.close()
+
+async def run(client, tokens, candidate_ids):
+    queue = list(enumerate(tokens))
+    statuses = []
+
+    async def worker():
+        while queue:
+            i, token = queue.pop()
+            r = await client.post("/vote", json={"token": token, "candidateId": candidate_ids[i % len(candidate_ids)]})
+            statuses.append(r.status_code)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - start
+    return elapsed, statuses
+
+async def bench():
+    await main.startup_event()
+    batch_id, election_id, candidate_ids, tokens = seed()
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            print(f"{VOTES} votes, {CONCURRENCY} concurrent clients, {CANDIDATES} candidates, engine={main.DB_ENGINE}")
+            for label, pipelined, chunk in (("per-request commit", False, tokens[:VOTES]),
+                                            ("group commit", True, tokens[VOTES:])):
+                if pipelined:
+                    await vote_pipeline.start()
+                elapsed, statuses = await run(client, chunk, candidate_ids)
+                ok = statuses.count(200)
+                extra = ""
+                if pipelined:
+                    stats = vote_pipeline.stats()
+                    extra = f"  ({stats['flushes']} flushes, avg batch {stats['avgBatch']})"
+                    await vote_pipeline.stop()
+                print(f"{label:<20} {ok / elapsed:>9.0f} votes/s  ok={ok}/{len(chunk)}{extra}")
+    finally:
+        await main.shutdown_event()
+        cleanup(batch_id, election_id)
+
+if __name__ == "__main__":
+    asyncio.run(bench())
@@ -0,0 +1,159 @@
+import os
+import uuid
+
+from fastapi import HTTPException
+from python_multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+from image_variants import remove_variants
+
+# Candidate photos uploaded as files (PUT /candidates/{id}/photo) instead of base64 inside the JSON
+# body. The request body is either the image itself or multipart/form-data with the image in a
+# file part (or a part named file / photo / image). Either way it is written to a temp file in
+# the uploads directory chunk by chunk as it arrives, so an upload holds about one network chunk
+# in memory whatever the image size. The type comes from the file's first bytes, not from the
+# declared content type or file name, and the upload is cut off with 413 as soon as it passes
+# PHOTO_MAX_BYTES. Only a complete, accepted image is renamed to its final cand_<uuid>.<ext> name.
+PHOTO_MAX_BYTES = int(os.environ.get("PHOTO_MAX_BYTES", str(5 * 1024 * 1024)))
+PHOTO_FIELDS = (b"file", b"photo", b"image")
+PHOTO_MULTIPART_OVERHEAD = 64 * 1024  # boundaries, part headers and other fields allowed on top
+PHOTO_SNIFF_BYTES = 12
+
+def sniff_image(head):
+    """File extension for a JPEG, PNG or WebP header, else None."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+class PhotoWriter:
+    """One upload being written to a temp file: size cap, type from the first bytes."""
+
+    def __init__(self, upload_dir, max_bytes=PHOTO_MAX_BYTES):
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.path = os.path.join(upload_dir, f".upload-{uuid.uuid4().hex}.part")
+        self.file = open(self.path, "wb")
+        self.size = 0
+        self.head = b""
+        self.ext = None
+
+    async def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"Photo larger than {self.max_bytes} bytes")
+        if self.ext is None:
+            self.head += data[:PHOTO_SNIFF_BYTES - len(self.head)]
+            if len(self.head) >= PHOTO_SNIFF_BYTES:
+                self._check_type()
+        await run_in_threadpool(self.file.write, data)
+
+    def _check_type(self):
+        self.ext = sniff_image(self.head)
+        if self.ext is None:
+            raise HTTPException(status_code=415, detail="Photo must be a JPEG, PNG or WebP image")
+
+    def finish(self):
+        """Moves the complete upload to its final name and returns that file name."""
+        self.file.close()
+        if self.size == 0:
+            raise HTTPException(status_code=400, detail="No photo data received")
+        if self.ext is None:
+            self._check_type()
+        filename = f"cand_{uuid.uuid4()}.{self.ext}"
+        os.replace(self.path, os.path.join(self.upload_dir, filename))
+        return filename
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+async def _receive_multipart(request, boundary, writer):
+    """Streams the first file part of a multipart/form-data body into `writer`."""
+    if not boundary:
+        raise HTTPException(status_code=400, detail="multipart/form-data without a boundary")
+    part = {}
+    pieces = []
+
+    def on_part_begin():
+        part.update(headers={}, field=b"", value=b"", target=False)
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"] = part["value"] = b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["target"] = not part.get("done") and (b"filename" in options or options.get(b"name") in PHOTO_FIELDS)
+
+    def on_part_data(data, start, end):
+        if part["target"]:
+            pieces.append(data[start:end])
+
+    def on_part_end():
+        if part["target"]:
+            part["done"] = True
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field, "on_header_value": on_header_value,
+        "on_header_end": on_header_end, "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data, "on_part_end": on_part_end,
+    })
+    part["done"] = False
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > writer.max_bytes + PHOTO_MULTIPART_OVERHEAD:
+            raise HTTPException(status_code=413, detail=f"Photo larger than {writer.max_bytes} bytes")
+        try:
+            parser.write(chunk)
+        except MultipartParseError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid multipart body: {e}")
+        for piece in pieces:
+            await writer.write(piece)
+        pieces.clear()
+    try:
+        parser.finalize()
+    except MultipartParseError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid multipart body: {e}")
+    if not part.get("done"):
+        raise HTTPException(status_code=400, detail="No photo file in the form (send it as a file part named 'file')")
+
+async def receive_photo(request, upload_dir, max_bytes=None):
+    """Saves the request's photo into upload_dir; returns the new file name."""
+    max_bytes = max_bytes or PHOTO_MAX_BYTES
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    multipart = content_type == b"multipart/form-data"
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_bytes + (PHOTO_MULTIPART_OVERHEAD if multipart else 0):
+        raise HTTPException(status_code=413, detail=f"Photo larger than {max_bytes} bytes")
+    writer = PhotoWriter(upload_dir, max_bytes)
+    try:
+        if multipart:
+            await _receive_multipart(request, options.get(b"boundary"), writer)
+        else:
+            async for chunk in request.stream():
+                await writer.write(chunk)
+        return writer.finish()
+    except BaseException:
+        writer.discard()
+        raise
+
+def remove_photo(image_url, upload_dir):
+    """Deletes the uploaded file behind a candidate's image_url, and its resized variants, if it is one of ours."""
+    if image_url:
+        filename = image_url.split("/")[-1]
+        path = os.path.join(upload_dir, filename)
+        if os.path.exists(path):
+            os.remove(path)
+            remove_variants(filename, upload_dir)
@@ -1,29 +1,206 @@
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2 import extensions
+from contextlib import contextmanager
+import threading
 import time
+import os
+import secrets
 
 # Database Configuration
-DB_NAME = "university_voting"
-DB_USER = "postgres"
-DB_PASSWORD = "blove1234@"
-DB_HOST = "localhost"
-DB_PORT = "5432"
+DB_NAME = os.environ.get("DB_NAME", "university_voting")
+DB_USER = os.environ.get("DB_USER", "postgres")
+DB_PASSWORD = os.environ.get("DB_PASSWORD", "blove1234@")
+DB_HOST = os.environ.get("DB_HOST", "localhost")
+DB_PORT = os.environ.get("DB_PORT", "5432")
+
+# Connection Pool Configuration
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "20"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "5"))  # seconds to wait for a free connection
+DB_POOL_HEALTHCHECK_AFTER = float(os.environ.get("DB_POOL_HEALTHCHECK_AFTER", "30"))  # ping connections idle longer than this
+
+def _connect():
+    return psycopg2.connect(
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT,
+        cursor_factory=RealDictCursor
+    )
 
 def get_db_connection():
+    """Opens a standalone (non-pooled) connection. Request handlers should use the pool instead."""
     try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT,
-            cursor_factory=RealDictCursor
-        )
-        return conn
+        return _connect()
     except psycopg2.OperationalError as e:
         print(f"Error connecting to database: {e}")
         return None
 
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes free within the borrow timeout."""
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool with borrow timeout, checkout health checks and usage stats."""
+
+    def __init__(self, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 timeout=DB_POOL_TIMEOUT, healthcheck_after=DB_POOL_HEALTHCHECK_AFTER):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.healthcheck_after = healthcheck_after
+
+        self._cond = threading.Condition()
+        self._idle = []        # [(conn, last_returned_at)], most recently used last
+        self._in_use = set()
+        self._opening = 0      # connections currently being established
+        self._waiting = 0
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def open(self):
+        """Pre-opens min_size connections so the first requests skip the handshake."""
+        conns = []
+        for _ in range(self.min_size):
+            try:
+                conns.append(_connect())
+            except psycopg2.OperationalError as e:
+                print(f"Error pre-opening pooled connection: {e}")
+                break
+        with self._cond:
+            now = time.monotonic()
+            self._idle.extend((c, now) for c in conns)
+            self._cond.notify_all()
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - last_used < self.healthcheck_after:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        self._discarded += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        self._in_use.add(conn)
+                        break
+                    if len(self._in_use) + self._opening < self.max_size:
+                        self._opening += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(f"No database connection available within {self.timeout}s")
+                    self._waiting += 1
+                    self._cond.wait(remaining)
+                    self._waiting -= 1
+
+            if conn is None:
+                # Slot reserved: open a fresh connection outside the lock
+                try:
+                    conn = _connect()
+                except Exception:
+                    with self._cond:
+                        self._opening -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._opening -= 1
+                    self._in_use.add(conn)
+            elif not self._is_healthy(conn, last_used):
+                with self._cond:
+                    self._in_use.discard(conn)
+                    self._discard(conn)
+                    self._cond.notify()
+                continue
+
+            waited = time.monotonic() - start
+            with self._cond:
+                self._checkouts += 1
+                self._total_wait += waited
+                self._max_wait = max(self._max_wait, waited)
+            return conn
+
+    def putconn(self, conn, discard=False):
+        with self._cond:
+            if conn not in self._in_use:
+                return  # already returned: listing it twice would hand one connection to two callers
+        if not discard and not conn.closed:
+            try:
+                # Never hand out a connection with an open/aborted transaction
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._cond:
+            if conn not in self._in_use:
+                return
+            self._in_use.remove(conn)
+            if discard or conn.closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "minSize": self.min_size,
+                "maxSize": self.max_size,
+                "inUse": len(self._in_use),
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "avgWaitMs": round(self._total_wait / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                "maxWaitMs": round(self._max_wait * 1000, 3),
+            }
+
+    def closeall(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._discard(conn)
+            self._idle.clear()
+            self._cond.notify_all()
+
+db_pool = ConnectionPool()
+
 def init_db():
     """Initializes the database tables safely without dropping data on every restart."""
     conn = get_db_connection()
@@ -47,6 +224,14 @@ def init_db():
             );
         """)
 
+        # 1b. Election aliases (legacy codes/names such as 'ELEC-001' -> elections.id)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS election_aliases (
+                alias TEXT PRIMARY KEY,
+                election_id INTEGER NOT NULL REFERENCES elections(id) ON DELETE CASCADE
+            );
+        """)
+
         # 2. Users Table
         cur.execute("""
             CREATE TABLE IF NOT EXISTS users (
@@ -68,12 +253,14 @@ def init_db():
                 name TEXT NOT NULL,
                 position TEXT NOT NULL,
                 party TEXT,
-                election_id TEXT,
+                election_id INTEGER REFERENCES elections(id) ON DELETE SET NULL,
                 image_url TEXT,
                 vote_count INTEGER DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
         """)
+        # Resized copies of the photo, {"thumb": url, ...} (see image_variants.py)
+        cur.execute("ALTER TABLE candidates ADD COLUMN IF NOT EXISTS image_variants JSONB")
 
         # 4. Votes Table
         cur.execute("""
@@ -92,33 +279,270 @@ def init_db():
                 id SERIAL PRIMARY KEY,
                 token TEXT UNIQUE NOT NULL,
                 batch_id TEXT,
-                election_id TEXT, 
                 is_used BOOLEAN DEFAULT FALSE,
                 used_at TIMESTAMP,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
         """)
 
-        # 6. Junction table for tokens and multiple elections
+        # 6. Election sets: the elections a token may vote in, stored once per distinct set of
+        # elections (a whole batch shares one) instead of one row per token per election
         cur.execute("""
-            CREATE TABLE IF NOT EXISTS token_elections (
+            CREATE TABLE IF NOT EXISTS election_sets (
                 id SERIAL PRIMARY KEY,
-                token_id INTEGER REFERENCES voting_tokens(id) ON DELETE CASCADE,
-                election_id TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
         """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS election_set_members (
+                set_id INTEGER NOT NULL REFERENCES election_sets(id) ON DELETE CASCADE,
+                election_id INTEGER NOT NULL REFERENCES elections(id) ON DELETE CASCADE,
+                PRIMARY KEY (set_id, election_id)
+            );
+        """)
+        cur.execute("ALTER TABLE voting_tokens ADD COLUMN IF NOT EXISTS election_set_id INTEGER REFERENCES election_sets(id)")
 
-        # 7. Insert Initial Data ONLY if candidates table is empty
+        # 6a. Token allocator state (see token_allocator.py): a never-reused index sequence and the
+        # permutation key, generated once so codes stay distinct across restarts
+        cur.execute("CREATE SEQUENCE IF NOT EXISTS token_counter_seq MINVALUE 1")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS token_allocator (
+                singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+                key BYTEA NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("INSERT INTO token_allocator (key) VALUES (%s) ON CONFLICT (singleton) DO NOTHING",
+                    (psycopg2.Binary(secrets.token_bytes(32)),))
+        # Highest token id when TOKEN_CHECK_DIGIT was turned on: older tokens have no check character
+        cur.execute("ALTER TABLE token_allocator ADD COLUMN IF NOT EXISTS check_digit_after_id INTEGER")
+
+        # 6b. Sharded vote counter slots (see vote_counters.py)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS candidate_vote_shards (
+                candidate_id INTEGER NOT NULL REFERENCES candidates(id) ON DELETE CASCADE,
+                shard SMALLINT NOT NULL,
+                vote_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (candidate_id, shard)
+            );
+        """)
+
+        # 6c. Append-only vote ledger + its materialized totals (see vote_ledger.py).
+        # The ledger keeps plain ids (no FKs) so the audit trail survives candidate deletes;
+        # tx_id is the writing transaction and drives the materializer's high-water mark.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS vote_ledger (
+                id BIGSERIAL PRIMARY KEY,
+                election_id INTEGER,
+                candidate_id INTEGER NOT NULL,
+                token_id INTEGER,
+                user_id INTEGER,
+                tx_id XID8 NOT NULL DEFAULT pg_current_xact_id(),
+                cast_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                CHECK ((token_id IS NULL) <> (user_id IS NULL))
+            );
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_vote_ledger_tx_id ON vote_ledger (tx_id)")
+        # One ballot per voter per election, whichever way the voter authenticated
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_vote_ledger_token_election ON vote_ledger (token_id, election_id) WHERE token_id IS NOT NULL")
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_vote_ledger_user_election ON vote_ledger (user_id, election_id) WHERE user_id IS NOT NULL")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS candidate_tallies (
+                candidate_id INTEGER PRIMARY KEY REFERENCES candidates(id) ON DELETE CASCADE,
+                election_id INTEGER,
+                votes INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS tally_state (
+                name TEXT PRIMARY KEY,
+                high_water XID8 NOT NULL DEFAULT '0',
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("INSERT INTO tally_state (name) VALUES ('vote_ledger') ON CONFLICT (name) DO NOTHING")
+
+        # 6d. Shared rate limit counters (see admission.py, ADMISSION_BACKEND=postgres). Unlogged:
+        # nothing here needs to survive a crash, and the writes skip the WAL.
+        cur.execute("""
+            CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_hits (
+                key TEXT NOT NULL,
+                window_start BIGINT NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (key, window_start)
+            );
+        """)
+
+        # 7. Older databases stored election references as free TEXT
+        migrate_election_keys(cur)
+        migrate_token_election_sets(cur)
+        migrate_token_election_column(cur)
+
+        # 7b. Data versions for conditional GET (see http_cache.py), after the migration since the
+        # triggers reference candidates.election_id. Statement-level triggers bump
+        # "catalog" on any change to elections, token eligibility, or candidate details; vote count
+        # and token redemption updates do not touch the listed columns and so never fire them.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS data_versions (
+                name TEXT PRIMARY KEY,
+                version BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        cur.execute("INSERT INTO data_versions (name) VALUES ('catalog'), ('tallies') ON CONFLICT (name) DO NOTHING")
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+            BEGIN
+                UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'catalog';
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql;
+        """)
+        for table, events in (
+            ("elections", "INSERT OR UPDATE OR DELETE OR TRUNCATE"),
+            ("candidates", "INSERT OR DELETE OR TRUNCATE OR UPDATE OF name, position, party, election_id, image_url, image_variants"),
+            ("voting_tokens", "INSERT OR DELETE OR TRUNCATE OR UPDATE OF election_set_id"),
+            ("election_set_members", "INSERT OR UPDATE OR DELETE OR TRUNCATE"),
+        ):
+            cur.execute(f"DROP TRIGGER IF EXISTS {table}_catalog_version ON {table}")
+            cur.execute(f"CREATE TRIGGER {table}_catalog_version AFTER {events} ON {table} FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version()")
+
+        # 7c. Per-batch token counts for /admin/token-batches (see token_batches.py). Statement-level
+        # triggers append one delta row per batch touched by an insert or delete, so no statement
+        # waits on a shared counter row; the compactor folds the deltas back together. Redeeming a
+        # token (the /vote UPDATE of is_used / used_at) fires nothing here: each worker appends the
+        # used counts of the tokens it redeemed from its batch compactor instead.
+        cur.execute("SELECT to_regclass('token_batch_deltas') IS NULL AS missing")
+        backfill = cur.fetchone()['missing']
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS token_batch_deltas (
+                batch_id TEXT,
+                election_set_id INTEGER,
+                total BIGINT NOT NULL DEFAULT 0,
+                used BIGINT NOT NULL DEFAULT 0,
+                last_used_at TIMESTAMP,
+                created_at TIMESTAMP
+            );
+        """)
+        cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'token_batch_deltas' AND column_name = 'used'
+        """)
+        backfill_used = cur.fetchone() is None
+        cur.execute("ALTER TABLE token_batch_deltas ADD COLUMN IF NOT EXISTS used BIGINT NOT NULL DEFAULT 0, ADD COLUMN IF NOT EXISTS last_used_at TIMESTAMP")
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION record_token_batch_deltas() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'TRUNCATE' THEN
+                    TRUNCATE token_batch_deltas;
+                ELSIF TG_OP = 'INSERT' THEN
+                    INSERT INTO token_batch_deltas (batch_id, election_set_id, total, used, last_used_at, created_at)
+                    SELECT batch_id, election_set_id, COUNT(*), COUNT(*) FILTER (WHERE is_used), MAX(used_at), MIN(created_at)
+                    FROM new_rows GROUP BY batch_id, election_set_id;
+                ELSE
+                    INSERT INTO token_batch_deltas (batch_id, election_set_id, total, used)
+                    SELECT batch_id, election_set_id, -COUNT(*), -COUNT(*) FILTER (WHERE is_used)
+                    FROM old_rows GROUP BY batch_id, election_set_id;
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql;
+        """)
+        # A token moved to another batch or election set (rare: migrations, manual fixes). A row
+        # trigger with a column list, because one with transition tables would make every UPDATE
+        # of voting_tokens, the vote's included, collect its old and new rows.
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION move_token_batch_delta() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO token_batch_deltas (batch_id, election_set_id, total, used, last_used_at, created_at)
+                VALUES (OLD.batch_id, OLD.election_set_id, -1, -OLD.is_used::int, NULL, NULL),
+                       (NEW.batch_id, NEW.election_set_id, 1, NEW.is_used::int, NEW.used_at, NEW.created_at);
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql;
+        """)
+        for op, rows in (("INSERT", "NEW TABLE AS new_rows"), ("DELETE", "OLD TABLE AS old_rows"), ("TRUNCATE", None)):
+            name = f"voting_tokens_batch_{op.lower()}"
+            cur.execute(f"DROP TRIGGER IF EXISTS {name} ON voting_tokens")
+            referencing = f"REFERENCING {rows} " if rows else ""
+            cur.execute(f"CREATE TRIGGER {name} AFTER {op} ON voting_tokens {referencing}FOR EACH STATEMENT EXECUTE FUNCTION record_token_batch_deltas()")
+        cur.execute("DROP TRIGGER IF EXISTS voting_tokens_batch_update ON voting_tokens")
+        cur.execute("DROP TRIGGER IF EXISTS voting_tokens_batch_move ON voting_tokens")
+        cur.execute("""
+            CREATE TRIGGER voting_tokens_batch_move AFTER UPDATE OF batch_id, election_set_id ON voting_tokens
+            FOR EACH ROW WHEN (OLD.batch_id IS DISTINCT FROM NEW.batch_id OR OLD.election_set_id IS DISTINCT FROM NEW.election_set_id)
+            EXECUTE FUNCTION move_token_batch_delta()
+        """)
+        if backfill or backfill_used:
+            # total only when the table is new (older ones already hold it), used counts either way
+            total = "COUNT(*)" if backfill else "0"
+            cur.execute(f"""
+                INSERT INTO token_batch_deltas (batch_id, election_set_id, total, used, last_used_at, created_at)
+                SELECT batch_id, election_set_id, {total}, COUNT(*) FILTER (WHERE is_used), MAX(used_at), MIN(created_at)
+                FROM voting_tokens GROUP BY batch_id, election_set_id
+            """)
+
+        # 7d. New tokens are announced to every worker's token filter (see token_filter.py) as
+        # "low id,high id"; NOTIFY is delivered on commit, so rolled-back batches never arrive.
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION notify_tokens_added() RETURNS trigger AS $$
+            DECLARE
+                low INTEGER;
+                high INTEGER;
+            BEGIN
+                SELECT MIN(id), MAX(id) INTO low, high FROM new_rows;
+                IF low IS NOT NULL THEN
+                    PERFORM pg_notify('voting_tokens_added', low || ',' || high);
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql;
+        """)
+        cur.execute("DROP TRIGGER IF EXISTS voting_tokens_notify_added ON voting_tokens")
+        cur.execute("CREATE TRIGGER voting_tokens_notify_added AFTER INSERT ON voting_tokens REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION notify_tokens_added()")
+
+        # 7e. Users whose identity changes (username, email, password, role) or who are deleted are
+        # announced to every worker's principal cache (see principal_cache.py) by their old email;
+        # identical payloads in one transaction are sent once. has_voted is left out on purpose: every
+        # user vote sets it, and announcing that would flush all workers' caches once per ballot.
+        cur.execute("""
+            CREATE OR REPLACE FUNCTION notify_users_changed() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('users_changed', OLD.email);
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql;
+        """)
+        cur.execute("DROP TRIGGER IF EXISTS users_notify_changed ON users")
+        cur.execute("""
+            CREATE TRIGGER users_notify_changed AFTER UPDATE OF username, email, password, role ON users
+            FOR EACH ROW WHEN (OLD.username IS DISTINCT FROM NEW.username OR OLD.email IS DISTINCT FROM NEW.email
+                               OR OLD.password IS DISTINCT FROM NEW.password OR OLD.role IS DISTINCT FROM NEW.role)
+            EXECUTE FUNCTION notify_users_changed()
+        """)
+        cur.execute("DROP TRIGGER IF EXISTS users_notify_deleted ON users")
+        cur.execute("CREATE TRIGGER users_notify_deleted AFTER DELETE ON users FOR EACH ROW EXECUTE FUNCTION notify_users_changed()")
+
+        # 8. Indexes for the election / token joins
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_candidates_election_id ON candidates (election_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_election_set_members_election_id ON election_set_members (election_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_voting_tokens_election_set_id ON voting_tokens (election_set_id)")
+        # (batch_id, id) serves both batch lookups and the keyset pages of /admin/token-batches/{id}/tokens.
+        # is_used / used_at stay unindexed so the vote's UPDATE remains a HOT update.
+        cur.execute("DROP INDEX IF EXISTS idx_voting_tokens_batch_id")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_voting_tokens_batch_id_id ON voting_tokens (batch_id, id)")
+
+        # 9. Insert Initial Data ONLY if candidates table is empty
         cur.execute("SELECT COUNT(*) FROM candidates")
         if cur.fetchone()['count'] == 0:
             print("Inserting initial candidate data...")
+            seed_election_id = resolve_election_ref(cur, 'ELEC-001', create=True)
             cur.execute("""
                 INSERT INTO candidates (name, position, party, election_id, image_url) VALUES
-                ('Candidate A', 'President', 'Party X', 'ELEC-001', 'https://yourdomain.com/uploads/candidate_a.jpg'),
-                ('Candidate B', 'Vice President', 'Party Y', 'ELEC-001', 'https://yourdomain.com/uploads/candidate_b.jpg'),
-                ('Candidate C', 'General Secretary', 'Independent', 'ELEC-001', 'https://yourdomain.com/uploads/candidate_c.jpg');
-            """)
+                ('Candidate A', 'President', 'Party X', %(e)s, 'https://yourdomain.com/uploads/candidate_a.jpg'),
+                ('Candidate B', 'Vice President', 'Party Y', %(e)s, 'https://yourdomain.com/uploads/candidate_b.jpg'),
+                ('Candidate C', 'General Secretary', 'Independent', %(e)s, 'https://yourdomain.com/uploads/candidate_c.jpg');
+            """, {"e": seed_election_id})
 
         conn.commit()
         cur.close()
@@ -128,3 +552,181 @@ def init_db():
         conn.rollback()
     finally:
         conn.close()
+
+# Tables whose election_id used to be free TEXT (an elections.id as string, an election name or a code like 'ELEC-001')
+ELECTION_REF_TABLES = ("candidates", "voting_tokens", "token_elections")
+
+def resolve_election_ref(cur, ref, create=False):
+    """Maps an election reference (numeric id, alias/code or name) to elections.id.
+
+    With create=True an unknown code gets a placeholder election plus alias, so admins can still
+    link candidates and tokens to a code before the formal election record exists.
+    """
+    if ref is None or str(ref).strip() == "":
+        return None
+    ref = str(ref).strip()
+    if ref.isdigit():
+        cur.execute("SELECT id FROM elections WHERE id = %s", (int(ref),))
+        row = cur.fetchone()
+        return row['id'] if row else None
+
+    cur.execute("SELECT election_id FROM election_aliases WHERE alias = %s", (ref,))
+    row = cur.fetchone()
+    if row:
+        return row['election_id']
+
+    cur.execute("SELECT id FROM elections WHERE name = %s ORDER BY id LIMIT 1", (ref,))
+    row = cur.fetchone()
+    if not row:
+        if not create:
+            return None
+        cur.execute(
+            "INSERT INTO elections (name, start_date, end_date) VALUES (%s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP) RETURNING id",
+            (ref,)
+        )
+        row = cur.fetchone()
+    cur.execute(
+        "INSERT INTO election_aliases (alias, election_id) VALUES (%s, %s) ON CONFLICT (alias) DO NOTHING",
+        (ref, row['id'])
+    )
+    return row['id']
+
+def resolve_election_set(cur, election_ids):
+    """election_sets.id holding exactly `election_ids` (created on first use); None for no elections.
+
+    Takes a transaction-level advisory lock so concurrent callers share one set; commit soon after.
+    """
+    ids = sorted(set(election_ids))
+    if not ids:
+        return None
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('election_sets'))")
+    cur.execute("""
+        SELECT set_id FROM election_set_members
+        GROUP BY set_id
+        HAVING array_agg(election_id ORDER BY election_id) = %s::int[]
+        LIMIT 1
+    """, (ids,))
+    row = cur.fetchone()
+    if row:
+        return row['set_id']
+    cur.execute("INSERT INTO election_sets DEFAULT VALUES RETURNING id")
+    set_id = cur.fetchone()['id']
+    cur.execute("INSERT INTO election_set_members (set_id, election_id) SELECT %s, unnest(%s::int[])", (set_id, ids))
+    return set_id
+
+def migrate_election_keys(cur):
+    """Converts TEXT election references into integer foreign keys to elections(id).
+
+    Every distinct stored reference is resolved by numeric id first, then by election name. References
+    that match no election get a placeholder election, and every non-numeric reference is kept in
+    election_aliases so old codes keep working in the API.
+    """
+    cur.execute("""
+        SELECT table_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND column_name = 'election_id' AND data_type = 'text'
+          AND table_name IN %s
+    """, (ELECTION_REF_TABLES,))
+    text_tables = [r['table_name'] for r in cur.fetchall()]
+    if not text_tables:
+        return
+
+    print(f"Migrating election references to integer keys: {', '.join(text_tables)}")
+    refs_sql = " UNION ".join(f"SELECT election_id AS ref FROM {t}" for t in text_tables)
+
+    # 1. Placeholder elections for references that match nothing
+    cur.execute(f"""
+        INSERT INTO elections (name, start_date, end_date)
+        SELECT DISTINCT r.ref, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        FROM ({refs_sql}) r
+        WHERE r.ref IS NOT NULL AND r.ref <> '' AND r.ref !~ '^[0-9]+$'
+          AND NOT EXISTS (SELECT 1 FROM elections e WHERE e.name = r.ref)
+    """)
+
+    # 2. Aliases for every non-numeric reference (lowest id wins on duplicate names)
+    cur.execute(f"""
+        INSERT INTO election_aliases (alias, election_id)
+        SELECT r.ref, MIN(e.id)
+        FROM ({refs_sql}) r
+        JOIN elections e ON e.name = r.ref
+        WHERE r.ref !~ '^[0-9]+$'
+        GROUP BY r.ref
+        ON CONFLICT (alias) DO NOTHING
+    """)
+
+    # 3. Swap each TEXT column for an integer foreign key
+    on_delete = {"candidates": "SET NULL", "voting_tokens": "SET NULL", "token_elections": "CASCADE"}
+    for t in text_tables:
+        cur.execute(f"ALTER TABLE {t} ADD COLUMN election_key INTEGER")
+        cur.execute(f"""
+            UPDATE {t} x SET election_key = COALESCE(
+                (SELECT e.id FROM elections e WHERE e.id::text = x.election_id),
+                (SELECT a.election_id FROM election_aliases a WHERE a.alias = x.election_id)
+            )
+            WHERE x.election_id IS NOT NULL
+        """)
+        cur.execute(f"ALTER TABLE {t} DROP COLUMN election_id")
+        cur.execute(f"ALTER TABLE {t} RENAME COLUMN election_key TO election_id")
+        cur.execute(f"""
+            ALTER TABLE {t} ADD CONSTRAINT {t}_election_id_fkey
+            FOREIGN KEY (election_id) REFERENCES elections(id) ON DELETE {on_delete[t]}
+        """)
+
+    # Token links that pointed at an unknown numeric id cannot grant access to anything
+    if "token_elections" in text_tables:
+        cur.execute("DELETE FROM token_elections WHERE election_id IS NULL")
+
+def migrate_token_election_sets(cur):
+    """Moves per-token token_elections rows onto election sets, then drops token_elections.
+
+    Tokens with the same elections share one set, so a batch of N tokens for E elections goes from
+    N * E link rows to E member rows plus a set id on each token.
+    """
+    cur.execute("SELECT to_regclass('token_elections') IS NOT NULL AS present")
+    if not cur.fetchone()['present']:
+        return
+
+    cur.execute("SELECT COUNT(*) AS n FROM token_elections")
+    print(f"Migrating {cur.fetchone()['n']} token_elections rows to election sets")
+    cur.execute("""
+        CREATE TEMP TABLE token_sets ON COMMIT DROP AS
+        SELECT token_id, array_agg(DISTINCT election_id ORDER BY election_id) AS ids
+        FROM token_elections
+        WHERE election_id IS NOT NULL AND token_id IS NOT NULL
+        GROUP BY token_id
+    """)
+    cur.execute("""
+        CREATE TEMP TABLE set_map ON COMMIT DROP AS
+        SELECT ids, nextval(pg_get_serial_sequence('election_sets', 'id'))::int AS set_id
+        FROM (SELECT DISTINCT ids FROM token_sets) d
+    """)
+    cur.execute("INSERT INTO election_sets (id) SELECT set_id FROM set_map")
+    cur.execute("INSERT INTO election_set_members (set_id, election_id) SELECT set_id, unnest(ids) FROM set_map")
+    cur.execute("""
+        UPDATE voting_tokens vt SET election_set_id = m.set_id
+        FROM token_sets t JOIN set_map m ON m.ids = t.ids
+        WHERE vt.id = t.token_id
+    """)
+    cur.execute("SELECT COUNT(*) AS sets, COALESCE(SUM(cardinality(ids)), 0) AS members FROM set_map")
+    row = cur.fetchone()
+    print(f"Created {row['sets']} election sets with {row['members']} members")
+    cur.execute("DROP TABLE token_elections")
+
+def migrate_token_election_column(cur):
+    """Moves tokens pushed with a single voting_tokens.election_id onto election sets, then drops
+    the column (eligibility is read from election_set_members only)."""
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'voting_tokens' AND column_name = 'election_id'
+    """)
+    if cur.fetchone() is None:
+        return
+
+    cur.execute("SELECT DISTINCT election_id FROM voting_tokens WHERE election_id IS NOT NULL AND election_set_id IS NULL")
+    election_ids = [r['election_id'] for r in cur.fetchall()]
+    print(f"Moving single-election tokens of {len(election_ids)} elections to election sets")
+    for election_id in election_ids:
+        cur.execute(
+            "UPDATE voting_tokens SET election_set_id = %s WHERE election_id = %s AND election_set_id IS NULL",
+            (resolve_election_set(cur, [election_id]), election_id)
+        )
+    cur.execute("ALTER TABLE voting_tokens DROP COLUMN election_id")
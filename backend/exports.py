@@ -0,0 +1,156 @@
+import csv
+import io
+import itertools
+import json
+import os
+
+from psycopg2 import extensions
+
+from vote_counters import VOTE_TOTAL_JOINS, VOTE_TOTAL_SQL
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+
+# Bulk exports. Rows come from a server-side (named) cursor EXPORT_CHUNK_ROWS at a time and each
+# chunk is encoded and handed to the client before the next is fetched, so a worker holds one
+# chunk in memory however many rows the export has.
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", "5000"))
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+def export_formats():
+    return [f for f in EXPORT_MEDIA_TYPES if f != "parquet" or pa is not None]
+
+# (column, type) pairs; the type only matters for the Parquet schema
+TOKEN_COLUMNS = [("id", "int"), ("token", "text"), ("batch_id", "text"), ("election_ids", "text"),
+                 ("is_used", "bool"), ("used_at", "timestamp"), ("created_at", "timestamp")]
+
+RESULT_COLUMNS = [("election_id", "int"), ("election_name", "text"), ("election_status", "text"),
+                  ("candidate_id", "int"), ("candidate_name", "text"), ("position", "text"),
+                  ("party", "text"), ("votes", "int")]
+
+def tokens_export_sql(election_id=None, batch_id=None):
+    """Query and params for the token export. election_ids is ';'-separated so it fits one CSV cell."""
+    where, params = [], []
+    if election_id is not None:
+        where.append("vt.election_set_id IN (SELECT m.set_id FROM election_set_members m WHERE m.election_id = %s)")
+        params.append(election_id)
+    if batch_id is not None:
+        where.append("vt.batch_id = %s")
+        params.append(batch_id)
+    return f"""
+        SELECT vt.id, vt.token, vt.batch_id,
+               s.election_ids, vt.is_used, vt.used_at, vt.created_at
+        FROM voting_tokens vt
+        LEFT JOIN (
+            SELECT set_id, string_agg(election_id::text, ';' ORDER BY election_id) AS election_ids
+            FROM election_set_members GROUP BY set_id
+        ) s ON s.set_id = vt.election_set_id
+        WHERE {" AND ".join(where) or "TRUE"}
+        ORDER BY vt.id
+    """, params
+
+def results_export_sql(election_id=None):
+    """Query and params for the results export: one row per candidate, highest total first."""
+    return f"""
+        SELECT e.id, e.name, e.status, c.id, c.name, c.position, c.party, {VOTE_TOTAL_SQL}
+        FROM elections e
+        JOIN candidates c ON c.election_id = e.id
+        {VOTE_TOTAL_JOINS}
+        WHERE {"e.id = %s" if election_id is not None else "TRUE"}
+        ORDER BY e.id, 8 DESC, c.id
+    """, [election_id] if election_id is not None else []
+
+def _csv_chunks(header, chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+def _ndjson_chunks(header, chunks):
+    for rows in chunks:
+        yield "".join(json.dumps(dict(zip(header, row)), default=str) + "\n" for row in rows).encode()
+
+class _Drain:
+    """Write-only file for ParquetWriter whose bytes are taken out after every row group."""
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+def _parquet_chunks(columns, chunks):
+    types = {"int": pa.int64(), "text": pa.string(), "bool": pa.bool_(), "timestamp": pa.timestamp("us")}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    sink = _Drain()
+    writer = pq.ParquetWriter(sink, schema)
+    for rows in chunks:
+        # One row group per chunk
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(col, type=field.type) for col, field in zip(zip(*rows), schema)], schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+def _export_body(conn, release, query, params, columns, fmt, chunk_rows):
+    try:
+        cur = conn.cursor(name="export", cursor_factory=extensions.cursor)
+        cur.itersize = chunk_rows
+        cur.execute(query, params)
+
+        def chunks():
+            while True:
+                rows = cur.fetchmany(chunk_rows)
+                if not rows:
+                    return
+                yield rows
+
+        header = [name for name, _ in columns]
+        if fmt == "parquet":
+            yield from _parquet_chunks(columns, chunks())
+        elif fmt == "ndjson":
+            yield from _ndjson_chunks(header, chunks())
+        else:
+            yield from _csv_chunks(header, chunks())
+        cur.close()
+    finally:
+        release(conn)
+
+def export_stream(conn, release, query, params, columns, fmt, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Body iterator for StreamingResponse. Takes ownership of `conn` and calls release(conn) once
+    the export ends or the iterator is dropped (client gone).
+
+    The first chunk is produced right away, so query errors surface before the response starts.
+    """
+    body = _export_body(conn, release, query, params, columns, fmt, chunk_rows)
+    first = next(body, b"")
+    return itertools.chain([first], body)
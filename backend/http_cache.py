@@ -0,0 +1,56 @@
+import hashlib
+
+from fastapi import Response
+
+# Conditional GET. The catalog version (elections, candidates, token/election links) is bumped by
+# triggers (see init_db); vote totals only ever grow, so their sum plus the "tallies" epoch (bumped
+# when a recount repair rewrites totals) changes whenever any count does.
+CATALOG_VERSION_SQL = "SELECT version FROM data_versions WHERE name = 'catalog'"
+
+def votes_version_sql(source="candidates c", where="TRUE"):
+    """Row with the catalog version, the tallies epoch and the vote total of the matching candidates.
+
+    `source` must expose the candidates as "c"; `where` may use the caller's placeholders.
+    """
+    return f"""
+        WITH m AS (SELECT c.id, c.vote_count FROM {source} WHERE {where})
+        SELECT (SELECT version FROM data_versions WHERE name = 'catalog') AS catalog,
+               (SELECT version FROM data_versions WHERE name = 'tallies') AS tallies,
+               (SELECT COALESCE(SUM(vote_count), 0) FROM m)
+             + (SELECT COALESCE(SUM(vote_count), 0) FROM candidate_vote_shards WHERE candidate_id IN (SELECT id FROM m))
+             + (SELECT COALESCE(SUM(votes), 0) FROM candidate_tallies WHERE candidate_id IN (SELECT id FROM m)) AS votes
+    """
+
+# votes_version_sql source for the candidates of a token's elections (token as $1 / %s)
+TOKEN_CANDIDATES_SOURCE = """
+    voting_tokens vt
+    JOIN election_set_members esm ON esm.set_id = vt.election_set_id
+    JOIN candidates c ON c.election_id = esm.election_id
+"""
+
+BUMP_TALLIES_SQL = "UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = 'tallies'"
+
+def make_etag(*parts):
+    """Strong ETag from version parts (or a rendered body)."""
+    raw = "|".join(str(p) for p in parts)
+    return f'"{hashlib.blake2b(raw.encode(), digest_size=12).hexdigest()}"'
+
+def is_fresh(if_none_match, etag):
+    """True when the client's If-None-Match already names `etag` (weak comparison, RFC 9110)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return etag in tags or f"W/{etag}" in tags
+
+def not_modified(etag):
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+def json_with_etag(body, etag):
+    """Already-serialized JSON body with its ETag"""
+    return Response(content=body, media_type="application/json", headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+def set_etag(response, etag):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
@@ -0,0 +1,208 @@
+import asyncio
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # without Pillow photos are served as uploaded
+    Image = None
+
+from database import db_pool, get_db_connection
+
+# Resized copies of candidate photos for the voter app. Photos are stored as uploaded (often a
+# few MB straight off a phone camera), and every /candidates list used to download all of them
+# at full size. After a photo is saved, IMAGE_VARIANT_WORKERS background threads write one copy
+# per IMAGE_VARIANTS entry ("name:pixels", the longest side) in IMAGE_VARIANT_FORMAT next to the
+# original in uploads/, as cand_<uuid>_<name>.<format>. The request does not wait for them; once
+# written, their URLs are stored in candidates.image_variants and returned as imageVariants
+# ({"thumb": url, "medium": url}). Until then imageVariants is null and clients use image.
+# Photos uploaded before this (or while Pillow was missing) are converted by the backfill job,
+# `python image_variants.py [--force]`, on IMAGE_BACKFILL_WORKERS processes (all CPUs).
+IMAGE_VARIANTS = [(name, int(size)) for name, size in
+                  (v.split(":") for v in os.environ.get("IMAGE_VARIANTS", "thumb:160,medium:640").split(",") if v)]
+IMAGE_VARIANT_FORMAT = os.environ.get("IMAGE_VARIANT_FORMAT", "webp").lower()  # webp or avif
+IMAGE_VARIANT_QUALITY = int(os.environ.get("IMAGE_VARIANT_QUALITY", "80"))
+IMAGE_VARIANT_WORKERS = int(os.environ.get("IMAGE_VARIANT_WORKERS", "2"))  # 0 = off
+IMAGE_BACKFILL_WORKERS = int(os.environ.get("IMAGE_BACKFILL_WORKERS", str(os.cpu_count() or 1)))
+
+# Only for the photo the variants were made from: a photo replaced meanwhile keeps its own
+SET_VARIANTS_SQL = "UPDATE candidates SET image_variants = %s WHERE id = %s AND image_url = %s"
+
+BACKFILL_SQL = """
+    SELECT id, image_url FROM candidates
+    WHERE image_url LIKE '%%/uploads/cand\\_%%' AND (image_variants IS NULL OR %s)
+    ORDER BY id
+"""
+
+def variants_supported(fmt=IMAGE_VARIANT_FORMAT):
+    return Image is not None and features.check(fmt)
+
+def variant_filename(filename, name, fmt=IMAGE_VARIANT_FORMAT):
+    """cand_<uuid>.jpg -> cand_<uuid>_<name>.<fmt>"""
+    return f"{os.path.splitext(filename)[0]}_{name}.{fmt}"
+
+def make_variants(path, sizes=IMAGE_VARIANTS, fmt=IMAGE_VARIANT_FORMAT, quality=IMAGE_VARIANT_QUALITY):
+    """Writes the variants of the photo at `path` next to it; returns {name: file name}."""
+    directory, filename = os.path.split(path)
+    written = {}
+    with Image.open(path) as img:
+        largest = max(size for _, size in sizes)
+        img.draft("RGB", (largest, largest))  # JPEG: decode at 1/2 .. 1/8 scale straight away
+        img = ImageOps.exif_transpose(img)  # phone photos are often stored sideways plus a rotate tag
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if img.mode in ("LA", "PA") or "transparency" in img.info else "RGB")
+        # Largest first; each smaller one is shrunk from the previous instead of the original
+        for name, size in sorted(sizes, key=lambda s: -s[1]):
+            img.thumbnail((size, size), Image.LANCZOS)
+            out = variant_filename(filename, name, fmt)
+            part = os.path.join(directory, f".{out}.part")
+            img.save(part, format=fmt.upper(), quality=quality)
+            os.replace(part, os.path.join(directory, out))
+            written[name] = out
+    return written
+
+def remove_variants(filename, upload_dir):
+    """Deletes every variant written for the uploaded photo `filename`."""
+    for path in glob.glob(os.path.join(upload_dir, glob.escape(os.path.splitext(filename)[0]) + "_*")):
+        os.remove(path)
+
+def _store(cur, candidate_id, image_url, names):
+    """Saves the variants' URLs for the candidate; False if its photo was replaced meanwhile."""
+    base = image_url.rsplit("/", 1)[0]
+    cur.execute(SET_VARIANTS_SQL, (json.dumps({name: f"{base}/{f}" for name, f in names.items()}), candidate_id, image_url))
+    return cur.rowcount > 0
+
+class ImageVariants:
+    """Background thread pool making the variants of newly saved photos."""
+
+    def __init__(self, workers=IMAGE_VARIANT_WORKERS):
+        self.workers = workers
+        self.upload_dir = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pending = 0
+
+        self.completed = 0
+        self.failed = 0
+        self.stale = 0
+        self._total_ms = 0.0
+
+    @property
+    def enabled(self):
+        return self.workers > 0 and variants_supported()
+
+    def submit(self, candidate_id, image_url):
+        """Queues the variants of a just-saved photo; photos not in uploads/ are skipped."""
+        filename = (image_url or "").split("/")[-1]
+        if self._executor is None or not filename.startswith("cand_"):
+            return
+        with self._lock:
+            self.pending += 1
+        self._executor.submit(self._process, candidate_id, image_url, os.path.join(self.upload_dir, filename))
+
+    def _process(self, candidate_id, image_url, path):
+        start = time.perf_counter()
+        try:
+            names = make_variants(path)
+            with db_pool.connection() as conn:
+                cur = conn.cursor()
+                try:
+                    stored = _store(cur, candidate_id, image_url, names)
+                    conn.commit()
+                finally:
+                    cur.close()
+            if not stored:
+                remove_variants(os.path.basename(path), self.upload_dir)
+            with self._lock:
+                self.completed += stored
+                self.stale += not stored
+                self._total_ms += (time.perf_counter() - start) * 1000
+        except Exception as e:
+            print(f"Image variants for candidate {candidate_id} failed: {e}")
+            with self._lock:
+                self.failed += 1
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self._executor is not None,
+                "workers": self.workers,
+                "format": IMAGE_VARIANT_FORMAT,
+                "sizes": dict(IMAGE_VARIANTS),
+                "pending": self.pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "stale": self.stale,
+                "avgMs": round(self._total_ms / self.completed, 1) if self.completed else 0.0,
+            }
+
+    def start(self, upload_dir):
+        self.upload_dir = upload_dir
+        if self._executor is None and self.enabled:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="image-variants")
+        elif self.workers > 0 and not variants_supported():
+            print(f"Image variants off: Pillow with {IMAGE_VARIANT_FORMAT} support is not installed")
+
+    async def stop(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            # Variants already being written finish; queued ones are left to the backfill job
+            await asyncio.to_thread(executor.shutdown, True, cancel_futures=True)
+
+image_variants = ImageVariants()
+
+def backfill(conn, upload_dir, workers=IMAGE_BACKFILL_WORKERS, force=False):
+    """Makes the missing variants (all of them with force) of every uploaded candidate photo."""
+    cur = conn.cursor()
+    cur.execute(BACKFILL_SQL, (force,))
+    rows = [r for r in cur.fetchall() if os.path.exists(os.path.join(upload_dir, r['image_url'].split("/")[-1]))]
+    conn.rollback()
+    report = {"photos": len(rows), "converted": 0, "failed": 0, "stale": 0}
+    executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = {executor.submit(make_variants, os.path.join(upload_dir, r['image_url'].split("/")[-1])): r for r in rows}
+        for future in as_completed(futures):
+            r = futures[future]
+            try:
+                names = future.result()
+            except Exception as e:
+                print(f"  candidate {r['id']}: {e}")
+                report["failed"] += 1
+                continue
+            if _store(cur, r['id'], r['image_url'], names):
+                report["converted"] += 1
+            else:
+                remove_variants(r['image_url'].split("/")[-1], upload_dir)
+                report["stale"] += 1
+            conn.commit()
+    finally:
+        executor.shutdown(cancel_futures=True)
+        cur.close()
+    return report
+
+if __name__ == "__main__":
+    # python image_variants.py [--force]
+    if not variants_supported():
+        sys.exit(f"Pillow with {IMAGE_VARIANT_FORMAT} support is required: pip install Pillow")
+    upload_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
+    conn = get_db_connection()
+    if conn is None:
+        sys.exit("Could not connect to the database")
+    print(f"Backfilling {IMAGE_VARIANT_FORMAT} variants {dict(IMAGE_VARIANTS)} of {upload_dir} "
+          f"on {IMAGE_BACKFILL_WORKERS} processes")
+    start = time.perf_counter()
+    try:
+        report = backfill(conn, upload_dir, force="--force" in sys.argv)
+    finally:
+        conn.close()
+    print(f"{report['photos']} photos: {report['converted']} converted, {report['failed']} failed, "
+          f"{report['stale']} replaced meanwhile, in {time.perf_counter() - start:.1f} s")
@@ -1,27 +1,57 @@
-from fastapi import FastAPI, HTTPException, status, Depends, Security
+from fastapi import FastAPI, HTTPException, status, Depends, Security, Response, Query, Header, Request
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from typing import List, Optional, Union
 import base64
+import json
 import uuid
 import os
 import psycopg2
 import hashlib
+import time
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 import random
-import string
+import tempfile
 
 # Import local modules
-from database import get_db_connection, init_db
+from database import init_db, db_pool, PoolTimeoutError, resolve_election_ref, resolve_election_set
+from async_database import (
+    DB_ENGINE, open_async_pool, close_async_pool, async_pool_stats,
+    acquire_session, release_session
+)
+from vote_pipeline import VOTE_PIPELINE, vote_pipeline
+from vote_counters import VOTE_COUNT_SQL, compact_vote_shards, start_compactor, stop_compactor
+from vote_ledger import VOTE_LEDGER, record_votes_sql, recount, start_materializer, stop_materializer
+from results_cache import results_cache
+from ballot_cache import TOKEN_BALLOT_SQL, ballot_cache
+from results_stream import results_broadcaster, StreamFull
+from exports import (
+    EXPORT_MEDIA_TYPES, TOKEN_COLUMNS, RESULT_COLUMNS, export_formats, export_stream, tokens_export_sql, results_export_sql
+)
+from token_allocator import TokenSpaceExhausted, token_allocator
+from token_filter import token_filter
+from admission import admission
+from principal_cache import principal_cache
+from password_hashing import BCRYPT_ROUNDS, PasswordHasherBusy, password_hasher
+from candidate_photos import receive_photo, remove_photo
+from image_variants import image_variants
+from roster_import import ROSTER_FORMATS, ROSTER_IMPORT_MAX_BYTES, import_jobs, run_in_background as run_import_in_background
+from token_batches import (
+    token_jobs, new_batch_id, generate_batch, run_in_background,
+    BATCH_SUMMARY_SQL, TOKEN_PAGE_LIMIT, TOKEN_PAGE_MAX, TOKEN_STATUS_FILTERS, token_page_sql,
+    compact_batch_deltas, start_batch_compactor, stop_batch_compactor, token_usage
+)
+from http_cache import CATALOG_VERSION_SQL, TOKEN_CANDIDATES_SOURCE, votes_version_sql, make_etag, is_fresh, not_modified, set_etag, json_with_etag
 from models import (
     UserRegister, UserLogin, UserResponse,
     Token, TokenData,
     CandidateCreate, CandidateResponse,
     ElectionCreate, ElectionUpdate, ElectionResponse,
-    VoteRequest, TokenGenerateRequest, VotingTokenResponse, TokenLoginRequest, TokenAddRequest
+    VoteRequest, TokenGenerateRequest, VotingTokenResponse, TokenLoginRequest, TokenAddRequest, TokenPushRequest
 )
 
 # --- Configuration ---
@@ -71,20 +101,63 @@ if not os.path.exists(UPLOAD_DIR):
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
     init_db()
+    db_pool.open()
+    token_allocator.start()
+    await open_async_pool()
+    if VOTE_PIPELINE:
+        await vote_pipeline.start()
+    start_compactor()
+    start_materializer()
+    start_batch_compactor()
+    token_filter.start()
+    principal_cache.start()
+    await password_hasher.start()
+    await admission.start()
+    image_variants.start(UPLOAD_DIR)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await results_broadcaster.stop()
+    await image_variants.stop()
+    await admission.stop()
+    await principal_cache.stop()
+    await password_hasher.stop()
+    await token_filter.stop()
+    await stop_batch_compactor()
+    await stop_materializer()
+    await stop_compactor()
+    await vote_pipeline.stop()
+    await close_async_pool()
+    db_pool.closeall()
 
 # --- Helper Functions ---
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def get_password_hash(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise server_busy()
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, user: dict) -> bool:
+    """Checks the password against the user's hash; re-hashes it when BCRYPT_ROUNDS has changed"""
+    try:
+        matches, new_hash = await password_hasher.verify(plain_password, user['password'])
+    except PasswordHasherBusy:
+        raise server_busy()
+    if new_hash:
+        try:
+            async with request_session() as db, db.transaction():
+                # Only if nobody changed the password meanwhile
+                await db.execute("UPDATE users SET password = $1 WHERE id = $2 AND password = $3",
+                                 new_hash, user['id'], user['password'])
+        except Exception as e:
+            print(f"Password rehash failed for user {user['id']}: {e}")
+    return matches
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -96,12 +169,52 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def server_busy():
+    """503 for an exhausted connection pool; clients should back off and retry"""
+    return HTTPException(status_code=503, detail="Server is busy, please try again", headers={"Retry-After": "1"})
+
+def get_db():
+    """Borrows a pooled connection for the lifetime of the request"""
+    try:
+        conn = db_pool.getconn()
+    except PoolTimeoutError:
+        raise server_busy()
+    except psycopg2.OperationalError as e:
+        throw_db_error(e)
+    try:
+        yield conn
+    finally:
+        db_pool.putconn(conn)
+
+@asynccontextmanager
+async def request_session():
+    """get_session for handlers that need a connection for only part of the request"""
+    try:
+        db = await acquire_session()
+    except PoolTimeoutError:
+        raise server_busy()
+    except (psycopg2.OperationalError, OSError) as e:
+        throw_db_error(e)
+    try:
+        yield db
+    finally:
+        await release_session(db)
+
+async def get_session():
+    """Borrows a session from the configured engine (asyncpg, or psycopg2 when DB_ENGINE=sync)"""
+    async with request_session() as db:
+        yield db
+
 def get_current_user(token: str = Depends(oauth2_scheme)):
+    """Resolves the bearer token to its users row (principal_cache se; a connection only on a miss)"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    user = principal_cache.get(token)
+    if user is not None:
+        return user
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -111,17 +224,25 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
         token_data = TokenData(email=email, role=role)
     except JWTError:
         raise credentials_exception
-        
-    conn = get_db_connection()
-    if not conn: raise HTTPException(status_code=500, detail="Database connection failed")
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE email = %s", (token_data.email,))
-    user = cur.fetchone()
-    cur.close()
-    conn.close()
-    
+
+    generation = principal_cache.generation()
+    try:
+        conn = db_pool.getconn()
+    except PoolTimeoutError:
+        raise server_busy()
+    except psycopg2.OperationalError as e:
+        throw_db_error(e)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM users WHERE email = %s", (token_data.email,))
+        user = cur.fetchone()
+        cur.close()
+    finally:
+        db_pool.putconn(conn)
+
     if user is None:
         raise credentials_exception
+    principal_cache.put(token, dict(user), payload.get("exp", float("inf")), generation)
     return user
 
 def get_current_admin_user(current_user: dict = Depends(get_current_user)):
@@ -133,49 +254,54 @@ def throw_db_error(e=None):
     if e: print(f"DB Error: {e}")
     raise HTTPException(status_code=500, detail="Database connection failed")
 
+def resolve_token_elections(cur, election_refs):
+    """elections.id of every reference a token is issued for: 400 for none, 404 for one that matches nothing"""
+    if not election_refs:
+        raise HTTPException(status_code=400, detail="A token needs at least one election")
+    election_ids = []
+    for eid in election_refs:
+        resolved = resolve_election_ref(cur, eid, create=True)
+        if resolved is None:
+            raise HTTPException(status_code=404, detail=f"Election {eid} not found")
+        election_ids.append(resolved)
+    return election_ids
+
 # --- Auth Endpoints ---
 
 @app.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-def register(user: UserRegister):
-    conn = get_db_connection()
-    if not conn: throw_db_error()
-    cur = conn.cursor()
-    try:
-        hashed_pw = get_password_hash(user.password)
-        cur.execute(
-            """
-            INSERT INTO users (username, email, password, role, has_voted)
-            VALUES (%s, %s, %s, %s, FALSE)
-            RETURNING id, username, email, role, has_voted
-            """,
-            (user.username, user.email, hashed_pw, user.role)
-        )
-        new_user = cur.fetchone()
-        conn.commit()
-        return new_user
-    except psycopg2.IntegrityError:
-        conn.rollback()
+async def register(user: UserRegister):
+    hashed_pw = await get_password_hash(user.password)
+    async with request_session() as db:
+        try:
+            async with db.transaction():
+                new_user = await db.fetchrow(
+                    """
+                    INSERT INTO users (username, email, password, role, has_voted)
+                    VALUES ($1, $2, $3, $4, FALSE)
+                    ON CONFLICT DO NOTHING
+                    RETURNING id, username, email, role, has_voted
+                    """,
+                    user.username, user.email, hashed_pw, user.role
+                )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    if new_user is None:
         raise HTTPException(status_code=400, detail="Email already registered")
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+    return dict(new_user)
+
+async def find_user(email: str):
+    """users row by email; the connection goes back to the pool before the password is checked"""
+    async with request_session() as db:
+        user = await db.fetchrow("SELECT * FROM users WHERE email = $1", email)
+    return dict(user) if user else None
 
 # Compatible with OAuth2 standard form (username, password)
 @app.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    conn = get_db_connection()
-    if not conn: throw_db_error()
-    cur = conn.cursor()
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     # OAuth2 spec uses 'username' field, but we treat it as email
-    cur.execute("SELECT * FROM users WHERE email = %s", (form_data.username,))
-    user = cur.fetchone()
-    cur.close()
-    conn.close()
+    user = await find_user(form_data.username)
 
-    if not user or not verify_password(form_data.password, user['password']):
+    if not user or not await verify_password(form_data.password, user):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -189,17 +315,11 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     return {"access_token": access_token, "token_type": "bearer", "role": user['role']}
 
 @app.post("/login", response_model=Token)
-def login_json(user_login: UserLogin):
+async def login_json(user_login: UserLogin):
     """JSON body login endpoint for generic frontend usage"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE email = %s", (user_login.email,))
-    user = cur.fetchone()
-    cur.close()
-    conn.close()
+    user = await find_user(user_login.email)
 
-    if not user or not verify_password(user_login.password, user['password']):
+    if not user or not await verify_password(user_login.password, user):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -212,41 +332,62 @@ def login_json(user_login: UserLogin):
 def read_users_me(current_user: dict = Depends(get_current_user)):
     return current_user
 
+@app.post("/admin/users/import", status_code=status.HTTP_202_ACCEPTED)
+async def import_users(request: Request, format: Optional[str] = None, rounds: int = Query(BCRYPT_ROUNDS, ge=4, le=16)):
+    """Admin: Bulk user (roster) import. The request body is the CSV or NDJSON file; it is spooled to disk
+    and imported in the background (see roster_import.py). Poll /admin/users/import/{importId} for the report."""
+    fmt = format or ("ndjson" if "json" in request.headers.get("content-type", "") else "csv")
+    if fmt not in ROSTER_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(ROSTER_FORMATS)}")
+    fd, path = tempfile.mkstemp(prefix="roster-", suffix=f".{fmt}")
+    try:
+        size = 0
+        with os.fdopen(fd, "wb") as spool:
+            async for part in request.stream():
+                size += len(part)
+                if size > ROSTER_IMPORT_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Roster larger than {ROSTER_IMPORT_MAX_BYTES} bytes")
+                spool.write(part)
+    except BaseException:
+        os.unlink(path)
+        raise
+    job = import_jobs.start(fmt, rounds)
+    run_import_in_background(job, path)
+    return job.to_dict()
+
+@app.get("/admin/users/import/{import_id}")
+def get_import_progress(import_id: str):
+    """Admin: Progress and report (duplicates, invalid rows) of a recent roster import on this worker"""
+    job = import_jobs.get(import_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No import with this id on this worker")
+    return job.to_dict()
+
 # --- Election Endpoints (Public Read, Admin Write) ---
 
 @app.get("/elections", response_model=List[ElectionResponse])
-def get_elections(token: Optional[str] = None):
-    """Sare elections ya filter by token (Voter authorized list)"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
-    cur = conn.cursor()
+async def get_elections(response: Response, token: Optional[str] = None,
+                        if_none_match: Optional[str] = Header(None), db = Depends(get_session)):
+    """Sare elections ya filter by token (Voter authorized list, from ballot_cache). ETag = catalog version (304 if unchanged)"""
     try:
         if token:
-            token_str = token.strip().upper()
-            cur.execute("""
-                SELECT e.* 
-                FROM elections e
-                JOIN token_elections te ON (e.id::text = te.election_id OR e.name = te.election_id)
-                JOIN voting_tokens vt ON te.token_id = vt.id
-                WHERE vt.token = %s
-                ORDER BY e.created_at DESC
-            """, (token_str,))
-        else:
-            cur.execute("SELECT * FROM elections ORDER BY created_at DESC")
-            
-        results = cur.fetchall()
-        return results
+            rec = await db.fetchrow(TOKEN_BALLOT_SQL, token.strip().upper())
+            etag = make_etag("elections", token, rec['catalog'])
+            if is_fresh(if_none_match, etag):
+                return not_modified(etag)
+            ballot = await ballot_cache.get(db, rec['election_set_id'], rec['catalog'])
+            return json_with_etag(ballot.elections_json, etag)
+        etag = make_etag("elections", token, await db.fetchval(CATALOG_VERSION_SQL))
+        if is_fresh(if_none_match, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
+        return await db.fetch("SELECT * FROM elections ORDER BY created_at DESC")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
 
 @app.post("/elections", response_model=ElectionResponse, status_code=status.HTTP_201_CREATED)
-def create_election(election: ElectionCreate):
+def create_election(election: ElectionCreate, conn = Depends(get_db)):
     """API for adding a new election (Security Removed)"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
     cur = conn.cursor()
     try:
         cur.execute(
@@ -259,19 +400,17 @@ def create_election(election: ElectionCreate):
         )
         new_election = cur.fetchone()
         conn.commit()
+        results_cache.invalidate()
         return new_election
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
 
 @app.put("/elections/{id}", response_model=ElectionResponse)
-def update_election(id: int, election: ElectionUpdate):
+def update_election(id: int, election: ElectionUpdate, conn = Depends(get_db)):
     """Admin calls this to edit election details"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
     cur = conn.cursor()
     try:
         # Build dynamic update query
@@ -286,6 +425,7 @@ def update_election(id: int, election: ElectionUpdate):
         cur.execute(f"UPDATE elections SET {set_clause} WHERE id = %s RETURNING *", values)
         updated = cur.fetchone()
         conn.commit()
+        results_cache.invalidate()
         if not updated:
             raise HTTPException(status_code=404, detail="Election not found")
         return updated
@@ -294,13 +434,10 @@ def update_election(id: int, election: ElectionUpdate):
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
 
 @app.patch("/elections/{id}/status")
-def update_election_status(id: int, status: str):
+def update_election_status(id: int, status: str, conn = Depends(get_db)):
     """Admin: Start, Pause, or End an election (Status Control)"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
     cur = conn.cursor()
     try:
         # Validate status
@@ -321,6 +458,7 @@ def update_election_status(id: int, status: str):
             raise HTTPException(status_code=404, detail="Election not found")
         
         conn.commit()
+        results_cache.invalidate()
         return {
             "status": "success",
             "election": updated,
@@ -334,111 +472,96 @@ def update_election_status(id: int, status: str):
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
 
 @app.delete("/elections/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_election(id: int):
+def delete_election(id: int, conn = Depends(get_db)):
     """Admin calls this to delete an election"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
     cur = conn.cursor()
     try:
         cur.execute("DELETE FROM elections WHERE id = %s RETURNING id", (id,))
         if not cur.fetchone():
             raise HTTPException(status_code=404, detail="Election not found")
         conn.commit()
+        results_cache.invalidate()
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
 
 @app.get("/elections/{id}", response_model=ElectionResponse)
-def get_election_by_id(id: Union[int, str]):
+def get_election_by_id(id: Union[int, str], conn = Depends(get_db)):
     """Sari details ek specific election ki (ID ke zariye)"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
     cur = conn.cursor()
-    # Handle int or str ID
-    if str(id).isdigit():
-        cur.execute("SELECT * FROM elections WHERE id = %s", (int(id),))
-    else:
-        # If they use a string code, we might need a separate column or just check name?
-        # For now, let's keep it consistent with the user's intent
-        cur.execute("SELECT * FROM elections WHERE name = %s", (str(id),))
-    
-    result = cur.fetchone()
+    # Handle int ID, alias code (ELEC-001) or name
+    election_id = resolve_election_ref(cur, id)
+    result = None
+    if election_id is not None:
+        cur.execute("SELECT * FROM elections WHERE id = %s", (election_id,))
+        result = cur.fetchone()
     cur.close()
-    conn.close()
     if not result:
         raise HTTPException(status_code=404, detail="Election not found")
     return result
 
 @app.get("/elections/{id}/candidates", response_model=List[CandidateResponse])
-def get_election_candidates(id: str):
-    """Ek specific election ke sare candidates (Admin/User app link karne ke liye)"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
+def get_election_candidates(id: str, response: Response, if_none_match: Optional[str] = Header(None), conn = Depends(get_db)):
+    """Ek specific election ke sare candidates (Admin/User app link karne ke liye). ETag = catalog + vote versions"""
     cur = conn.cursor()
-    cur.execute("SELECT id, name, position, party, election_id, image_url, vote_count, image_url as image FROM candidates WHERE election_id = %s", (id,))
+    election_id = resolve_election_ref(cur, id)
+    cur.execute(votes_version_sql(where="c.election_id = %s"), (election_id,))
+    v = cur.fetchone()
+    etag = make_etag("election-candidates", election_id, v['catalog'], v['tallies'], v['votes'])
+    if is_fresh(if_none_match, etag):
+        cur.close()
+        return not_modified(etag)
+    set_etag(response, etag)
+    cur.execute(f"SELECT c.id, c.name, c.position, c.party, c.election_id::text AS election_id, c.image_url, c.image_variants, {VOTE_COUNT_SQL} AS vote_count, c.image_url as image FROM candidates c WHERE c.election_id = %s ORDER BY c.id", (election_id,))
     results = cur.fetchall()
     cur.close()
-    conn.close()
     return results
 
 # --- Candidates Endpoints (Public Read, Admin Write) ---
 
 @app.get("/candidates", response_model=List[CandidateResponse])
-def get_candidates(token: Optional[str] = None):
-    """Sare candidates ya filter by token (Sari details ke saath)"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
-    cur = conn.cursor()
+async def get_candidates(response: Response, token: Optional[str] = None,
+                         if_none_match: Optional[str] = Header(None), db = Depends(get_session)):
+    """Sare candidates ya filter by token (Sari details ke saath). ETag = catalog + vote versions"""
     try:
-        if token:
-            token_str = token.strip().upper()
-            # 1. Pehle token ke authorized election IDs nikalen
-            cur.execute("""
-                SELECT te.election_id 
-                FROM token_elections te
-                JOIN voting_tokens vt ON te.token_id = vt.id
-                WHERE vt.token = %s
-            """, (token_str,))
-            rows = cur.fetchall()
-            election_ids = [r['election_id'] for r in rows]
-            
-            if not election_ids:
-                return []
-            
-            # 2. In elections ke candidates nikalen
-            cur.execute("""
-                SELECT id, name, position, party, election_id, image_url, vote_count, image_url as image 
-                FROM candidates 
-                WHERE election_id IN %s
-            """, (tuple(election_ids),))
-        else:
-            # Pura data (Admin ya general view ke liye)
-            cur.execute("SELECT id, name, position, party, election_id, image_url, vote_count, image_url as image FROM candidates")
-            
-        results = cur.fetchall()
-        return results
+        token_str = token.strip().upper() if token else None
+        if token_str:
+            # Token ke authorized elections ke candidates: ballot_cache se, sirf vote counts fresh
+            rec = await db.fetchrow(TOKEN_BALLOT_SQL, token_str)
+            ballot = await ballot_cache.get(db, rec['election_set_id'], rec['catalog'])
+            counts = {}
+            if ballot.candidate_ids:
+                rows = await db.fetch(f"SELECT c.id, {VOTE_COUNT_SQL} AS vote_count FROM candidates c WHERE c.id = ANY($1::int[])",
+                                      ballot.candidate_ids)
+                counts = {r['id']: r['vote_count'] for r in rows}
+            etag = make_etag("candidates", token_str, rec['catalog'], rec['tallies'], sum(counts.values()))
+            if is_fresh(if_none_match, etag):
+                return not_modified(etag)
+            return json_with_etag(ballot.candidates_json(counts), etag)
+        v = await db.fetchrow(votes_version_sql())
+        etag = make_etag("candidates", token_str, v['catalog'], v['tallies'], v['votes'])
+        if is_fresh(if_none_match, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
+        # Pura data (Admin ya general view ke liye)
+        return await db.fetch(f"SELECT c.id, c.name, c.position, c.party, c.election_id::text AS election_id, c.image_url, c.image_variants, {VOTE_COUNT_SQL} AS vote_count, c.image_url as image FROM candidates c ORDER BY c.id")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
 
 @app.post("/candidates", response_model=CandidateResponse, status_code=status.HTTP_201_CREATED)
-def add_candidate(candidate: CandidateCreate):
+def add_candidate(candidate: CandidateCreate, conn = Depends(get_db)):
     """API for adding a new candidate (Security Removed)"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
     cur = conn.cursor()
     try:
-        # 1. Skip strictly checking Election ID if it's a string code like 'ELEC-001'
+        # 1. Resolve the Election ID; unknown codes like 'ELEC-001' get a placeholder election
         # This allows linking Admin and User apps even without a formal Election record
-        pass 
+        election_id = resolve_election_ref(cur, candidate.election_id, create=True)
+        if election_id is None:
+            raise HTTPException(status_code=404, detail="Election not found")
 
         # 2. Handle Base64 Image Upload
         image_url = ""
@@ -482,30 +605,32 @@ def add_candidate(candidate: CandidateCreate):
             """
             INSERT INTO candidates (name, position, party, election_id, image_url, vote_count)
             VALUES (%s, %s, %s, %s, %s, 0)
-            RETURNING id, name, position, party, election_id, image_url, vote_count
+            RETURNING id, name, position, party, election_id::text AS election_id, image_url, image_variants, vote_count
             """,
-            (candidate.name, candidate.position, candidate.party, candidate.election_id, image_url)
+            (candidate.name, candidate.position, candidate.party, election_id, image_url)
         )
         row = cur.fetchone()
         conn.commit()
+        results_cache.invalidate()
+        image_variants.submit(row['id'], image_url)
         
         # Prepare response (ensure both image and imageUrl are set)
         response = dict(row)
         # Add alias fields for frontend mapping
         response["image"] = response["image_url"]
         return response
+    except HTTPException as he:
+        conn.rollback()
+        raise he
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
 
 @app.put("/candidates/{id}", response_model=CandidateResponse)
-def update_candidate(id: int, candidate: CandidateCreate):
+def update_candidate(id: int, candidate: CandidateCreate, conn = Depends(get_db)):
     """Admin calls this to edit candidate details and potentially update image"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
     cur = conn.cursor()
     try:
         # Get old candidate to see if we need to delete old image
@@ -515,16 +640,16 @@ def update_candidate(id: int, candidate: CandidateCreate):
             raise HTTPException(status_code=404, detail="Candidate not found")
         
         image_url = old_data['image_url']
+
+        election_id = resolve_election_ref(cur, candidate.election_id, create=True)
+        if election_id is None:
+            raise HTTPException(status_code=404, detail="Election not found")
         
         # Handle New Image if provided (as Base64)
         raw_image_data = candidate.image_base64 or candidate.image or candidate.photo or candidate.image_url
         if raw_image_data and str(raw_image_data).startswith("data:image"):
-            # Delete old image file if it exists
-            if old_data['image_url']:
-                old_filename = old_data['image_url'].split("/")[-1]
-                old_path = os.path.join(UPLOAD_DIR, old_filename)
-                if os.path.exists(old_path):
-                    os.remove(old_path)
+            # Delete old image file (and its resized variants) if it exists
+            remove_photo(old_data['image_url'], UPLOAD_DIR)
             
             # Save new image
             header, encoded = raw_image_data.split(",", 1)
@@ -539,102 +664,142 @@ def update_candidate(id: int, candidate: CandidateCreate):
             image_url = f"{BASE_URL}/uploads/{filename}"
 
         cur.execute(
-            """
-            UPDATE candidates 
-            SET name = %s, position = %s, party = %s, election_id = %s, image_url = %s
-            WHERE id = %s RETURNING id, name, position, party, election_id, image_url, vote_count
+            f"""
+            UPDATE candidates c
+            SET name = %s, position = %s, party = %s, election_id = %s, image_url = %s,
+                image_variants = CASE WHEN c.image_url IS DISTINCT FROM %s THEN NULL ELSE c.image_variants END
+            WHERE id = %s RETURNING id, name, position, party, election_id::text AS election_id, image_url, image_variants, {VOTE_COUNT_SQL} AS vote_count
             """,
-            (candidate.name, candidate.position, candidate.party, candidate.election_id, image_url, id)
+            (candidate.name, candidate.position, candidate.party, election_id, image_url, image_url, id)
         )
         row = cur.fetchone()
         conn.commit()
+        results_cache.invalidate()
+        if image_url != old_data['image_url']:
+            image_variants.submit(id, image_url)
         
         response = dict(row)
         response["image"] = response["image_url"]
         return response
+    except HTTPException as he:
+        conn.rollback()
+        raise he
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
+
+@app.put("/candidates/{id}/photo", response_model=CandidateResponse)
+async def upload_candidate_photo(id: int, request: Request):
+    """Admin: Replace a candidate's photo with an image file, sent as the raw body or as a multipart `file` part.
+    Streamed to disk with a size cap; JPEG / PNG / WebP checked from the file's own bytes (see candidate_photos.py)"""
+    filename = await receive_photo(request, UPLOAD_DIR)
+    image_url = f"{BASE_URL}/uploads/{filename}"
+    try:
+        async with request_session() as db, db.transaction():
+            old = await db.fetchrow("SELECT image_url FROM candidates WHERE id = $1 FOR UPDATE", id)
+            if old is None:
+                raise HTTPException(status_code=404, detail="Candidate not found")
+            row = await db.fetchrow(f"""
+                UPDATE candidates c SET image_url = $1, image_variants = NULL
+                WHERE id = $2 RETURNING id, name, position, party, election_id::text AS election_id, image_url, image_variants, {VOTE_COUNT_SQL} AS vote_count
+            """, image_url, id)
+    except BaseException:
+        remove_photo(image_url, UPLOAD_DIR)
+        raise
+    results_cache.invalidate()
+    remove_photo(old['image_url'], UPLOAD_DIR)
+    image_variants.submit(id, image_url)
+
+    response = dict(row)
+    response["image"] = response["image_url"]
+    return response
 
 @app.delete("/candidates/{id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_candidate(id: int):
+def delete_candidate(id: int, conn = Depends(get_db)):
     """Deletes candidate and their photo from storage"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
     cur = conn.cursor()
     try:
         # Get image URL first to delete file
         cur.execute("SELECT image_url FROM candidates WHERE id = %s", (id,))
         row = cur.fetchone()
-        if row and row['image_url']:
-            filename = row['image_url'].split("/")[-1]
-            filepath = os.path.join(UPLOAD_DIR, filename)
-            if os.path.exists(filepath):
-                os.remove(filepath)
+        if row:
+            remove_photo(row['image_url'], UPLOAD_DIR)
         
         cur.execute("DELETE FROM candidates WHERE id = %s RETURNING id", (id,))
         if not cur.fetchone():
             raise HTTPException(status_code=404, detail="Candidate not found")
         conn.commit()
+        results_cache.invalidate()
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
 
 # --- ADMIN APIS (Specifically for Admin Panel) ---
 
 @app.post("/admin/save-token")
-def admin_save_token(req: TokenAddRequest):
-    """Admin Pannel se token push karne ki API - Multi-Election Support"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
+def admin_save_token(req: TokenAddRequest, conn = Depends(get_db)):
+    """Admin Pannel se token push karne ki API - Multi-Election Support.
+    Token na diya ho to token_allocator se naya code milta hai"""
     cur = conn.cursor()
     try:
         batch_id = f"S-{random.randint(1000, 9999)}" # S for Save (Manual)
-        token_str = req.token.strip().upper()
-        
-        # 1. Insert Token
-        cur.execute(
-            "INSERT INTO voting_tokens (token, batch_id) VALUES (%s, %s) RETURNING id",
-            (token_str, batch_id)
-        )
-        token_id = cur.fetchone()['id']
-        
-        # 2. Link to Elections
-        for eid in req.election_ids:
+
+        # 1. Elections -> the token's election set
+        election_set_id = resolve_election_set(cur, resolve_token_elections(cur, req.election_ids))
+
+        # 2. Insert Token (allocated codes only clash with older/manual ones: take the next code)
+        token_id = None
+        if req.token:
+            token_str = req.token.strip().upper()
+            if not token_allocator.is_well_formed(token_str):
+                raise HTTPException(status_code=400, detail="Token does not have a valid check character")
             cur.execute(
-                "INSERT INTO token_elections (token_id, election_id) VALUES (%s, %s)",
-                (token_id, str(eid))
+                "INSERT INTO voting_tokens (token, batch_id, election_set_id) VALUES (%s, %s, %s) ON CONFLICT (token) DO NOTHING RETURNING id",
+                (token_str, batch_id, election_set_id)
             )
+            row = cur.fetchone()
+            if not row:
+                raise HTTPException(status_code=400, detail="This token is already in the database.")
+            token_id = row['id']
+        while token_id is None:
+            token_str = token_allocator.allocate(cur, 1)[0]
+            cur.execute(
+                "INSERT INTO voting_tokens (token, batch_id, election_set_id) VALUES (%s, %s, %s) ON CONFLICT (token) DO NOTHING RETURNING id",
+                (token_str, batch_id, election_set_id)
+            )
+            row = cur.fetchone()
+            token_id = row['id'] if row else None
         
         conn.commit()
         return {"status": "success", "batchId": batch_id, "token": token_str}
+    except HTTPException:
+        conn.rollback()
+        raise
+    except TokenSpaceExhausted as e:
+        conn.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
 
 @app.get("/admin/get-tokens")
-def admin_get_all_tokens():
-    """Admin Pannel: Grouped Tokens by Batch with Election Arrays"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
+def admin_get_all_tokens(conn = Depends(get_db)):
+    """Admin Pannel: Grouped Tokens by Batch with Election Arrays (har token load hota hai; bare batches ke liye /admin/token-batches)"""
     cur = conn.cursor()
     try:
-        # Step 1: Get all batches and their linked elections
+        # Step 1: Get all batches and their linked elections (via each batch's election set)
         cur.execute("""
-            SELECT vt.batch_id, te.election_id, COALESCE(e.name, te.election_id) as election_name
-            FROM voting_tokens vt
-            JOIN token_elections te ON vt.id = te.token_id
-            LEFT JOIN elections e ON te.election_id::text = e.id::text OR te.election_id = e.name
-            GROUP BY vt.batch_id, te.election_id, e.name
+            SELECT b.batch_id, e.id::text as election_id, e.name as election_name
+            FROM (SELECT DISTINCT batch_id, election_set_id FROM voting_tokens) b
+            JOIN election_set_members m ON m.set_id = b.election_set_id
+            JOIN elections e ON e.id = m.election_id
+            GROUP BY b.batch_id, e.id, e.name
         """)
         batch_mappings = cur.fetchall()
         
@@ -661,13 +826,37 @@ def admin_get_all_tokens():
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
+
+@app.get("/admin/token-batches")
+async def admin_token_batches(db = Depends(get_session)):
+    """Admin Pannel: Har batch ka summary (total, used, unused, last used, elections), token_batch_deltas se"""
+    try:
+        await token_usage.flush(db)  # this worker's redemptions; other workers' within a compaction interval
+        return await db.fetch(BATCH_SUMMARY_SQL)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/admin/token-batches/{batch_id}/tokens")
+def admin_batch_tokens(batch_id: str, status: Optional[str] = None, after: Optional[int] = None,
+                       limit: int = Query(TOKEN_PAGE_LIMIT, ge=1, le=TOKEN_PAGE_MAX), conn = Depends(get_db)):
+    """Admin Pannel: Batch ke tokens, newest first, page by page (status=used/unused, after=nextCursor)"""
+    if status not in TOKEN_STATUS_FILTERS:
+        raise HTTPException(status_code=400, detail="status must be 'used' or 'unused'")
+    cur = conn.cursor()
+    try:
+        cur.execute(*token_page_sql(batch_id, status, after, limit + 1))
+        tokens = cur.fetchall()
+        has_more = len(tokens) > limit
+        tokens = tokens[:limit]
+        return {"batchId": batch_id, "tokens": tokens, "nextCursor": tokens[-1]['id'] if has_more else None}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cur.close()
 
 @app.delete("/admin/tokens/{token_id}", status_code=status.HTTP_204_NO_CONTENT)
-def admin_delete_token(token_id: int):
+def admin_delete_token(token_id: int, conn = Depends(get_db)):
     """Admin: Delete a specific token (Voting Control)"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
     cur = conn.cursor()
     try:
         cur.execute("DELETE FROM voting_tokens WHERE id = %s RETURNING id", (token_id,))
@@ -677,6 +866,7 @@ def admin_delete_token(token_id: int):
             raise HTTPException(status_code=404, detail="Token not found")
         
         conn.commit()
+        results_cache.invalidate()
     except HTTPException as he:
         conn.rollback()
         raise he
@@ -685,70 +875,166 @@ def admin_delete_token(token_id: int):
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
 
 @app.get("/admin/results")
-def admin_get_results():
-    """Admin Pannel: Detailed results for ALL elections with candidate stats"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
-    cur = conn.cursor()
+async def admin_get_results(if_none_match: Optional[str] = Header(None)):
+    """Admin Pannel: Detailed results for ALL elections with candidate stats. Served from results_cache (ETag = catalog + vote versions)."""
     try:
-        # 1. Get All Elections
-        cur.execute("SELECT id, name, description, status, created_at FROM elections ORDER BY created_at DESC")
-        elections = cur.fetchall()
+        return await conditional_results("admin", lambda e: {
+            "electionId": e['id'],
+            "electionName": e['name'],
+            "status": e['status'],
+            "totalVotes": e['totalVotes']
+        }, None, if_none_match)
+    except PoolTimeoutError:
+        raise server_busy()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # 2. Get All Candidates with their votes
-        cur.execute("""
-            SELECT id, name, position, party, election_id, image_url, vote_count, image_url as image 
-            FROM candidates 
-            ORDER BY election_id, vote_count DESC
-        """)
-        all_candidates = cur.fetchall()
-
-        # 3. Group them
-        results = []
-        for e in elections:
-            e_id = str(e['id'])
-            # Filter candidates for this election
-            candidates = [c for c in all_candidates if str(c['election_id']) == e_id or c['election_id'] == e['name']]
-            
-            # Calculate total votes in this election
-            total_election_votes = sum(c['vote_count'] for c in candidates)
-            
-            results.append({
-                "electionId": e['id'],
-                "electionName": e['name'],
-                "status": e['status'],
-                "totalVotes": total_election_votes,
-                "candidates": candidates
-            })
-            
-        return results
+@app.get("/admin/db-pool")
+def admin_db_pool_stats():
+    """Admin: Connection pool usage (in-use, idle, waiters, wait times)"""
+    return {"engine": DB_ENGINE, "sync": db_pool.stats(), "async": async_pool_stats(), "votePipeline": vote_pipeline.stats()}
+
+@app.get("/admin/results-cache")
+def admin_results_cache_stats():
+    """Admin: Results cache size and hit/miss counters"""
+    return results_cache.stats()
+
+@app.get("/admin/ballot-cache")
+def admin_ballot_cache_stats():
+    """Admin: Ballot cache size and hit/miss counters"""
+    return ballot_cache.stats()
+
+@app.get("/admin/token-filter")
+def admin_token_filter_stats():
+    """Admin: Token membership filter size, expected false-positive rate and rejections"""
+    return token_filter.stats()
+
+@app.get("/admin/principal-cache")
+def admin_principal_cache_stats():
+    """Admin: Bearer-token principal cache size, hit rate and invalidations"""
+    return principal_cache.stats()
+
+@app.get("/admin/password-hashing")
+def admin_password_hashing_stats():
+    """Admin: bcrypt process pool queue depth, timeouts, rehashes and average hash time"""
+    return password_hasher.stats()
+
+@app.get("/admin/image-variants")
+def admin_image_variants_stats():
+    """Admin: background thumbnail / medium photo variants: pending, made, failed and average time"""
+    return image_variants.stats()
+
+@app.get("/admin/admission")
+def admin_admission_stats():
+    """Admin: Failed-attempt limits, concurrency caps and admitted / rate-limited / shed counts per token route"""
+    return admission.stats()
+
+@app.get("/admin/results-stream")
+def admin_results_stream_stats():
+    """Admin: Live results stream subscribers and broadcast counters"""
+    return results_broadcaster.stats()
+
+@app.post("/admin/vote-counters/compact")
+async def admin_compact_vote_counters(db = Depends(get_session)):
+    """Admin: Fold the sharded vote counter slots back into candidates.vote_count"""
+    try:
+        compacted = await compact_vote_shards(db)
+        return {"status": "success", "candidatesCompacted": compacted}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
+
+@app.post("/admin/token-batches/compact")
+async def admin_compact_token_batches(recount: bool = False, db = Depends(get_session)):
+    """Admin: Fold the per-batch token count deltas (normally done every TOKEN_BATCH_COMPACT_SECONDS).
+    recount=true rebuilds them from voting_tokens; run it while no votes are being cast"""
+    try:
+        row = await compact_batch_deltas(db, recount)
+        return {"status": "success", "usedCounted": row['used'], "deltasFolded": row['moved'], "rows": row['folded']}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/admin/vote-ledger/recount")
+async def admin_recount_vote_ledger(repair: bool = False, db = Depends(get_session)):
+    """Admin (audit): Recount every ballot in the vote ledger and compare with the materialized totals"""
+    try:
+        report = await recount(db, repair)
+        if report["repaired"]:
+            results_cache.invalidate()
+        return report
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def export_response(name, fmt, columns, build_query):
+    """Streams an export on its own pooled connection, held until the last chunk is sent.
+    build_query(cur) resolves the filters and returns (query, params)."""
+    if fmt not in export_formats():
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(export_formats())}")
+    try:
+        conn = db_pool.getconn()
+    except PoolTimeoutError:
+        raise server_busy()
+    except psycopg2.OperationalError as e:
+        throw_db_error(e)
+    try:
+        cur = conn.cursor()
+        query, params = build_query(cur)
         cur.close()
-        conn.close()
+    except HTTPException:
+        db_pool.putconn(conn)
+        raise
+    except Exception as e:
+        db_pool.putconn(conn)
+        raise HTTPException(status_code=500, detail=str(e))
+    try:
+        # From here on the stream owns the connection and releases it on every path
+        body = export_stream(conn, db_pool.putconn, query, params, columns, fmt)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(body, media_type=EXPORT_MEDIA_TYPES[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'})
+
+def export_election_ref(cur, ref):
+    election_id = resolve_election_ref(cur, ref)
+    if election_id is None and ref is not None and ref.strip():
+        raise HTTPException(status_code=404, detail="Election not found")
+    return election_id
+
+@app.get("/admin/export/tokens")
+def admin_export_tokens(format: str = "csv", election_id: Optional[str] = None, batch_id: Optional[str] = None):
+    """Admin (audit/printing): Stream every token as CSV, NDJSON or Parquet. Optional election_id / batch_id filter"""
+    return export_response("tokens", format, TOKEN_COLUMNS,
+                           lambda cur: tokens_export_sql(export_election_ref(cur, election_id), batch_id))
+
+@app.get("/admin/export/results")
+def admin_export_results(format: str = "csv", election_id: Optional[str] = None):
+    """Admin (audit): Stream results, one row per candidate, as CSV, NDJSON or Parquet. Optional election_id filter"""
+    return export_response("results", format, RESULT_COLUMNS,
+                           lambda cur: results_export_sql(export_election_ref(cur, election_id)))
 
 # --- Voting Tokens (Admin to Generate, User to Use) ---
 
 @app.post("/tokens", response_model=VotingTokenResponse)
-def push_token(req: TokenAddRequest):
+def push_token(req: TokenPushRequest, conn = Depends(get_db)):
     """Admin calls this to 'PUSH' a token to the database after generating it on frontend"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
     cur = conn.cursor()
     try:
         token_str = req.token.strip().upper()
-        # Insert without checking FK because election_id is now TEXT (ELEC-001)
+        if not token_allocator.is_well_formed(token_str):
+            raise HTTPException(status_code=400, detail="Token does not have a valid check character")
+        # Eligibility lives in the token's election set, like /admin/save-token and /tokens/generate
+        election_set_id = resolve_election_set(cur, resolve_token_elections(cur, req.election_ids))
         cur.execute(
-            "INSERT INTO voting_tokens (token, election_id) VALUES (%s, %s) RETURNING id, token, election_id, is_used, used_at, created_at",
-            (token_str, req.election_id)
+            "INSERT INTO voting_tokens (token, election_set_id) VALUES (%s, %s) RETURNING id, token, batch_id, is_used, used_at, created_at",
+            (token_str, election_set_id)
         )
         new_token = cur.fetchone()
         conn.commit()
         return new_token
+    except HTTPException:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         if "unique constraint" in str(e).lower():
@@ -756,80 +1042,79 @@ def push_token(req: TokenAddRequest):
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
 
 @app.post("/tokens/generate")
-def generate_tokens(req: TokenGenerateRequest):
-    """Admin: Generate a Batch of 6-digit tokens for multiple elections"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
+def generate_tokens(req: TokenGenerateRequest, response: Response, conn = Depends(get_db)):
+    """Admin: Generate a Batch of tokens (token_allocator codes) for multiple elections (bulk COPY, see token_batches.py).
+    background=true returns 202 at once; progress at GET /tokens/generate/{batchId}"""
     cur = conn.cursor()
+    job = None
     try:
-        # Generate a short batch ID
-        batch_id = f"B-{random.randint(1000, 9999)}"
-        generated_tokens = []
-        
-        for _ in range(req.count):
-            # Generate a unique 6-digit numeric token
-            attempts = 0
-            while attempts < 10:
-                token_str = ''.join(random.choices(string.digits, k=6))
-                # Check for uniqueness
-                cur.execute("SELECT id FROM voting_tokens WHERE token = %s", (token_str,))
-                if not cur.fetchone():
-                    break
-                attempts += 1
-                
-            cur.execute(
-                "INSERT INTO voting_tokens (token, batch_id) VALUES (%s, %s) RETURNING id, token, created_at", 
-                (token_str, batch_id)
-            )
-            token_rec = cur.fetchone()
-            token_id = token_rec['id']
-            
-            # Link to all selected elections
-            for eid in req.election_ids:
-                cur.execute(
-                    "INSERT INTO token_elections (token_id, election_id) VALUES (%s, %s)", 
-                    (token_id, str(eid))
-                )
-            
-            generated_tokens.append(token_rec)
-            
+        election_ids = resolve_token_elections(cur, req.election_ids)
+        job = token_jobs.start(new_batch_id(cur), election_ids, req.count, resolve_election_set(cur, election_ids))
+        # Placeholder elections and the election set are kept even if generation fails; committing
+        # here also releases the election set lock before the long insert
+        conn.commit()
+        if req.background:
+            run_in_background(job)
+            response.status_code = status.HTTP_202_ACCEPTED
+            return job.to_dict()
+
+        generated_tokens = generate_batch(cur, job)
         conn.commit()
+        job.status = "done"
         return {
             "status": "success",
-            "batchId": batch_id,
-            "electionIds": [str(eid) for eid in req.election_ids],
+            "batchId": job.batch_id,
+            "electionIds": [str(eid) for eid in election_ids],
             "tokens": generated_tokens
         }
+    except HTTPException as he:
+        conn.rollback()
+        raise he
+    except TokenSpaceExhausted as e:
+        conn.rollback()
+        job.status, job.error = "failed", str(e)
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         conn.rollback()
+        if job is not None:
+            job.status, job.error = "failed", str(e)
         raise HTTPException(status_code=500, detail=str(e))
     finally:
+        if job is not None and not req.background:
+            job.finished = time.monotonic()
         cur.close()
-        conn.close()
+
+@app.get("/tokens/generate/{batch_id}")
+def get_token_generation_progress(batch_id: str):
+    """Admin: Progress of a (recent) token batch generation on this worker"""
+    job = token_jobs.get(batch_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No generation job for this batch on this worker")
+    return job.to_dict()
 
 @app.get("/tokens")
-def get_all_tokens(election_id: Optional[Union[int, str]] = None):
-    """Admin calls this to see all saved/pushed tokens"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
+def get_all_tokens(election_id: Optional[Union[int, str]] = None, conn = Depends(get_db)):
+    """Admin calls this to see all saved/pushed tokens, one row per token with its election set's elections"""
     cur = conn.cursor()
     
     query = """
-        SELECT vt.id, vt.token, vt.election_id, vt.is_used, vt.used_at, vt.created_at, 
-               COALESCE(e.name, 'No Election Name') as election_name 
+        SELECT vt.id, vt.token, MIN(m.election_id)::text as election_id,
+               COALESCE(array_agg(m.election_id::text ORDER BY m.election_id) FILTER (WHERE m.election_id IS NOT NULL), '{}') as election_ids,
+               vt.is_used, vt.used_at, vt.created_at,
+               COALESCE(string_agg(e.name, ', ' ORDER BY m.election_id), 'No Election Name') as election_name
         FROM voting_tokens vt
-        LEFT JOIN elections e ON vt.election_id::text = e.id::text OR vt.election_id = e.name
+        LEFT JOIN election_set_members m ON m.set_id = vt.election_set_id
+        LEFT JOIN elections e ON e.id = m.election_id
     """
     
     try:
         if election_id:
-            query += " WHERE vt.election_id = %s"
-            cur.execute(query + " ORDER BY vt.created_at DESC", (str(election_id),))
+            query += " WHERE vt.election_set_id IN (SELECT set_id FROM election_set_members WHERE election_id = %s)"
+            cur.execute(query + " GROUP BY vt.id ORDER BY vt.created_at DESC", (resolve_election_ref(cur, election_id),))
         else:
-            cur.execute(query + " ORDER BY vt.created_at DESC")
+            cur.execute(query + " GROUP BY vt.id ORDER BY vt.created_at DESC")
             
         results = cur.fetchall()
         return results
@@ -837,54 +1122,32 @@ def get_all_tokens(election_id: Optional[Union[int, str]] = None):
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
 
-@app.post("/access-token")
-@app.post("/tokens/login")
-def token_login(req: TokenLoginRequest):
-    """User Login: Returns JWT and all authorized Elections/Candidates"""
+@app.post("/access-token", dependencies=[Depends(admission.dependency("login"))])
+@app.post("/tokens/login", dependencies=[Depends(admission.dependency("login"))])
+async def token_login(req: TokenLoginRequest):
+    """User Login: Returns JWT and all authorized Elections/Candidates (ballot_cache se, per election set)"""
     token_str = req.token.strip().upper()
-    conn = get_db_connection()
-    if not conn: throw_db_error()
-    cur = conn.cursor()
-    
-    cur.execute("SELECT * FROM voting_tokens WHERE token = %s", (token_str,))
-    token_rec = cur.fetchone()
-    
-    if not token_rec:
-        cur.close()
-        conn.close()
+    if not token_allocator.may_exist(token_str):
+        raise HTTPException(status_code=404, detail="Invalid Token")  # typo: rejected without a lookup
+    verdict = token_filter.check(token_str)  # guesses / used codes: rejected before taking a connection
+    if verdict == "invalid":
         raise HTTPException(status_code=404, detail="Invalid Token")
-    
-    if token_rec['is_used']:
-        cur.close()
-        conn.close()
+    if verdict == "used":
         raise HTTPException(status_code=400, detail="Token already used")
+
+    async with request_session() as db:
+        token_rec = await db.fetchrow(TOKEN_BALLOT_SQL, token_str)
     
-    token_id = token_rec['id']
-    
-    # 1. Get all linked Elections
-    cur.execute("""
-        SELECT te.election_id as id, COALESCE(e.name, te.election_id) as name
-        FROM token_elections te
-        LEFT JOIN elections e ON te.election_id::text = e.id::text OR te.election_id = e.name
-        WHERE te.token_id = %s
-    """, (token_id,))
-    elections = cur.fetchall()
+        if token_rec['token'] is None:
+            raise HTTPException(status_code=404, detail="Invalid Token")
     
-    # 2. Get Candidates for all these elections
-    election_ids = [e['id'] for e in elections]
-    candidates = []
-    if election_ids:
-        cur.execute("""
-            SELECT id, name, position, party, election_id, image_url, image_url as image 
-            FROM candidates 
-            WHERE election_id IN %s
-        """, (tuple(election_ids),))
-        candidates = cur.fetchall()
+        if token_rec['is_used']:
+            token_filter.mark_used(token_str)
+            raise HTTPException(status_code=400, detail="Token already used")
     
-    cur.close()
-    conn.close()
+        # Linked elections + their candidates: one pre-serialized ballot per election set
+        ballot = await ballot_cache.get(db, token_rec['election_set_id'], token_rec['catalog'])
 
     # Generate JWT
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -892,220 +1155,246 @@ def token_login(req: TokenLoginRequest):
         data={"sub": f"voter_{token_str}", "role": "voter", "token": token_str}, 
         expires_delta=access_token_expires
     )
-    
-    return {
+
+    head = json.dumps({
         "status": "success",
         "accessToken": jwt_token,
         "tokenType": "bearer",
         "votingToken": token_rec['token'],
-        "authorizedElections": elections,
-        "candidates": candidates,
         "user": { "role": "voter", "token": token_rec['token'] }
-    }
+    })
+    return Response(content=f'{head[:-1]}, {ballot.login_json}}}', media_type="application/json")
 
 # --- Voting Logic ---
 
-@app.post("/vote")
-def vote(vote_req: VoteRequest):
+@app.post("/vote", dependencies=[Depends(admission.dependency("vote"))])
+async def vote(vote_req: VoteRequest):
     """Token-based and User-based Single-Use Voting API"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
-    cur = conn.cursor()
-    try:
-        # Case 1: Voting via Token (Single-Use, Multi-Election Support)
-        if vote_req.token:
-            token_str = vote_req.token.strip().upper()
-            cur.execute("SELECT * FROM voting_tokens WHERE token = %s", (token_str,))
-            token_rec = cur.fetchone()
-            
-            if not token_rec:
-                raise HTTPException(status_code=404, detail="Token not found")
-            if token_rec['is_used']:
-                raise HTTPException(status_code=400, detail="This token has already been used and is now expired")
+    # Identify which candidates the voter wants to vote for
+    target_ids = []
+    if vote_req.candidate_ids:
+        target_ids = vote_req.candidate_ids
+    elif vote_req.candidate_id:
+        target_ids = [vote_req.candidate_id]
+
+    if vote_req.token:
+        # Typos, guesses and used codes are turned away before a connection is taken
+        token_str = vote_req.token.strip().upper()
+        if not token_allocator.may_exist(token_str):
+            raise HTTPException(status_code=404, detail="Token not found")
+        verdict = token_filter.check(token_str)
+        if verdict == "invalid":
+            raise HTTPException(status_code=404, detail="Token not found")
+        if verdict == "used":
+            raise HTTPException(status_code=400, detail="This token has already been used and is now expired")
+
+    async with request_session() as db:
+        try:
+            # Case 1: Voting via Token (Single-Use, Multi-Election Support)
+            if vote_req.token:
+                # Token lookup + validation of the whole ballot in one set-based query
+                rows = await db.fetch("""
+                    SELECT vt.id AS token_id, vt.is_used, c.id AS candidate_id, c.election_id
+                    FROM voting_tokens vt
+                    LEFT JOIN candidates c ON c.id = ANY($2::int[])
+                        AND EXISTS (SELECT 1 FROM election_set_members m WHERE m.set_id = vt.election_set_id AND m.election_id = c.election_id)
+                    WHERE vt.token = $1
+                """, token_str, target_ids)
             
-            # Identify which candidates the user wants to vote for
-            target_ids = []
-            if vote_req.candidate_ids:
-                target_ids = vote_req.candidate_ids
-            elif vote_req.candidate_id:
-                target_ids = [vote_req.candidate_id]
-            else:
-                raise HTTPException(status_code=400, detail="Please provide at least one candidate ID to vote")
-
-            # Validate each candidate and track elections to prevent double voting
-            seen_elections = set()
-            for c_id in target_ids:
-                cur.execute("""
-                    SELECT c.id, c.election_id 
-                    FROM candidates c
-                    JOIN token_elections te ON c.election_id = te.election_id
-                    WHERE c.id = %s AND te.token_id = %s
-                """, (c_id, token_rec['id']))
-                cand_info = cur.fetchone()
+                if not rows:
+                    raise HTTPException(status_code=404, detail="Token not found")
+                token_rec = rows[0]
+                if token_rec['is_used']:
+                    token_filter.mark_used(token_str)
+                    raise HTTPException(status_code=400, detail="This token has already been used and is now expired")
+                if not target_ids:
+                    raise HTTPException(status_code=400, detail="Please provide at least one candidate ID to vote")
+
+                # Validate each candidate and track elections to prevent double voting
+                authorized = {r['candidate_id']: r['election_id'] for r in rows if r['candidate_id'] is not None}
+                seen_elections = set()
+                for c_id in target_ids:
+                    if c_id not in authorized:
+                        raise HTTPException(status_code=403, detail=f"Candidate ID {c_id} is not in your authorized elections")
                 
-                if not cand_info:
-                    raise HTTPException(status_code=403, detail=f"Candidate ID {c_id} is not in your authorized elections")
+                    eid = authorized[c_id]
+                    if eid in seen_elections:
+                        raise HTTPException(status_code=400, detail=f"You can only vote for ONE candidate per election. Error at election: {eid}")
+                    seen_elections.add(eid)
+
+                # --- EXPIRE TOKEN + PROCESS VOTES ---
+                if vote_pipeline.running:
+                    # Group commit: resolves once the batch holding this ballot is durable.
+                    # The request's connection is not needed while waiting, so hand it back early.
+                    await release_session(db)
+                    redeemed = await vote_pipeline.submit("token", token_rec['token_id'], target_ids)
+                else:
+                    # The conditional UPDATE decides the winner: concurrent requests with the same token
+                    # serialize on the token row and only the first one sees is_used = FALSE.
+                    async with db.transaction():
+                        redeemed = await db.fetchval(f"""
+                            WITH redeemed AS (
+                                UPDATE voting_tokens SET is_used = TRUE, used_at = CURRENT_TIMESTAMP
+                                WHERE id = $2 AND is_used = FALSE
+                                RETURNING id
+                            ), recorded AS ({record_votes_sql("redeemed", "token_id")})
+                            SELECT id FROM redeemed
+                        """, target_ids, token_rec['token_id'])
+                token_filter.mark_used(token_str)  # redeemed now or by a concurrent request
+                if not redeemed:
+                    raise HTTPException(status_code=400, detail="This token has already been used and is now expired")
+                token_usage.record(token_rec['token_id'])  # batch used count, appended by the batch compactor
+                if not VOTE_LEDGER:
+                    # Ledger ballots reach the totals through the materializer, which invalidates instead
+                    results_cache.record_votes({c_id: authorized[c_id] for c_id in target_ids})
                 
-                eid = cand_info['election_id']
-                if eid in seen_elections:
-                    raise HTTPException(status_code=400, detail=f"You can only vote for ONE candidate per election. Error at election: {eid}")
-                seen_elections.add(eid)
-
-            # --- PROCESS VOTES ---
-            for c_id in target_ids:
-                cur.execute("UPDATE candidates SET vote_count = vote_count + 1 WHERE id = %s", (c_id,))
-            
-            # --- EXPIRE TOKEN ---
-            cur.execute("UPDATE voting_tokens SET is_used = TRUE, used_at = CURRENT_TIMESTAMP WHERE token = %s", (token_str,))
-            
-            conn.commit()
-            return {
-                "status": "success", 
-                "message": f"Successfully cast {len(target_ids)} vote(s). Your token has now expired.",
-                "votedElections": list(seen_elections)
-            }
-
-        # Case 2: Voting via User ID (Traditional, Multi-Election Support)
-        elif vote_req.user_id:
-            cur.execute("SELECT id, has_voted FROM users WHERE id = %s", (vote_req.user_id,))
-            user = cur.fetchone()
-            if not user:
-                raise HTTPException(status_code=404, detail="User not found")
-            if user['has_voted']:
-                raise HTTPException(status_code=400, detail="User has already voted and is now restricted")
-
-            # Identify candidates
-            target_ids = []
-            if vote_req.candidate_ids:
-                target_ids = vote_req.candidate_ids
-            elif vote_req.candidate_id:
-                target_ids = [vote_req.candidate_id]
-            else:
-                raise HTTPException(status_code=400, detail="Please provide at least one candidate ID to vote")
-
-            # Validate Candidates
-            seen_elections = set()
-            for c_id in target_ids:
-                cur.execute("SELECT id, election_id FROM candidates WHERE id = %s", (c_id,))
-                cand_info = cur.fetchone()
-                if not cand_info:
-                    raise HTTPException(status_code=404, detail=f"Candidate ID {c_id} not found")
+                return {
+                    "status": "success", 
+                    "message": f"Successfully cast {len(target_ids)} vote(s). Your token has now expired.",
+                    "votedElections": [str(eid) for eid in seen_elections]
+                }
+
+            # Case 2: Voting via User ID (Traditional, Multi-Election Support)
+            elif vote_req.user_id:
+                # User lookup + candidate validation in one query
+                rows = await db.fetch("""
+                    SELECT u.id, u.email, u.has_voted, c.id AS candidate_id, c.election_id
+                    FROM users u
+                    LEFT JOIN candidates c ON c.id = ANY($2::int[])
+                    WHERE u.id = $1
+                """, vote_req.user_id, target_ids)
+                if not rows:
+                    raise HTTPException(status_code=404, detail="User not found")
+                if rows[0]['has_voted']:
+                    raise HTTPException(status_code=400, detail="User has already voted and is now restricted")
+                if not target_ids:
+                    raise HTTPException(status_code=400, detail="Please provide at least one candidate ID to vote")
+
+                # Validate Candidates
+                found = {r['candidate_id']: r['election_id'] for r in rows if r['candidate_id'] is not None}
+                seen_elections = set()
+                for c_id in target_ids:
+                    if c_id not in found:
+                        raise HTTPException(status_code=404, detail=f"Candidate ID {c_id} not found")
                 
-                eid = cand_info['election_id']
-                if eid in seen_elections:
-                    raise HTTPException(status_code=400, detail=f"Double voting in election {eid} is not allowed")
-                seen_elections.add(eid)
-
-            # Process Votes
-            for c_id in target_ids:
-                cur.execute("UPDATE candidates SET vote_count = vote_count + 1 WHERE id = %s", (c_id,))
-            
-            cur.execute("UPDATE users SET has_voted = TRUE WHERE id = %s", (vote_req.user_id,))
-            
-            conn.commit()
-            return {
-                "status": "success", 
-                "message": f"Successfully cast {len(target_ids)} vote(s) via User ID.",
-                "votedElections": list(seen_elections)
-            }
+                    eid = found[c_id]
+                    if eid in seen_elections:
+                        raise HTTPException(status_code=400, detail=f"Double voting in election {eid} is not allowed")
+                    seen_elections.add(eid)
+
+                # Mark the user + Process Votes
+                if vote_pipeline.running:
+                    await release_session(db)
+                    voter = await vote_pipeline.submit("user", vote_req.user_id, target_ids)
+                else:
+                    async with db.transaction():
+                        voter = await db.fetchval(f"""
+                            WITH voter AS (
+                                UPDATE users SET has_voted = TRUE
+                                WHERE id = $2 AND has_voted = FALSE
+                                RETURNING id
+                            ), recorded AS ({record_votes_sql("voter", "user_id")})
+                            SELECT id FROM voter
+                        """, target_ids, vote_req.user_id)
+                if not voter:
+                    raise HTTPException(status_code=400, detail="User has already voted and is now restricted")
+                principal_cache.invalidate(rows[0]['email'])  # has_voted is not announced to the cache
+                if not VOTE_LEDGER:
+                    results_cache.record_votes({c_id: found[c_id] for c_id in target_ids})
+                
+                return {
+                    "status": "success", 
+                    "message": f"Successfully cast {len(target_ids)} vote(s) via User ID.",
+                    "votedElections": [str(eid) for eid in seen_elections]
+                }
         
-        else:
-            raise HTTPException(status_code=400, detail="Either Token or User ID is required")
+            else:
+                raise HTTPException(status_code=400, detail="Either Token or User ID is required")
             
-    except HTTPException as he:
-        conn.rollback()
-        raise he
-    except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        except HTTPException as he:
+            raise he
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/candidates/all/clear")
-def clear_all_candidates():
+def clear_all_candidates(conn = Depends(get_db)):
     """Testing ke liye sare candidates saaf karne ki API"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
     cur = conn.cursor()
     try:
         cur.execute("DELETE FROM candidates")
         conn.commit()
+        results_cache.invalidate()
         return {"message": "Sare candidates delete ho gaye hain. Ab naya data add karein."}
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
 
-@app.get("/results")
-def get_results(token: Optional[str] = None):
-    """Results grouped by election (Facilitates UI). Optional token filter."""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
-    cur = conn.cursor()
-    try:
-        election_ids = None
+async def results_version(token=None):
+    """Catalog version, tallies epoch and vote total of the elections /results shows (all, or the token's)"""
+    async with request_session() as db:
         if token:
-            token_str = token.strip().upper()
-            cur.execute("""
-                SELECT te.election_id 
-                FROM token_elections te
-                JOIN voting_tokens vt ON te.token_id = vt.id
-                WHERE vt.token = %s
-            """, (token_str,))
-            rows = cur.fetchall()
-            election_ids = [r['election_id'] for r in rows]
-            
-            if not election_ids:
-                return []
-
-        # 1. Get Elections
-        if election_ids:
-            cur.execute("SELECT id, name, description FROM elections WHERE id::text IN %s OR name IN %s", (tuple(election_ids), tuple(election_ids)))
-        else:
-            cur.execute("SELECT id, name, description FROM elections")
-        
-        elections = cur.fetchall()
+            return await db.fetchrow(votes_version_sql(TOKEN_CANDIDATES_SOURCE, "vt.token = $1"), token)
+        return await db.fetchrow(votes_version_sql(where="c.election_id IS NOT NULL"))
+
+async def conditional_results(view, shape, token, if_none_match):
+    """Results JSON, or 304 decided from the versions alone (nothing is loaded or rendered)"""
+    v = await results_version(token)
+    etag = make_etag("results", view, token, v['catalog'], v['tallies'], v['votes'])
+    if is_fresh(if_none_match, etag):
+        return not_modified(etag)
+    entries = await results_cache.results_as_of(v, token)
+    return json_with_etag(results_cache.render(entries, view, shape), etag)
+
+def public_results_view(e):
+    return {
+        "electionId": e['id'],
+        "electionName": e['name'],
+        "electionDescription": e['description']
+    }
 
-        # 2. Get Candidates
-        if election_ids:
-            cur.execute("SELECT id, name, position, party, election_id, image_url, vote_count, image_url as image FROM candidates WHERE election_id IN %s ORDER BY vote_count DESC", (tuple(election_ids),))
-        else:
-            cur.execute("SELECT id, name, position, party, election_id, image_url, vote_count, image_url as image FROM candidates ORDER BY vote_count DESC")
-            
-        all_candidates = cur.fetchall()
-
-        # 3. Grouping Logic
-        results = []
-        for e in elections:
-            e_id = str(e['id'])
-            # Filter candidates for this specific election
-            cand_list = [c for c in all_candidates if str(c['election_id']) == e_id or c['election_id'] == e['name']]
-            
-            results.append({
-                "electionId": e['id'],
-                "electionName": e['name'],
-                "electionDescription": e['description'],
-                "candidates": cand_list
-            })
-            
-        return results
+@app.get("/results")
+async def get_results(token: Optional[str] = None, if_none_match: Optional[str] = Header(None)):
+    """Results grouped by election (Facilitates UI). Optional token filter. Served from results_cache (ETag = catalog + vote versions)."""
+    try:
+        return await conditional_results("public", public_results_view, token.strip().upper() if token else None, if_none_match)
+    except PoolTimeoutError:
+        raise server_busy()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+
+@app.get("/results/stream")
+async def stream_results(token: Optional[str] = None, election_ids: Optional[str] = Query(None, alias="electionIds")):
+    """Live results (Server-Sent Events): a snapshot, then per-election vote count deltas.
+    Optional token and/or electionIds (comma separated) filter."""
+    try:
+        entries = await results_cache.results(token.strip().upper() if token else None)
+        if election_ids:
+            wanted = {int(x) for x in election_ids.split(",") if x.strip()}
+            entries = [e for e in entries if e['id'] in wanted]
+        if not entries:
+            raise HTTPException(status_code=404, detail="No elections to stream")
+        events = results_broadcaster.stream(entries, lambda es: results_cache.render(es, "public", public_results_view))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="electionIds must be a comma separated list of election IDs")
+    except StreamFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except PoolTimeoutError:
+        raise server_busy()
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.get("/elections/{id}/tokens")
-def get_election_tokens(id: str):
-    """Specific election ke tokens dekhne ke liye"""
-    conn = get_db_connection()
-    if not conn: throw_db_error()
+def get_election_tokens(id: str, conn = Depends(get_db)):
+    """Specific election ke tokens dekhne ke liye (tokens whose election set includes it)"""
     cur = conn.cursor()
-    cur.execute("SELECT * FROM voting_tokens WHERE election_id = %s ORDER BY created_at DESC", (id,))
+    cur.execute("""
+        SELECT vt.id, vt.token, vt.batch_id, m.election_id::text AS election_id, vt.election_set_id, vt.is_used, vt.used_at, vt.created_at
+        FROM voting_tokens vt
+        JOIN election_set_members m ON m.set_id = vt.election_set_id
+        WHERE m.election_id = %s
+        ORDER BY vt.created_at DESC
+    """, (resolve_election_ref(cur, id),))
     results = cur.fetchall()
     cur.close()
-    conn.close()
     return results
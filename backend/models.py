@@ -1,7 +1,8 @@
-from pydantic import BaseModel, EmailStr, ConfigDict
+from pydantic import BaseModel, EmailStr, ConfigDict, field_validator
 from pydantic.alias_generators import to_camel
 from datetime import datetime
-from typing import Optional, List, Union, Any
+from typing import Optional, List, Union, Any, Dict
+import json
 
 class CamelModel(BaseModel):
     model_config = ConfigDict(
@@ -78,11 +79,18 @@ class CandidateResponse(CamelModel):
     name: str
     position: str
     party: str
-    election_id: str  # Changed to str
+    election_id: Optional[str] = None  # elections.id as string (NULL once the election is deleted)
     image_url: Optional[str] = None # Relative or Full URL
     image: Optional[str] = None     # Alias for imageUrl
+    image_variants: Optional[Dict[str, str]] = None  # Resized copies {"thumb": url, "medium": url}, once made
     vote_count: int
 
+    @field_validator("image_variants", mode="before")
+    @classmethod
+    def parse_variants(cls, v):
+        # JSONB column: psycopg2 hands it over as a dict, asyncpg as text
+        return json.loads(v) if isinstance(v, str) else v
+
 # --- Vote Models ---
 class VoteRequest(CamelModel):
     user_id: Optional[int] = None
@@ -94,6 +102,7 @@ class VoteRequest(CamelModel):
 class TokenGenerateRequest(CamelModel):
     election_ids: List[Any]  # Use Any to bypass strict type checks from frontend
     count: int = 1
+    background: bool = False  # True: return 202 at once and poll GET /tokens/generate/{batchId}
 
 class VotingTokenResponse(CamelModel):
     id: int
@@ -114,6 +123,10 @@ class TokenBatchResponse(CamelModel):
 class TokenLoginRequest(BaseModel):
     token: str
 
+class TokenPushRequest(CamelModel):
+    token: str  # POST /tokens: a code made by the admin app
+    election_ids: List[Any]
+
 class TokenAddRequest(CamelModel):
-    token: str
+    token: Optional[str] = None  # /admin/save-token allocates one when omitted
     election_ids: List[Any]
@@ -0,0 +1,145 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.context import CryptContext
+
+# bcrypt for /register, /token and /login, off the event loop and out of this process. A bcrypt
+# call is tens to hundreds of milliseconds of pure CPU; run inline in the request thread, a login
+# surge at the opening of the voting window held a threadpool thread and a pooled connection per
+# login and competed for the CPU with every other request on the worker. Hashes now run in a
+# small process pool, before the request borrows a connection:
+#   PASSWORD_HASH_WORKERS  processes per app worker (0 = run in the threadpool instead)
+#   PASSWORD_HASH_QUEUE    hashes queued or running at once; past that requests get 503 at once
+#   PASSWORD_HASH_TIMEOUT  seconds a request waits for its hash before giving up with 503
+#   PASSWORD_HASH_NICE     niceness added to the pool processes, so on a busy machine the request
+#                          handling processes win the CPU and logins absorb the wait
+#   BCRYPT_ROUNDS          cost of new hashes; a login whose stored hash has another cost is
+#                          re-hashed at this one (see verify)
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_HASH_QUEUE = int(os.environ.get("PASSWORD_HASH_QUEUE", "64"))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get("PASSWORD_HASH_TIMEOUT", "5"))
+PASSWORD_HASH_NICE = int(os.environ.get("PASSWORD_HASH_NICE", "5"))
+
+class PasswordHasherBusy(Exception):
+    """The hash queue is full, or the hash did not finish within PASSWORD_HASH_TIMEOUT."""
+
+# --- run inside the pool processes (module level, so they can be pickled) ---
+
+_contexts = {}
+
+def _context(rounds):
+    if rounds not in _contexts:
+        _contexts[rounds] = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+    return _contexts[rounds]
+
+def _init_worker(nice):
+    if nice:
+        os.nice(nice)
+
+def _warm_up(rounds):
+    _context(rounds)
+
+def _hash(password, rounds):
+    return _context(rounds).hash(password)
+
+def _hash_many(passwords, rounds):
+    context = _context(rounds)
+    return [context.hash(p) for p in passwords]
+
+def _verify(password, hashed, rounds):
+    """(matches, new hash or None): a matching hash of another cost is re-hashed at `rounds`."""
+    context = _context(rounds)
+    if not context.verify(password, hashed):
+        return False, None
+    if hash_rounds(hashed) != rounds:
+        return True, context.hash(password)
+    return True, None
+
+def hash_rounds(hashed):
+    """Cost of a "$2b$12$..." bcrypt hash (None for anything else)."""
+    parts = hashed.split("$")
+    return int(parts[2]) if len(parts) > 3 and parts[2].isdigit() else None
+
+class PasswordHasher:
+    def __init__(self, workers=PASSWORD_HASH_WORKERS, max_queue=PASSWORD_HASH_QUEUE,
+                 timeout=PASSWORD_HASH_TIMEOUT, rounds=BCRYPT_ROUNDS, nice=PASSWORD_HASH_NICE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.rounds = rounds
+        self.nice = nice
+        self._executor = None
+        self.in_flight = 0
+
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.rehashed = 0
+        self._total_ms = 0.0
+
+    async def hash(self, password):
+        return await self._run(_hash, password, self.rounds)
+
+    async def verify(self, password, hashed):
+        """(matches, new hash or None); store the new hash when there is one."""
+        matches, new_hash = await self._run(_verify, password, hashed, self.rounds)
+        if new_hash:
+            self.rehashed += 1
+        return matches, new_hash
+
+    async def _run(self, fn, *args):
+        if self.in_flight >= self.max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusy("Password hash queue is full")
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            if self._executor is None:
+                job = asyncio.to_thread(fn, *args)
+            else:
+                job = asyncio.wrap_future(self._executor.submit(fn, *args))
+            try:
+                # On timeout a hash still queued is cancelled; one already running finishes unread
+                result = await asyncio.wait_for(job, self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise PasswordHasherBusy(f"Password hash took longer than {self.timeout:g}s")
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        self._total_ms += (time.perf_counter() - start) * 1000
+        return result
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "maxQueue": self.max_queue,
+            "timeoutSeconds": self.timeout,
+            "inFlight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "rehashed": self.rehashed,
+            "avgMs": round(self._total_ms / self.completed, 1) if self.completed else 0.0,
+        }
+
+    async def start(self):
+        if self.workers > 0 and self._executor is None:
+            # spawn, not fork: the app process has threads and open connections by now
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_init_worker, initargs=(self.nice,))
+            # Start the processes (and import passlib there) now instead of on the first logins
+            await asyncio.gather(*(asyncio.wrap_future(self._executor.submit(_warm_up, self.rounds))
+                                   for _ in range(self.workers)), return_exceptions=True)
+
+    async def stop(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, True, cancel_futures=True)
+
+password_hasher = PasswordHasher()
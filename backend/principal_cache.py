@@ -0,0 +1,154 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import asyncpg
+
+from database import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+
+# Principal cache for get_current_user: bearer token -> the users row it resolved to. A repeated
+# token skips both the JWT signature check (the exact same bytes were verified before) and the
+# users lookup, so it does not borrow a pool connection at all. Entries live until the sooner of
+# PRINCIPAL_CACHE_TTL seconds and the token's own exp. A change to username, email, password or
+# role, and any DELETE of a users row (also when done by hand in psql), is announced by a trigger
+# on the users_changed channel (see init_db), and every worker drops that user's entries. While
+# the listener is disconnected nothing is served from the cache. has_voted is not announced (a
+# NOTIFY per ballot would keep every cache empty during an election): the worker that records a
+# user's vote drops that user's entries itself, others may show the old value for up to the TTL.
+PRINCIPAL_CACHE_SIZE = int(os.environ.get("PRINCIPAL_CACHE_SIZE", "10000"))  # 0 = off
+PRINCIPAL_CACHE_TTL = float(os.environ.get("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_CHANNEL = "users_changed"
+
+class PrincipalCache:
+    def __init__(self, max_size=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.ready = False
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # token -> (user row, expires at)
+        self._by_email = {}             # email -> tokens cached for it
+        self._generation = 0            # bumped by every invalidation
+        self._task = None
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def get(self, token):
+        """The cached user row for `token` (a copy), or None."""
+        if not self.ready:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    self._drop(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return dict(entry[0])
+
+    def generation(self):
+        """Read before looking the user up; put() ignores rows that an invalidation may have outdated."""
+        return self._generation
+
+    def put(self, token, user, expires_at, generation):
+        if not self.ready:
+            return
+        expires_at = min(expires_at, time.time() + self.ttl)
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._drop(token)
+            self._entries[token] = (user, expires_at)
+            self._by_email.setdefault(user['email'], set()).add(token)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, email):
+        with self._lock:
+            self._generation += 1
+            for token in self._by_email.pop(email, ()):
+                self._entries.pop(token, None)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._by_email.clear()
+
+    def _drop(self, token):
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            tokens = self._by_email.get(entry[0]['email'])
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._by_email[entry[0]['email']]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "maxSize": self.max_size,
+            "ttlSeconds": self.ttl,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+    # --- listening ---
+
+    def _on_notify(self, conn, pid, channel, payload):
+        self.invalidate(payload)
+
+    async def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(database=DB_NAME, user=DB_USER, password=DB_PASSWORD,
+                                             host=DB_HOST, port=int(DB_PORT))
+                await conn.add_listener(PRINCIPAL_CACHE_CHANNEL, self._on_notify)
+                # Changes made while nobody was listening may have been missed
+                self.clear()
+                self.ready = True
+                while not conn.is_closed():
+                    await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Principal cache listener failed: {e}")
+            finally:
+                self.ready = False
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(5)
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self.ready = False
+            self.clear()
+
+principal_cache = PrincipalCache()
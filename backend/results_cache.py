@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import async_database
+from vote_counters import VOTE_TOTAL_JOINS, VOTE_TOTAL_SQL
+
+# Per-election results cache for /results and /admin/results. Entries live for RESULTS_CACHE_TTL
+# seconds (0 = off); votes committed by this process update them in place, admin edits drop them.
+# Each API worker has its own cache, so writes made through another worker show up within the TTL.
+RESULTS_CACHE_TTL = float(os.environ.get("RESULTS_CACHE_TTL", "2"))
+RESULTS_CACHE_MAX_TOKENS = int(os.environ.get("RESULTS_CACHE_MAX_TOKENS", "10000"))
+
+class ResultsCache:
+    """Election entries ({id, name, description, status, created_at, totalVotes, candidates_json}) by id."""
+
+    def __init__(self, ttl=RESULTS_CACHE_TTL, max_tokens=RESULTS_CACHE_MAX_TOKENS):
+        self.ttl = ttl
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._entries = {}               # election id -> (expires_at, entry)
+        self._all_ids = None             # (expires_at, every election id)
+        self._tokens = OrderedDict()     # token -> (expires_at, election ids), LRU
+        # Bumped on every change; a load only stores what it read if nothing changed meanwhile
+        self._versions = defaultdict(int)
+        self._epoch = 0
+        self._load_lock = None
+
+        self.hits = 0
+        self.misses = 0
+
+    async def results(self, token=None):
+        """Entries for every election, or only the token's elections, newest election first.
+
+        A database session is only borrowed on a miss; hits never touch the pool.
+        """
+        entries = self._lookup(token, time.monotonic())
+        cached = entries is not None
+        if self.ttl <= 0:
+            async with async_database.session() as db:
+                entries = await self._load(db, token)
+        elif not cached:
+            # One load at a time: when an entry expires under hundreds of pollers, the rest wait for
+            # the first reader's load instead of all going to Postgres
+            if self._load_lock is None:
+                self._load_lock = asyncio.Lock()
+            async with self._load_lock:
+                entries = self._lookup(token, time.monotonic())
+                cached = entries is not None
+                if not cached:
+                    async with async_database.session() as db:
+                        entries = await self._load(db, token)
+        with self._lock:
+            if cached:
+                self.hits += 1
+            else:
+                self.misses += 1
+        entries.sort(key=lambda e: (e['created_at'] is not None, e['created_at'], e['id']), reverse=True)
+        return entries
+
+    async def results_as_of(self, version, token=None):
+        """results(), reloaded if the cached entries are older than `version` (a votes_version_sql row).
+
+        The caller tags the body with `version`, so the body must be at least that new; a cached
+        entry carries the catalog / tallies versions it was read at, and vote totals only grow.
+        """
+        entries = await self.results(token)
+        if not entries:
+            if token is not None:
+                return entries  # unknown tokens and empty sets are never cached: just read
+            self.invalidate()
+        elif any(e['catalog'] < version['catalog'] or e['tallies'] < version['tallies'] for e in entries):
+            self.invalidate()
+        elif sum(e['totalVotes'] for e in entries) < version['votes']:
+            self.invalidate([e['id'] for e in entries])  # votes through another worker
+        else:
+            return entries
+        return await self.results(token)
+
+    def record_votes(self, votes):
+        """Applies committed votes ({candidate id: election id}, one vote each) to the cached entries."""
+        with self._lock:
+            for c_id, eid in votes.items():
+                self._versions[eid] += 1
+                cached = self._entries.get(eid)
+                if cached is None:
+                    continue
+                expires, entry = cached
+                # Copy-on-write so a response being serialized never sees a half-applied update
+                candidates = [dict(c, vote_count=c['vote_count'] + 1) if c['id'] == c_id else c
+                              for c in entry_candidates(entry)]
+                candidates.sort(key=lambda c: (-c['vote_count'], c['id']))  # as results_sql orders them
+                self._entries[eid] = (expires, dict(entry, candidates=candidates, candidates_json=json.dumps(candidates),
+                                                    totalVotes=entry['totalVotes'] + 1, rendered={}))
+
+    def render(self, entries, view, shape):
+        """JSON array of shape(entry) plus a trailing "candidates" key per entry.
+
+        The candidates JSON is spliced in as Postgres built it. Each entry renders once per view.
+        """
+        parts = []
+        for entry in entries:
+            part = entry['rendered'].get(view)
+            if part is None:
+                head = json.dumps(shape(entry), default=str)
+                part = entry['rendered'][view] = f'{head[:-1]}, "candidates": {entry["candidates_json"]}}}'
+            parts.append(part)
+        return "[" + ",".join(parts) + "]"
+
+    def invalidate(self, election_ids=None):
+        """Drops the given elections, or everything (incl. token mappings) when None."""
+        with self._lock:
+            if election_ids is None:
+                self._epoch += 1
+                self._entries.clear()
+                self._tokens.clear()
+                self._all_ids = None
+                return
+            for eid in election_ids:
+                self._versions[eid] += 1
+                self._entries.pop(eid, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "ttlSeconds": self.ttl,
+                "elections": len(self._entries),
+                "tokens": len(self._tokens),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+    # --- lookups ---
+
+    def _lookup(self, token, now):
+        ids = self._get_all_ids(now) if token is None else self._get_token(token, now)
+        if ids is None:
+            return None
+        entries, missing = self._get_entries(ids, now)
+        return None if missing else entries
+
+    def _get_all_ids(self, now):
+        with self._lock:
+            if self._all_ids and self._all_ids[0] > now:
+                return self._all_ids[1]
+        return None
+
+    def _get_token(self, token, now):
+        with self._lock:
+            cached = self._tokens.get(token)
+            if cached and cached[0] > now:
+                self._tokens.move_to_end(token)
+                return cached[1]
+        return None
+
+    def _get_entries(self, ids, now):
+        entries, missing = [], []
+        with self._lock:
+            for eid in ids:
+                cached = self._entries.get(eid)
+                if cached and cached[0] > now:
+                    entries.append(cached[1])
+                else:
+                    missing.append(eid)
+        return entries, missing
+
+    # --- loads ---
+
+    async def _load(self, db, token):
+        now = time.monotonic()
+        if token is None:
+            ids = self._get_all_ids(now)
+            if ids is None:
+                return await self._load_entries(db)
+        else:
+            ids = self._get_token(token, now)
+            if ids is None:
+                ids = await self._load_token(db, token)
+        entries, missing = self._get_entries(ids, now)
+        if missing:
+            entries.extend(await self._load_entries(db, missing))
+        return entries
+
+    async def _load_token(self, db, token):
+        epoch = self._epoch
+        rows = await db.fetch("""
+            SELECT m.election_id
+            FROM voting_tokens vt
+            JOIN election_set_members m ON m.set_id = vt.election_set_id
+            WHERE vt.token = $1
+        """, token)
+        ids = [r['election_id'] for r in rows]
+        # Unknown tokens are not remembered, so a token created a moment later works right away
+        with self._lock:
+            if self.ttl > 0 and ids and epoch == self._epoch:
+                self._tokens[token] = (time.monotonic() + self.ttl, ids)
+                self._tokens.move_to_end(token)
+                while len(self._tokens) > self.max_tokens:
+                    self._tokens.popitem(last=False)
+        return ids
+
+    async def _load_entries(self, db, election_ids=None):
+        """Loads entries for the given elections (None = all) with one grouped query."""
+        with self._lock:
+            epoch = self._epoch
+            versions = dict(self._versions) if election_ids is None else {eid: self._versions[eid] for eid in election_ids}
+        if election_ids is None:
+            rows = await db.fetch(results_sql())
+        else:
+            rows = await db.fetch(results_sql("c.election_id = ANY($1::int[])", "e.id = ANY($1::int[])"), election_ids)
+
+        # Postgres already grouped, ordered, totalled and rendered the candidates; this is one pass
+        # over the elections, and the JSON is only parsed if something needs the dicts
+        entries = [dict(r, candidates=None, candidates_json=r['candidates'], rendered={}) for r in rows]
+
+        with self._lock:
+            if self.ttl > 0 and epoch == self._epoch:
+                expires = time.monotonic() + self.ttl
+                if election_ids is None:
+                    self._all_ids = (expires, [entry['id'] for entry in entries])
+                for entry in entries:
+                    eid = entry['id']
+                    if self._versions[eid] != versions.get(eid, 0):
+                        continue  # a vote or edit landed while we were reading
+                    self._entries[eid] = (expires, entry)
+        return entries
+
+def results_sql(candidate_filter="TRUE", election_filter="TRUE"):
+    """Per-election results rows: election columns, totalVotes and the candidates as a JSON array."""
+    return f"""
+        SELECT e.id, e.name, e.description, e.status, e.created_at,
+               (SELECT version FROM data_versions WHERE name = 'catalog') AS catalog,
+               (SELECT version FROM data_versions WHERE name = 'tallies') AS tallies,
+               COALESCE(SUM(c.vote_count), 0)::bigint AS "totalVotes",
+               COALESCE(
+                   json_agg(json_build_object(
+                       'id', c.id, 'name', c.name, 'position', c.position, 'party', c.party,
+                       'election_id', c.election_id::text, 'image_url', c.image_url,
+                       'image_variants', c.image_variants, 'vote_count', c.vote_count, 'image', c.image_url
+                   ) ORDER BY c.vote_count DESC, c.id) FILTER (WHERE c.id IS NOT NULL),
+                   '[]'
+               )::text AS candidates
+        FROM elections e
+        LEFT JOIN (
+            SELECT c.id, c.name, c.position, c.party, c.election_id, c.image_url, c.image_variants, {VOTE_TOTAL_SQL} AS vote_count
+            FROM candidates c
+            {VOTE_TOTAL_JOINS}
+            WHERE {candidate_filter}
+        ) c ON c.election_id = e.id
+        WHERE {election_filter}
+        GROUP BY e.id
+        ORDER BY e.created_at DESC NULLS LAST, e.id DESC
+    """
+
+def entry_candidates(entry):
+    """The entry's candidates as dicts, parsed from its JSON on first use."""
+    if entry['candidates'] is None:
+        entry['candidates'] = json.loads(entry['candidates_json'])
+    return entry['candidates']
+
+results_cache = ResultsCache()
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import os
+
+import async_database
+from results_cache import entry_candidates
+from vote_counters import VOTE_TOTAL_JOINS, VOTE_TOTAL_SQL
+
+# Live results over Server-Sent Events. One broadcaster per worker reads the counts of every
+# subscribed election once per RESULTS_STREAM_INTERVAL_MS and fans the changes out to subscribers;
+# the number of queries does not depend on the number of connected screens.
+RESULTS_STREAM_INTERVAL_MS = float(os.environ.get("RESULTS_STREAM_INTERVAL_MS", "1000"))
+RESULTS_STREAM_HEARTBEAT_SECONDS = float(os.environ.get("RESULTS_STREAM_HEARTBEAT_SECONDS", "15"))
+RESULTS_STREAM_MAX_SUBSCRIBERS = int(os.environ.get("RESULTS_STREAM_MAX_SUBSCRIBERS", "10000"))
+
+COUNTS_SQL = f"""
+    SELECT c.id, c.election_id, {VOTE_TOTAL_SQL} AS vote_count
+    FROM candidates c
+    {VOTE_TOTAL_JOINS}
+    WHERE c.election_id = ANY($1::int[])
+"""
+
+class StreamFull(Exception):
+    pass
+
+def sse(event, data):
+    return f"event: {event}\ndata: {data}\n\n"
+
+class Subscriber:
+    """One connected client. Deltas wait in `pending` (per election) until the client takes them."""
+
+    def __init__(self, snapshot_counts):
+        self.election_ids = set(snapshot_counts)
+        self.snapshot_counts = snapshot_counts  # {election id: {candidate id: count}} as sent; None once synced
+        self.pending = {}                       # election id -> (changes, rendered event or None)
+        self.wake = asyncio.Event()
+
+class ResultsBroadcaster:
+    def __init__(self, interval_ms=RESULTS_STREAM_INTERVAL_MS, max_subscribers=RESULTS_STREAM_MAX_SUBSCRIBERS):
+        self.interval = interval_ms / 1000
+        self.max_subscribers = max_subscribers
+        self._subscribers = set()
+        self._last = {}       # election id -> {candidate id: count} as of the previous tick
+        self._task = None
+
+        self.ticks = 0
+        self.events = 0       # delta events handed to subscribers
+        self.coalesced = 0    # deltas merged into an unsent one because the client was behind
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "subscribers": len(self._subscribers),
+            "elections": len(self._last),
+            "intervalMs": self.interval * 1000,
+            "ticks": self.ticks,
+            "events": self.events,
+            "coalesced": self.coalesced,
+        }
+
+    def stream(self, entries, render):
+        """SSE body: a snapshot of `entries`, then a delta event per changed election.
+
+        `render(entries)` turns results entries into the snapshot JSON. Raises StreamFull when the
+        worker already holds RESULTS_STREAM_MAX_SUBSCRIBERS connections.
+        """
+        if len(self._subscribers) >= self.max_subscribers:
+            raise StreamFull(f"Results stream is full ({self.max_subscribers} subscribers)")
+        sub = Subscriber({e['id']: {c['id']: c['vote_count'] for c in entry_candidates(e)} for e in entries})
+        self.start()
+        return self._events(sub, render(entries))
+
+    async def _events(self, sub, snapshot):
+        # Registered only once the body is being sent, so a response that is never started (client
+        # gone before the first chunk) leaves nothing behind; add and discard share one try/finally
+        self._subscribers.add(sub)
+        try:
+            yield f"retry: 3000\n{sse('snapshot', snapshot)}"
+            while True:
+                try:
+                    await asyncio.wait_for(sub.wake.wait(), RESULTS_STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                sub.wake.clear()
+                pending, sub.pending = sub.pending, {}
+                # While this yield waits on a slow socket, new deltas are merged into sub.pending
+                yield "".join(
+                    rendered or sse("delta", json.dumps({"electionId": eid, "candidates": changes}))
+                    for eid, (changes, rendered) in pending.items()
+                )
+        finally:
+            self._subscribers.discard(sub)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self._subscribers:
+                self._last.clear()
+                continue
+            try:
+                await self._tick()
+            except Exception as e:
+                print(f"Results stream tick failed: {e}")
+
+    async def _tick(self):
+        election_ids = set().union(*(s.election_ids for s in self._subscribers))
+        async with async_database.session() as db:
+            rows = await db.fetch(COUNTS_SQL, sorted(election_ids))
+        current = {eid: {} for eid in election_ids}
+        for r in rows:
+            current[r['election_id']][r['id']] = r['vote_count']
+        self.ticks += 1
+
+        # One delta per changed election, rendered once and shared by every subscriber
+        deltas = {}
+        for eid, counts in current.items():
+            prev = self._last.get(eid)
+            if prev is None:
+                continue
+            if prev.keys() != counts.keys():
+                deltas[eid] = (None, sse("reload", json.dumps({"electionId": eid})))
+                continue
+            changes = {cid: n for cid, n in counts.items() if prev[cid] != n}
+            if changes:
+                deltas[eid] = (changes, sse("delta", json.dumps({"electionId": eid, "candidates": changes})))
+        self._last = current
+
+        for sub in list(self._subscribers):
+            if sub.snapshot_counts is not None:
+                # First tick after subscribing: catch up from the (possibly cached) snapshot
+                updates = {}
+                for eid, sent in sub.snapshot_counts.items():
+                    counts = current.get(eid, {})
+                    if sent.keys() != counts.keys():
+                        updates[eid] = (None, sse("reload", json.dumps({"electionId": eid})))
+                        continue
+                    changes = {cid: n for cid, n in counts.items() if sent[cid] != n}
+                    if changes:
+                        updates[eid] = (changes, None)
+                sub.snapshot_counts = None
+            else:
+                updates = {eid: deltas[eid] for eid in sub.election_ids if eid in deltas}
+            for eid, (changes, rendered) in updates.items():
+                queued = sub.pending.get(eid)
+                if queued is None:
+                    sub.pending[eid] = (changes, rendered)
+                elif changes is None or queued[0] is None:
+                    sub.pending[eid] = (None, sse("reload", json.dumps({"electionId": eid})))
+                    self.coalesced += 1
+                else:
+                    # Slow consumer: keep only the newest count per candidate
+                    sub.pending[eid] = ({**queued[0], **changes}, None)
+                    self.coalesced += 1
+                self.events += 1
+            if updates:
+                sub.wake.set()
+
+results_broadcaster = ResultsBroadcaster()
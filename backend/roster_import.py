@@ -0,0 +1,288 @@
+import csv
+import io
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from pydantic import ValidationError
+
+from database import db_pool, get_db_connection
+from models import UserRegister
+from password_hashing import BCRYPT_ROUNDS, PASSWORD_HASH_NICE, _hash_many, _init_worker
+
+# Bulk user (voter roster) import: CSV with a header row, or NDJSON, with username, email,
+# password and optionally role, the same fields /register takes. The input is read row by row
+# and handled ROSTER_IMPORT_CHUNK rows at a time, so memory does not grow with the roster:
+#   1. rows are validated like /register; rows repeating an email / username of the same chunk,
+#      or one that already exists, are reported and dropped before any hashing
+#   2. the passwords are hashed across ROSTER_IMPORT_WORKERS processes (all cores by default),
+#      the next chunk hashing while the previous one is written
+#   3. the chunk is COPYed into a temp staging table and merged with INSERT ... ON CONFLICT DO
+#      NOTHING; rows that lose to a concurrent registration are reported as duplicates
+# Each chunk commits on its own: a failed import keeps the chunks before it, and importing the
+# same file again only reports duplicates. `rounds` below BCRYPT_ROUNDS makes a big import much
+# cheaper; each hash is upgraded to BCRYPT_ROUNDS at the user's first login.
+ROSTER_IMPORT_CHUNK = int(os.environ.get("ROSTER_IMPORT_CHUNK", "1000"))
+ROSTER_IMPORT_WORKERS = int(os.environ.get("ROSTER_IMPORT_WORKERS", str(os.cpu_count() or 1)))
+ROSTER_IMPORT_MAX_BYTES = int(os.environ.get("ROSTER_IMPORT_MAX_BYTES", str(200 * 1024 * 1024)))
+ROSTER_IMPORT_MAX_PROBLEMS = 1000  # invalid / duplicate rows listed in a report (all are counted)
+ROSTER_FORMATS = ("csv", "ndjson")
+
+EXISTING_USERS_SQL = "SELECT email, username FROM users WHERE email = ANY(%s) OR username = ANY(%s)"
+
+MERGE_STAGED_USERS_SQL = """
+    WITH inserted AS (
+        INSERT INTO users (username, email, password, role, has_voted)
+        SELECT username, email, password, role, FALSE FROM user_staging ORDER BY line
+        ON CONFLICT DO NOTHING
+        RETURNING email
+    )
+    SELECT s.line, s.email FROM user_staging s
+    WHERE NOT EXISTS (SELECT 1 FROM inserted i WHERE i.email = s.email)
+    ORDER BY s.line
+"""
+
+class ImportJob:
+    """Progress and report of one roster import."""
+
+    def __init__(self, import_id, fmt, rounds):
+        self.import_id = import_id
+        self.format = fmt
+        self.rounds = rounds
+        self.status = "running"
+        self.error = None
+        self.rows = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.problems = []
+        self.hash_seconds = 0.0
+        self.write_seconds = 0.0
+        self.started = time.monotonic()
+        self.finished = None
+
+    def problem(self, line, email, reason):
+        if len(self.problems) < ROSTER_IMPORT_MAX_PROBLEMS:
+            self.problems.append({"line": line, "email": email, "reason": reason})
+
+    def to_dict(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return {
+            "importId": self.import_id,
+            "format": self.format,
+            "rounds": self.rounds,
+            "status": self.status,
+            "rows": self.rows,
+            "imported": self.imported,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "elapsedMs": round(elapsed * 1000, 1),
+            "rowsPerSecond": round(self.rows / elapsed, 1) if elapsed else 0.0,
+            "hashSeconds": round(self.hash_seconds, 2),
+            "writeSeconds": round(self.write_seconds, 2),
+            "problems": self.problems,
+            "error": self.error,
+        }
+
+class ImportJobs:
+    """In-process registry of recent imports, keyed by import id."""
+
+    def __init__(self, keep=20):
+        self.keep = keep
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start(self, fmt, rounds):
+        job = ImportJob(f"I-{uuid.uuid4().hex[:8].upper()}", fmt, rounds)
+        with self._lock:
+            self._jobs[job.import_id] = job
+            while len(self._jobs) > self.keep:
+                done = next((k for k, j in self._jobs.items() if j.status != "running"), None)
+                if done is None:
+                    break
+                del self._jobs[done]
+        return job
+
+    def get(self, import_id):
+        with self._lock:
+            return self._jobs.get(import_id)
+
+import_jobs = ImportJobs()
+
+def read_rows(lines, fmt):
+    """Yields (line number, dict) for every record of a CSV (header row first) or NDJSON text stream."""
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            # Spreadsheet exports pad cells; passwords are kept exactly as /register would
+            record = {k.strip(): v or "" for k, v in row.items() if k}
+            yield reader.line_num, {k: v if k == "password" else v.strip() for k, v in record.items()}
+    else:
+        for number, line in enumerate(lines, 1):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield number, record if isinstance(record, dict) else None
+
+def _chunks(job, lines, fmt):
+    """Valid rows (line, UserRegister) in lists of up to ROSTER_IMPORT_CHUNK; invalid ones are reported."""
+    chunk = []
+    for line, record in read_rows(lines, fmt):
+        job.rows += 1
+        try:
+            if record is None:
+                raise ValueError("not a JSON object")
+            if not record.get("role"):
+                record.pop("role", None)
+            chunk.append((line, UserRegister.model_validate(record)))
+        except (ValidationError, ValueError) as e:
+            job.invalid += 1
+            reason = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()) \
+                if isinstance(e, ValidationError) else str(e)
+            job.problem(line, (record or {}).get("email"), reason)
+            continue
+        if len(chunk) >= ROSTER_IMPORT_CHUNK:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _drop_duplicates(cur, job, chunk):
+    """The chunk without rows whose email or username repeats within it or already exists."""
+    cur.execute(EXISTING_USERS_SQL, ([u.email for _, u in chunk], [u.username for _, u in chunk]))
+    taken_emails, taken_names = set(), set()
+    for r in cur.fetchall():
+        taken_emails.add(r['email'])
+        taken_names.add(r['username'])
+    kept, emails, names = [], set(), set()
+    for line, user in chunk:
+        if user.email in taken_emails or user.username in taken_names:
+            reason = "email or username already registered"
+        elif user.email in emails or user.username in names:
+            reason = "email or username repeated in the file"
+        else:
+            kept.append((line, user))
+            emails.add(user.email)
+            names.add(user.username)
+            continue
+        job.duplicates += 1
+        job.problem(line, user.email, reason)
+    return kept
+
+def _hash_chunk(executor, workers, chunk, rounds):
+    """Futures hashing the chunk's passwords, split over the workers."""
+    passwords = [u.password for _, u in chunk]
+    size = max(1, -(-len(passwords) // workers))
+    return [executor.submit(_hash_many, passwords[i:i + size], rounds) for i in range(0, len(passwords), size)]
+
+def _write_chunk(conn, cur, job, chunk, hash_futures):
+    start = time.perf_counter()
+    hashes = [h for f in hash_futures for h in f.result()]
+    job.hash_seconds += time.perf_counter() - start
+
+    start = time.perf_counter()
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for (line, user), hashed in zip(chunk, hashes):
+        writer.writerow((line, user.username, user.email, hashed, user.role))
+    buf.seek(0)
+    try:
+        cur.execute("TRUNCATE user_staging")
+        cur.copy_expert("COPY user_staging (line, username, email, password, role) FROM STDIN WITH (FORMAT csv)", buf)
+        cur.execute(MERGE_STAGED_USERS_SQL)
+        lost = cur.fetchall()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    for r in lost:
+        job.duplicates += 1
+        job.problem(r['line'], r['email'], "email or username already registered")
+    job.imported += len(chunk) - len(lost)
+    job.write_seconds += time.perf_counter() - start
+
+def import_roster(conn, lines, fmt, job, rounds=BCRYPT_ROUNDS, workers=ROSTER_IMPORT_WORKERS):
+    """Imports the users in `lines` (an iterable of text lines) on `conn`, committing per chunk."""
+    cur = conn.cursor()
+    # Not ON COMMIT DROP: the table outlives the per-chunk commits, and goes with the session
+    cur.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS user_staging (
+            line INTEGER, username TEXT, email TEXT, password TEXT, role TEXT
+        )
+    """)
+    conn.commit()
+    executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=(PASSWORD_HASH_NICE,))
+    try:
+        pending = None
+        for chunk in _chunks(job, lines, fmt):
+            chunk = _drop_duplicates(cur, job, chunk)
+            conn.rollback()  # end the read-only transaction; the hashing below takes a while
+            if not chunk:
+                continue
+            hashing = (chunk, _hash_chunk(executor, workers, chunk, rounds))
+            if pending:
+                _write_chunk(conn, cur, job, *pending)
+            pending = hashing
+        if pending:
+            _write_chunk(conn, cur, job, *pending)
+        cur.execute("DROP TABLE IF EXISTS user_staging")
+        conn.commit()
+        job.status = "done"
+    except Exception as e:
+        conn.rollback()
+        job.status = "failed"
+        job.error = str(e)
+        raise
+    finally:
+        executor.shutdown(cancel_futures=True)
+        job.finished = time.monotonic()
+        cur.close()
+    return job
+
+def run_in_background(job, path):
+    """Imports the spooled upload at `path` on its own pooled connection in a worker thread, then deletes it."""
+    def work():
+        try:
+            with db_pool.connection() as conn, open(path, newline="", encoding="utf-8-sig") as lines:
+                import_roster(conn, lines, job.format, job, job.rounds)
+        except Exception as e:
+            print(f"Roster import {job.import_id} failed: {e}")
+        finally:
+            os.unlink(path)
+
+    threading.Thread(target=work, name=f"roster-import-{job.import_id}", daemon=True).start()
+
+if __name__ == "__main__":
+    # python roster_import.py roster.csv|roster.ndjson [rounds]
+    if len(sys.argv) < 2:
+        sys.exit("usage: python roster_import.py FILE.csv|FILE.ndjson [bcrypt rounds]")
+    path = sys.argv[1]
+    fmt = "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else BCRYPT_ROUNDS
+    job = ImportJob(os.path.basename(path), fmt, rounds)
+    conn = get_db_connection()
+    if conn is None:
+        sys.exit("Could not connect to the database")
+    print(f"Importing {path} ({fmt}), bcrypt rounds {rounds}, {ROSTER_IMPORT_WORKERS} hashing processes, "
+          f"{ROSTER_IMPORT_CHUNK} rows per chunk")
+    try:
+        with open(path, newline="", encoding="utf-8-sig") as lines:
+            import_roster(conn, lines, fmt, job, rounds)
+    finally:
+        conn.close()
+        report = job.to_dict()
+        for p in report["problems"][:20]:
+            print(f"  line {p['line']}: {p['email']}: {p['reason']}")
+        if len(report["problems"]) > 20:
+            print(f"  ... {report['duplicates'] + report['invalid'] - 20} more")
+        print(f"{report['status']}: {report['rows']} rows, {report['imported']} imported, {report['duplicates']} duplicates, "
+              f"{report['invalid']} invalid in {report['elapsedMs'] / 1000:.1f} s ({report['rowsPerSecond']:.0f} rows/s; "
+              f"waiting on hashes {report['hashSeconds']:.1f} s, writing {report['writeSeconds']:.1f} s)")
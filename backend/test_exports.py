@@ -0,0 +1,37 @@
+from fastapi import HTTPException
+
+from database import db_pool
+from exports import TOKEN_COLUMNS
+from main import export_response
+
+def idle_connections():
+    return [conn for conn, _ in db_pool._idle]
+
+def test_failing_first_chunk_releases_once():
+    """An export whose query fails on the first chunk hands its connection back exactly once"""
+    db_pool.putconn(db_pool.getconn())  # at least one idle connection to start from
+    before = db_pool.stats()
+    try:
+        export_response("tokens", "csv", TOKEN_COLUMNS, lambda cur: ("SELECT 1 / 0 AS id", ()))
+        raise AssertionError("the export should have failed")
+    except HTTPException as e:
+        assert e.status_code == 500, e.status_code
+
+    after = db_pool.stats()
+    print(f"Pool before: {before['idle']} idle / {before['inUse']} in use, after: {after['idle']} idle / {after['inUse']} in use")
+    assert after['idle'] == before['idle']
+    assert after['inUse'] == before['inUse']
+    assert len(set(map(id, idle_connections()))) == len(idle_connections())
+
+def test_putconn_twice_is_ignored():
+    conn = db_pool.getconn()
+    db_pool.putconn(conn)
+    idle = db_pool.stats()['idle']
+    db_pool.putconn(conn)
+    assert db_pool.stats()['idle'] == idle
+    assert idle_connections().count(conn) == 1
+
+if __name__ == "__main__":
+    test_failing_first_chunk_releases_once()
+    test_putconn_twice_is_ignored()
+    print("SUCCESS: export connections are released once")
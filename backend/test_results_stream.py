@@ -0,0 +1,45 @@
+import asyncio
+import json
+import time
+
+from results_cache import ResultsCache, entry_candidates
+from results_stream import ResultsBroadcaster
+
+def entry(eid, candidates):
+    return {'id': eid, 'candidates': None, 'candidates_json': json.dumps(candidates), 'totalVotes': 0, 'rendered': {}}
+
+def test_unstarted_stream_leaves_no_subscriber():
+    """A stream whose body is never sent (client gone before the first chunk) does not stay subscribed"""
+    async def run():
+        broadcaster = ResultsBroadcaster(interval_ms=60000)
+        events = broadcaster.stream([entry(1, [{'id': 1, 'vote_count': 0}])], lambda es: "[]")
+        assert broadcaster.stats()['subscribers'] == 0
+        await events.aclose()
+        assert broadcaster.stats()['subscribers'] == 0
+
+        events = broadcaster.stream([entry(1, [{'id': 1, 'vote_count': 0}])], lambda es: "[]")
+        assert (await events.__anext__()).startswith("retry:")
+        assert broadcaster.stats()['subscribers'] == 1
+        await events.aclose()
+        assert broadcaster.stats()['subscribers'] == 0
+        await broadcaster.stop()
+    asyncio.run(run())
+
+def test_recorded_votes_keep_results_order():
+    """Candidates tied on votes stay in id order after record_votes, as in the /results query"""
+    cache = ResultsCache(ttl=60)
+    cache._entries[1] = (time.monotonic() + 60, entry(1, [
+        {'id': 2, 'vote_count': 1}, {'id': 3, 'vote_count': 1}, {'id': 5, 'vote_count': 0}, {'id': 7, 'vote_count': 0},
+    ]))
+    cache.record_votes({7: 1})
+    order = [c['id'] for c in entry_candidates(cache._entries[1][1])]
+    print(f"Order after a vote for 7: {order}")
+    assert order == [2, 3, 7, 5], order
+    cache.record_votes({5: 1})
+    order = [c['id'] for c in entry_candidates(cache._entries[1][1])]
+    assert order == [2, 3, 5, 7], order
+
+if __name__ == "__main__":
+    test_unstarted_stream_leaves_no_subscriber()
+    test_recorded_votes_keep_results_order()
+    print("SUCCESS: results stream subscribers and cached results order")
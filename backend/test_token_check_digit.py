@@ -0,0 +1,74 @@
+import os
+
+os.environ["TOKEN_CHECK_DIGIT"] = "1"
+os.environ.setdefault("TOKEN_LENGTH", "9")  # room for new codes however many the database already has
+os.environ["ADMISSION"] = "0"
+
+from fastapi.testclient import TestClient
+
+import main
+from database import _connect, init_db, resolve_election_set
+from token_allocator import token_allocator
+
+def seed_legacy_token():
+    """A token issued before the check character was turned on: its last digit does not check out."""
+    init_db()
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO elections (name, start_date, end_date, status)
+        VALUES ('Check Digit Test', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP + INTERVAL '1 day', 'active') RETURNING id
+    """)
+    election_id = cur.fetchone()['id']
+    cur.execute("INSERT INTO candidates (name, position, party, election_id) VALUES ('Legacy', 'Test', 'Test', %s) RETURNING id",
+                (election_id,))
+    candidate_id = cur.fetchone()['id']
+    body = f"{int.from_bytes(os.urandom(4), 'big') % 10 ** token_allocator.body_length:0{token_allocator.body_length}d}"
+    good = token_allocator.check_char(body)
+    legacy = body + token_allocator.alphabet[(token_allocator.alphabet.index(good) + 1) % len(token_allocator.alphabet)]
+    cur.execute("INSERT INTO voting_tokens (token, election_set_id) VALUES (%s, %s)",
+                (legacy, resolve_election_set(cur, [election_id])))
+    # As if the flag had been off until now
+    cur.execute("UPDATE token_allocator SET check_digit_after_id = NULL")
+    conn.commit()
+    conn.close()
+    return election_id, candidate_id, legacy
+
+def cleanup(election_id):
+    conn = _connect()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM voting_tokens WHERE election_set_id IN (SELECT set_id FROM election_set_members WHERE election_id = %s)",
+                (election_id,))
+    cur.execute("DELETE FROM candidates WHERE election_id = %s", (election_id,))
+    cur.execute("DELETE FROM elections WHERE id = %s", (election_id,))
+    cur.execute("UPDATE token_allocator SET check_digit_after_id = NULL")
+    conn.commit()
+    conn.close()
+
+def test_legacy_token_after_check_digit_is_turned_on():
+    """A token without a check character keeps working once TOKEN_CHECK_DIGIT=1; new codes carry one"""
+    election_id, candidate_id, legacy = seed_legacy_token()
+    assert not token_allocator.is_well_formed(legacy)
+    try:
+        with TestClient(main.app) as client:
+            assert token_allocator.legacy
+            r = client.post("/tokens/login", json={"token": legacy})
+            print(f"Legacy token login: {r.status_code}")
+            assert r.status_code == 200, r.text
+            r = client.post("/vote", json={"token": legacy, "candidateId": candidate_id})
+            print(f"Legacy token vote: {r.status_code}")
+            assert r.status_code == 200, r.text
+
+            batch = client.post("/tokens/generate", json={"electionIds": [election_id], "count": 1}).json()
+            fresh = batch['tokens'][0]['token']
+            assert token_allocator.is_well_formed(fresh)
+            assert client.post("/tokens/login", json={"token": fresh}).status_code == 200
+            # Writers still insist on the check character
+            r = client.post("/admin/save-token", json={"token": legacy, "electionIds": [election_id]})
+            assert r.status_code == 400 and "check character" in r.json()['detail'], r.text
+    finally:
+        cleanup(election_id)
+
+if __name__ == "__main__":
+    test_legacy_token_after_check_digit_is_turned_on()
+    print("SUCCESS: tokens issued before the check character still work")
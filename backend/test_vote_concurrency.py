@@ -0,0 +1,40 @@
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = "http://localhost:8000"
+PARALLEL_VOTES = 50
+
+def test_concurrent_token_vote():
+    """Fires many parallel votes with the same token: exactly one may succeed"""
+    election = requests.post(f"{BASE_URL}/elections", json={
+        "name": "Concurrency Test",
+        "startDate": "2026-01-13T00:00:00",
+        "endDate": "2026-12-31T00:00:00",
+        "status": "active"
+    }).json()
+    candidate = requests.post(f"{BASE_URL}/candidates", json={
+        "name": "Race Candidate",
+        "position": "Test",
+        "party": "Test Party",
+        "electionId": str(election['id'])
+    }).json()
+    batch = requests.post(f"{BASE_URL}/tokens/generate", json={"electionIds": [election['id']], "count": 1}).json()
+    token = batch['tokens'][0]['token']
+
+    def cast(_):
+        return requests.post(f"{BASE_URL}/vote", json={"token": token, "candidateId": candidate['id']}).status_code
+
+    with ThreadPoolExecutor(max_workers=PARALLEL_VOTES) as pool:
+        codes = list(pool.map(cast, range(PARALLEL_VOTES)))
+
+    print(f"Status codes: {sorted(codes)}")
+    assert codes.count(200) == 1
+    assert codes.count(400) == PARALLEL_VOTES - 1
+
+    votes = [c['voteCount'] for c in requests.get(f"{BASE_URL}/elections/{election['id']}/candidates").json()]
+    print(f"Vote count after race: {votes}")
+    assert votes == [1]
+
+if __name__ == "__main__":
+    test_concurrent_token_vote()
+    print("SUCCESS: exactly one vote was counted")
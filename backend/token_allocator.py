@@ -0,0 +1,144 @@
+import hashlib
+import os
+import threading
+
+from database import db_pool
+
+# Token allocator. Codes are a keyed permutation of a counter: token_counter_seq hands out indices
+# that are never reused, and a Feistel network (keyed with token_allocator.key, cycle-walked into
+# the keyspace) maps each index to a distinct code. Two indices can never give the same code, so
+# allocation needs no uniqueness probes, and consecutive codes look unrelated without the key.
+# Only codes inserted some other way (older random tokens, manual /admin/save-token codes) can
+# still clash; the writers keep ON CONFLICT as a safety net for those.
+# With TOKEN_CHECK_DIGIT on, new codes carry a check character and the writers refuse codes without
+# one. Tokens issued before it was turned on (ids up to token_allocator.check_digit_after_id) have
+# none, so while any of them is unused, login and vote look up codes that fail the check instead
+# of rejecting them; the token filter still turns away the ones that do not exist.
+TOKEN_ALPHABET = os.environ.get("TOKEN_ALPHABET", "0123456789")
+TOKEN_LENGTH = int(os.environ.get("TOKEN_LENGTH", "6"))            # printed length, check character included
+TOKEN_CHECK_DIGIT = os.environ.get("TOKEN_CHECK_DIGIT", "0") == "1"  # append a Luhn mod N check character
+
+FEISTEL_ROUNDS = 8
+
+class TokenSpaceExhausted(Exception):
+    pass
+
+class TokenAllocator:
+    def __init__(self, alphabet=TOKEN_ALPHABET, length=TOKEN_LENGTH, check_digit=TOKEN_CHECK_DIGIT, key=None):
+        """`key` defaults to the one stored in token_allocator, read on the first allocation."""
+        alphabet = alphabet.upper()  # tokens are matched upper-cased
+        if len(alphabet) < 2 or len(set(alphabet)) != len(alphabet):
+            raise ValueError("TOKEN_ALPHABET needs at least two distinct characters")
+        self.alphabet = alphabet
+        self.length = length
+        self.check_digit = check_digit
+        self.body_length = length - (1 if check_digit else 0)
+        if self.body_length < 1:
+            raise ValueError("TOKEN_LENGTH is too short")
+        self.space = len(alphabet) ** self.body_length
+        self._index = {ch: i for i, ch in enumerate(alphabet)}
+
+        # Balanced Feistel over 2 * half bits, the smallest even width covering the keyspace
+        self._half = max(1, ((self.space - 1).bit_length() + 1) // 2)
+        self._mask = (1 << self._half) - 1
+        self._round_hash = hashlib.blake2b(key=key, digest_size=8) if key else None
+        self._lock = threading.Lock()
+        self.legacy = False  # unused tokens without a check character remain (see start)
+
+    def _load_key(self, cur):
+        with self._lock:
+            if self._round_hash is None:
+                cur.execute("SELECT key FROM token_allocator")
+                key = bytes(cur.fetchone()['key'])
+                self._round_hash = hashlib.blake2b(key=key, digest_size=8)
+
+    def permute(self, index):
+        """Keyed bijection on [0, space): Feistel rounds, re-applied until the value is in range."""
+        value = index
+        while True:
+            left, right = value >> self._half, value & self._mask
+            for r in range(FEISTEL_ROUNDS):
+                h = self._round_hash.copy()
+                h.update(bytes((r,)) + right.to_bytes(8, "big"))
+                left, right = right, left ^ (int.from_bytes(h.digest(), "big") & self._mask)
+            value = (left << self._half) | right
+            if value < self.space:
+                return value
+
+    def check_char(self, body):
+        """Luhn mod N over the alphabet: catches any single wrong character and most swaps.
+
+        Luhn's digit-sum fold of the doubled value is only a bijection for an even alphabet size;
+        for an odd size plain doubling mod N is, and it catches every adjacent swap as well.
+        """
+        n = len(self.alphabet)
+        factor, total = 2, 0
+        for ch in reversed(body):
+            addend = factor * self._index[ch]
+            total += addend // n + addend % n if n % 2 == 0 else addend
+            factor = 3 - factor
+        return self.alphabet[(n - total % n) % n]
+
+    def encode(self, index):
+        value = self.permute(index)
+        n = len(self.alphabet)
+        chars = []
+        for _ in range(self.body_length):
+            value, digit = divmod(value, n)
+            chars.append(self.alphabet[digit])
+        body = "".join(reversed(chars))
+        return body + self.check_char(body) if self.check_digit else body
+
+    def is_well_formed(self, token):
+        """False only for codes that cannot have been issued (wrong length, alphabet or check
+        character). Without a check character every code is accepted, as older tokens may differ."""
+        if not self.check_digit:
+            return True
+        if len(token) != self.length or any(ch not in self._index for ch in token):
+            return False
+        return self.check_char(token[:-1]) == token[-1]
+
+    def may_exist(self, token):
+        """is_well_formed, except that codes from before the check character are let through."""
+        return self.legacy or self.is_well_formed(token)
+
+    def start(self):
+        """Records the check character cutover on first use and whether older tokens are left."""
+        self.legacy = self.check_digit  # until known, look up codes that fail the check
+        try:
+            with db_pool.connection() as conn:
+                cur = conn.cursor()
+                try:
+                    if self.check_digit:
+                        cur.execute("""
+                            UPDATE token_allocator SET check_digit_after_id = (SELECT COALESCE(MAX(id), 0) FROM voting_tokens)
+                            WHERE check_digit_after_id IS NULL
+                        """)
+                        cur.execute("""
+                            SELECT EXISTS (
+                                SELECT 1 FROM voting_tokens
+                                WHERE id <= (SELECT check_digit_after_id FROM token_allocator) AND NOT is_used
+                            ) AS legacy
+                        """)
+                        self.legacy = cur.fetchone()['legacy']
+                    else:
+                        # Turned off: tokens issued from now on have no check character either
+                        cur.execute("UPDATE token_allocator SET check_digit_after_id = NULL WHERE check_digit_after_id IS NOT NULL")
+                    conn.commit()
+                finally:
+                    cur.close()
+        except Exception as e:
+            print(f"Token check character cutover not loaded: {e}")
+
+    def allocate(self, cur, count):
+        """`count` new codes, distinct from every code this allocator has handed out before."""
+        self._load_key(cur)
+        cur.execute("SELECT nextval('token_counter_seq') - 1 AS i FROM generate_series(1, %s)", (count,))
+        indices = [r['i'] for r in cur.fetchall()]
+        if indices and max(indices) >= self.space:
+            raise TokenSpaceExhausted(
+                f"All {self.space} codes of {self.body_length} characters from the alphabet are issued; "
+                "raise TOKEN_LENGTH or widen TOKEN_ALPHABET")
+        return [self.encode(i) for i in indices]
+
+token_allocator = TokenAllocator()
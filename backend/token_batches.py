@@ -0,0 +1,296 @@
+import asyncio
+import io
+import os
+import random
+import threading
+import time
+
+import async_database
+from database import db_pool
+from token_allocator import TokenSpaceExhausted, token_allocator
+
+# Bulk token generation. Codes come from token_allocator (unique by construction), are COPYed into
+# a temp staging table TOKEN_BATCH_CHUNK at a time, and moved into voting_tokens with one
+# INSERT ... ON CONFLICT DO NOTHING. Eligibility is the batch's election set (one id per token, see
+# resolve_election_set), so there are no per-token election rows to write. A code that clashes
+# with a token inserted outside the allocator (older random or manually saved codes) is missing
+# from RETURNING and replaced by a fresh allocation in the next round.
+TOKEN_BATCH_CHUNK = int(os.environ.get("TOKEN_BATCH_CHUNK", "10000"))
+TOKEN_BATCH_MAX_ROUNDS = 20  # clash rounds per chunk before giving up
+
+INSERT_CHUNK_SQL = """
+    INSERT INTO voting_tokens (token, batch_id, election_set_id)
+    SELECT token, %s, %s FROM token_staging
+    ON CONFLICT (token) DO NOTHING
+    RETURNING id, token, created_at
+"""
+
+class BatchJob:
+    """Progress of one generation run, readable while it is still in its transaction."""
+
+    def __init__(self, batch_id, election_ids, requested, election_set_id=None):
+        self.batch_id = batch_id
+        self.election_ids = election_ids
+        self.election_set_id = election_set_id
+        self.requested = requested
+        self.generated = 0
+        self.collisions = 0
+        self.status = "running"
+        self.error = None
+        self.started = time.monotonic()
+        self.finished = None
+
+    def to_dict(self):
+        end = self.finished or time.monotonic()
+        return {
+            "batchId": self.batch_id,
+            "electionIds": [str(eid) for eid in self.election_ids],
+            "status": self.status,
+            "requested": self.requested,
+            "generated": self.generated,
+            "collisions": self.collisions,
+            "elapsedMs": round((end - self.started) * 1000, 1),
+            "error": self.error,
+        }
+
+class BatchJobs:
+    """In-process registry of recent generation runs, keyed by batch id."""
+
+    def __init__(self, keep=100):
+        self.keep = keep
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start(self, batch_id, election_ids, requested, election_set_id=None):
+        job = BatchJob(batch_id, election_ids, requested, election_set_id)
+        with self._lock:
+            self._jobs[batch_id] = job
+            while len(self._jobs) > self.keep:
+                done = next((k for k, j in self._jobs.items() if j.status != "running"), None)
+                if done is None:
+                    break
+                del self._jobs[done]
+        return job
+
+    def get(self, batch_id):
+        with self._lock:
+            return self._jobs.get(batch_id)
+
+token_jobs = BatchJobs()
+
+def new_batch_id(cur):
+    """Short batch ID (B-####) not used by any existing token or running job."""
+    while True:
+        batch_id = f"B-{random.randint(1000, 9999)}"
+        if token_jobs.get(batch_id) is None:
+            cur.execute("SELECT 1 FROM voting_tokens WHERE batch_id = %s LIMIT 1", (batch_id,))
+            if not cur.fetchone():
+                return batch_id
+
+def generate_batch(cur, job):
+    """Inserts job.requested new tokens for job.election_set_id inside the caller's transaction.
+
+    Returns the new rows (id, token, created_at). Raises TokenSpaceExhausted when the allocator's
+    keyspace runs out.
+    """
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS token_staging (token TEXT) ON COMMIT DROP")
+    created = []
+    while job.generated < job.requested:
+        want = min(TOKEN_BATCH_CHUNK, job.requested - job.generated)
+        for _ in range(TOKEN_BATCH_MAX_ROUNDS):
+            codes = token_allocator.allocate(cur, want)
+            cur.execute("TRUNCATE token_staging")
+            cur.copy_expert("COPY token_staging (token) FROM STDIN", io.StringIO("\n".join(codes) + "\n"))
+            cur.execute(INSERT_CHUNK_SQL, (job.batch_id, job.election_set_id))
+            rows = cur.fetchall()
+            created.extend(rows)
+            job.generated += len(rows)
+            job.collisions += want - len(rows)
+            want -= len(rows)
+            if want == 0:
+                break
+        else:
+            raise TokenSpaceExhausted(f"Could not place {want} more tokens: allocated codes keep clashing with existing ones")
+    return created
+
+def run_in_background(job):
+    """Generates the batch on its own pooled connection in a worker thread (poll token_jobs for progress)."""
+    def work():
+        try:
+            with db_pool.connection() as conn:
+                cur = conn.cursor()
+                try:
+                    generate_batch(cur, job)
+                    conn.commit()
+                    job.status = "done"
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    cur.close()
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            print(f"Token batch {job.batch_id} failed: {e}")
+        finally:
+            job.finished = time.monotonic()
+
+    threading.Thread(target=work, name=f"token-batch-{job.batch_id}", daemon=True).start()
+
+# Token administration reads. Batch counts come from token_batch_deltas, one row per batch plus the
+# deltas not yet compacted, so the summary costs the same however many tokens there are. Totals
+# are kept by insert / delete triggers on voting_tokens (see init_db). Redeeming a token must not
+# write anything extra, so /vote only notes the token id in token_usage; the batch compactor
+# appends the used count and last use of the noted tokens every TOKEN_BATCH_COMPACT_SECONDS (and
+# a worker does so before serving the summary). Redemptions on other workers therefore show up
+# within one compaction interval; those noted by a worker that crashes before its next flush are
+# lost until ?recount=true rebuilds the counts from voting_tokens.
+# The tokens of a batch are paged by id (keyset: WHERE id < last id seen).
+TOKEN_BATCH_COMPACT_SECONDS = float(os.environ.get("TOKEN_BATCH_COMPACT_SECONDS", "10"))  # 0 = no periodic compaction
+TOKEN_PAGE_LIMIT = 100
+TOKEN_PAGE_MAX = 1000
+UNBATCHED = "SINGLE-TOKENS"  # label for tokens without a batch_id
+TOKEN_STATUS_FILTERS = {None: "TRUE", "used": "is_used", "unused": "NOT is_used"}
+
+BATCH_SUMMARY_SQL = f"""
+    WITH per_set AS (
+        SELECT batch_id, election_set_id, SUM(total) AS total, SUM(used) AS used,
+               MAX(last_used_at) AS last_used_at, MIN(created_at) AS created_at
+        FROM token_batch_deltas
+        GROUP BY batch_id, election_set_id
+        HAVING SUM(total) <> 0
+    ), b AS (
+        SELECT batch_id, SUM(total)::bigint AS total, SUM(used)::bigint AS used, MAX(last_used_at) AS last_used_at,
+               MIN(created_at) AS created_at, array_agg(election_set_id) AS set_ids
+        FROM per_set
+        GROUP BY batch_id
+    )
+    SELECT COALESCE(b.batch_id, '{UNBATCHED}') AS "batchId", b.total, b.used, b.total - b.used AS unused,
+           b.last_used_at AS "lastUsedAt", b.created_at AS "createdAt",
+           COALESCE((SELECT json_agg(json_build_object('id', e.id::text, 'name', e.name) ORDER BY e.id)
+                     FROM elections e
+                     WHERE e.id IN (SELECT m.election_id FROM election_set_members m WHERE m.set_id = ANY(b.set_ids))),
+                    '[]') AS elections
+    FROM b
+    ORDER BY b.created_at DESC NULLS LAST, b.batch_id
+"""
+
+def token_page_sql(batch_id, status=None, after=None, limit=TOKEN_PAGE_LIMIT):
+    """(sql, params) for up to `limit` tokens of one batch, newest first, with ids below `after`."""
+    where = ["batch_id IS NULL" if batch_id == UNBATCHED else "batch_id = %s", TOKEN_STATUS_FILTERS[status]]
+    params = [] if batch_id == UNBATCHED else [batch_id]
+    if after is not None:
+        where.append("id < %s")
+        params.append(after)
+    params.append(limit)
+    return f"""
+        SELECT id, token, batch_id, is_used, used_at, created_at
+        FROM voting_tokens
+        WHERE {' AND '.join(where)}
+        ORDER BY id DESC
+        LIMIT %s
+    """, params
+
+COMPACT_BATCH_DELTAS_SQL = """
+    WITH moved AS (
+        DELETE FROM token_batch_deltas RETURNING *
+    ), folded AS (
+        INSERT INTO token_batch_deltas (batch_id, election_set_id, total, used, last_used_at, created_at)
+        SELECT batch_id, election_set_id, SUM(total), SUM(used), MAX(last_used_at), MIN(created_at)
+        FROM moved
+        GROUP BY batch_id, election_set_id
+        HAVING SUM(total) <> 0 OR SUM(used) <> 0
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM moved) AS moved, (SELECT COUNT(*) FROM folded) AS folded
+"""
+
+# Used count and last use of the tokens noted by token_usage, as one delta row per batch
+RECORD_USAGE_SQL = """
+    INSERT INTO token_batch_deltas (batch_id, election_set_id, used, last_used_at)
+    SELECT batch_id, election_set_id, COUNT(*), MAX(used_at)
+    FROM voting_tokens
+    WHERE id = ANY($1::int[]) AND is_used
+    GROUP BY batch_id, election_set_id
+"""
+
+RECOUNT_BATCH_DELTAS_SQL = """
+    WITH cleared AS (
+        DELETE FROM token_batch_deltas RETURNING 1
+    ), counted AS (
+        INSERT INTO token_batch_deltas (batch_id, election_set_id, total, used, last_used_at, created_at)
+        SELECT batch_id, election_set_id, COUNT(*), COUNT(*) FILTER (WHERE is_used), MAX(used_at), MIN(created_at)
+        FROM voting_tokens
+        GROUP BY batch_id, election_set_id
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM cleared) AS moved, (SELECT COUNT(*) FROM counted) AS folded
+"""
+
+class TokenUsage:
+    """Ids of the tokens this worker redeemed that token_batch_deltas does not count yet."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = []
+
+    def record(self, token_id):
+        with self._lock:
+            self._ids.append(token_id)
+
+    async def flush(self, db):
+        """Appends the noted tokens' used counts; returns how many tokens were counted."""
+        with self._lock:
+            ids, self._ids = self._ids, []
+        if not ids:
+            return 0
+        try:
+            async with db.transaction():
+                await db.execute(RECORD_USAGE_SQL, ids)
+        except BaseException:
+            with self._lock:
+                self._ids[:0] = ids  # kept for the next flush
+            raise
+        return len(ids)
+
+token_usage = TokenUsage()
+
+async def compact_batch_deltas(db, recount=False):
+    """Counts the tokens redeemed on this worker, then folds the per-batch delta rows into one row
+    per batch and election set. recount=True rebuilds them from voting_tokens instead (while no
+    votes are cast: redemptions other workers have not flushed yet would be counted twice)."""
+    counted = await token_usage.flush(db)
+    async with db.transaction():
+        row = await db.fetchrow(RECOUNT_BATCH_DELTAS_SQL if recount else COMPACT_BATCH_DELTAS_SQL)
+    return {**row, "used": counted}
+
+async def _compact_forever():
+    while True:
+        await asyncio.sleep(TOKEN_BATCH_COMPACT_SECONDS)
+        try:
+            async with async_database.session() as db:
+                await compact_batch_deltas(db)
+        except Exception as e:
+            print(f"Token batch delta compaction failed: {e}")
+
+_compactor = None
+
+def start_batch_compactor():
+    global _compactor
+    if TOKEN_BATCH_COMPACT_SECONDS > 0 and _compactor is None:
+        _compactor = asyncio.create_task(_compact_forever())
+
+async def stop_batch_compactor():
+    global _compactor
+    if _compactor is not None:
+        _compactor.cancel()
+        try:
+            await _compactor
+        except asyncio.CancelledError:
+            pass
+        _compactor = None
+    try:
+        async with async_database.session() as db:
+            await token_usage.flush(db)
+    except Exception as e:
+        print(f"Counting redeemed tokens failed: {e}")
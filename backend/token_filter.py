@@ -0,0 +1,287 @@
+import asyncio
+import hashlib
+import math
+import os
+import threading
+import time
+
+import asyncpg
+from psycopg2 import extensions
+
+from database import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, db_pool
+
+# Per-worker token membership filter, so /tokens/login, /access-token and /vote can turn away codes
+# that cannot work without a database round trip. Three parts, all in memory:
+#   unused       Bloom filter over the tokens that were unused at the last build, plus every token
+#                inserted since (never a false "no"; false "maybe" at about TOKEN_FILTER_FP_RATE)
+#   used         Bloom filter over the tokens already used at the last build (or when announced)
+#   recent_used  exact set of tokens this worker saw redeemed (or saw the database call used) since
+# A code outside `unused` is either used (in `used` or recent_used) or invalid; anything else goes
+# to Postgres as before. New tokens reach every worker through NOTIFY (a statement trigger on
+# voting_tokens sends the inserted id range; see init_db). While an announced range is still being
+# loaded, codes outside the filter go to Postgres instead of being called invalid. That leaves the
+# delivery delay itself (a few ms after the batch commits), in which a worker that has not heard of
+# a batch yet answers "invalid" for its codes; telling those apart from guesses would cost a
+# database round trip per guess, which is what the filter is there to save. Redemptions on other
+# workers are not broadcast (NOTIFY takes a global lock at commit, which /vote should not pay);
+# this worker learns of them on the first database answer. Until the first build, or while the
+# listener is disconnected, every code goes to Postgres.
+TOKEN_FILTER = os.environ.get("TOKEN_FILTER", "1") == "1"
+TOKEN_FILTER_FP_RATE = float(os.environ.get("TOKEN_FILTER_FP_RATE", "0.001"))
+TOKEN_FILTER_HEADROOM = 2.0        # sized for this many times the unused tokens, so new batches fit
+TOKEN_FILTER_MIN_CAPACITY = 100_000
+TOKEN_FILTER_REBUILD_USED = 0.1    # rebuild once recent_used reaches this share of the unused tokens
+TOKEN_FILTER_CHUNK = 50_000
+TOKEN_FILTER_CHANNEL = "voting_tokens_added"
+
+class BloomFilter:
+    """Bloom filter over strings: m bits, k positions by double hashing one blake2b digest."""
+
+    def __init__(self, capacity, fp_rate):
+        self.capacity = max(1, capacity)
+        self.size = max(64, math.ceil(-self.capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, item):
+        bits = self.bits
+        for p in self._positions(item):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def update(self, items):
+        """add() for many items, with the hashing inlined (this is the whole cost of a build)."""
+        bits, size, hashes, blake2b = self.bits, self.size, range(self.hashes), hashlib.blake2b
+        n = 0
+        for item in items:
+            digest = blake2b(item.encode(), digest_size=16).digest()
+            h1 = int.from_bytes(digest[:8], "little")
+            h2 = int.from_bytes(digest[8:], "little") | 1
+            for i in hashes:
+                p = (h1 + i * h2) % size
+                bits[p >> 3] |= 1 << (p & 7)
+            n += 1
+        self.count += n
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    @property
+    def nbytes(self):
+        return len(self.bits)
+
+    def expected_fp_rate(self):
+        """(1 - e^(-kn/m))^k for the current number of items."""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+class TokenFilter:
+    def __init__(self, enabled=TOKEN_FILTER, fp_rate=TOKEN_FILTER_FP_RATE):
+        self.enabled = enabled
+        self.fp_rate = fp_rate
+        self.ready = False
+        self._lock = threading.Lock()
+        self._unused = None
+        self._used = None
+        self._recent_used = set()
+        self._building = False
+        self._replay = None           # id ranges NOTIFYed while a build runs, re-applied after it
+        self._ranges = None           # asyncio.Queue of (low id, high id)
+        self._pending = 0             # ranges NOTIFYed but not yet in the filter
+        self._task = None
+        self.build_ms = 0.0
+
+        self.rejected_invalid = 0
+        self.rejected_used = 0
+        self.passed = 0
+
+    def check(self, token):
+        """"invalid" or "used" when the code cannot be redeemed, None when Postgres must decide."""
+        if not self.ready:
+            return None
+        with self._lock:
+            if token in self._recent_used:
+                self.rejected_used += 1
+                return "used"
+            if token not in self._unused:
+                if token in self._used:
+                    self.rejected_used += 1
+                    return "used"
+                if not self._pending:  # else it may be in a range still being loaded
+                    self.rejected_invalid += 1
+                    return "invalid"
+            self.passed += 1
+        return None
+
+    def mark_used(self, token):
+        """Called once the database has redeemed the code, or reported it already used."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._recent_used.add(token)
+            due = self._unused is not None and \
+                len(self._recent_used) > max(TOKEN_FILTER_MIN_CAPACITY, self._unused.count) * TOKEN_FILTER_REBUILD_USED
+        if due:
+            self._schedule_build()
+
+    def stats(self):
+        with self._lock:
+            unused, used = self._unused, self._used
+            return {
+                "enabled": self.enabled,
+                "ready": self.ready,
+                "unusedTokens": unused.count if unused else 0,
+                "usedTokens": used.count if used else 0,
+                "recentlyUsed": len(self._recent_used),
+                "bytes": (unused.nbytes + used.nbytes) if unused else 0,
+                "pendingRanges": self._pending,
+                "hashes": unused.hashes if unused else 0,
+                "targetFpRate": self.fp_rate,
+                "expectedFpRate": round(unused.expected_fp_rate(), 8) if unused else None,
+                "lastBuildMs": self.build_ms,
+                "rejectedInvalid": self.rejected_invalid,
+                "rejectedUsed": self.rejected_used,
+                "passed": self.passed,
+            }
+
+    # --- building ---
+
+    def build(self):
+        """Loads every token into fresh filters (blocking; run in a thread). Returns (unused, used)."""
+        start = time.perf_counter()
+        conn = db_pool.getconn()
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT COUNT(*) FILTER (WHERE NOT is_used) AS unused, COUNT(*) FILTER (WHERE is_used) AS used FROM voting_tokens")
+            counts = cur.fetchone()
+            cur.close()
+            unused = BloomFilter(max(TOKEN_FILTER_MIN_CAPACITY, int(counts['unused'] * TOKEN_FILTER_HEADROOM)), self.fp_rate)
+            used = BloomFilter(max(TOKEN_FILTER_MIN_CAPACITY, counts['used']), self.fp_rate)
+            cur = conn.cursor(name="token_filter", cursor_factory=extensions.cursor)
+            cur.itersize = TOKEN_FILTER_CHUNK
+            cur.execute("SELECT token, is_used FROM voting_tokens")
+            while True:
+                rows = cur.fetchmany(TOKEN_FILTER_CHUNK)
+                if not rows:
+                    break
+                unused.update(token for token, is_used in rows if not is_used)
+                used.update(token for token, is_used in rows if is_used)
+            cur.close()
+            conn.rollback()
+        finally:
+            db_pool.putconn(conn)
+        self.build_ms = round((time.perf_counter() - start) * 1000, 1)
+        return unused, used
+
+    async def _rebuild(self):
+        with self._lock:
+            self._building = True
+            self._replay = []
+            before = set(self._recent_used)
+        try:
+            unused, used = await asyncio.to_thread(self.build)
+        except Exception as e:
+            print(f"Token filter build failed: {e}")
+            with self._lock:
+                self._building = False
+                self._replay = None
+            return False
+        with self._lock:
+            self._unused, self._used = unused, used
+            self._recent_used -= before   # redeemed before the build started, so now in `used`
+            replay, self._replay, self._building = self._replay, None, False
+        for r in replay:
+            self._queue_range(r)
+        print(f"Token filter built: {unused.count} unused / {used.count} used tokens, "
+              f"{(unused.nbytes + used.nbytes) / 1e6:.1f} MB, {self.build_ms:.0f} ms")
+        return True
+
+    def _schedule_build(self):
+        with self._lock:
+            if self._building or self._task is None:
+                return
+            self._building = True
+        self._loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._rebuild()))
+
+    # --- listening ---
+
+    def _queue_range(self, r):
+        self._pending += 1
+        self._ranges.put_nowait(r)
+
+    def _on_notify(self, conn, pid, channel, payload):
+        low, high = (int(x) for x in payload.split(","))
+        self._queue_range((low, high))
+
+    async def _add_ranges(self, conn):
+        while True:
+            low, high = await self._ranges.get()
+            try:
+                # Tokens already used by now (say, replayed after a build) go to `used`, so a retry
+                # is told "used" rather than "invalid"
+                rows = await conn.fetch("SELECT token, is_used FROM voting_tokens WHERE id BETWEEN $1 AND $2", low, high)
+                with self._lock:
+                    if self._replay is not None:
+                        self._replay.append((low, high))
+                    if self._unused is not None:
+                        for r in rows:
+                            (self._used if r['is_used'] else self._unused).add(r['token'])
+            finally:
+                self._pending -= 1
+            if self._unused is not None and self._unused.count > self._unused.capacity:
+                self._schedule_build()
+
+    async def _run(self):
+        while True:
+            conn = adder = None
+            try:
+                conn = await asyncpg.connect(database=DB_NAME, user=DB_USER, password=DB_PASSWORD,
+                                             host=DB_HOST, port=int(DB_PORT))
+                # Listen first: tokens committed before the build's snapshot are in it, later
+                # ones arrive as notifications
+                await conn.add_listener(TOKEN_FILTER_CHANNEL, self._on_notify)
+                adder = asyncio.create_task(self._add_ranges(conn))
+                if await self._rebuild():
+                    self.ready = True
+                while not conn.is_closed() and not adder.done():
+                    await asyncio.sleep(1)
+                if adder.done():
+                    adder.result()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Token filter listener failed: {e}")
+            finally:
+                # Missed notifications would mean false "invalid" answers, so stop answering
+                self.ready = False
+                if adder is not None:
+                    adder.cancel()
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(5)
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._ranges = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self.ready = False
+
+token_filter = TokenFilter()
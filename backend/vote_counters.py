@@ -0,0 +1,93 @@
+import asyncio
+import os
+
+import async_database
+
+# Vote counters. With VOTE_COUNTER_SHARDS = 0 every vote increments candidates.vote_count directly.
+# With N > 0 each vote lands in one of N slots of candidate_vote_shards (chosen by the backend
+# connection), so concurrent voters for the same candidate stop queueing on a single row lock.
+# Totals are always candidates.vote_count plus the slots, so both modes can be switched freely.
+VOTE_COUNTER_SHARDS = int(os.environ.get("VOTE_COUNTER_SHARDS", "0"))
+VOTE_COUNTER_COMPACT_SECONDS = float(os.environ.get("VOTE_COUNTER_COMPACT_SECONDS", "0"))  # 0 = no periodic compaction
+
+# Read expression for a candidate's total, for queries that alias candidates as "c".
+# Ballots recorded through the vote ledger (see vote_ledger.py) arrive via candidate_tallies.
+VOTE_COUNT_SQL = (
+    "(c.vote_count"
+    " + COALESCE((SELECT SUM(s.vote_count) FROM candidate_vote_shards s WHERE s.candidate_id = c.id), 0)"
+    " + COALESCE((SELECT t.votes FROM candidate_tallies t WHERE t.candidate_id = c.id), 0))"
+)
+
+# Set-based form of VOTE_COUNT_SQL for queries reading many candidates at once: add the joins
+# after "FROM candidates c" and select VOTE_TOTAL_SQL (hash joins instead of two probes per row)
+VOTE_TOTAL_JOINS = """
+    LEFT JOIN (SELECT candidate_id, SUM(vote_count) AS n FROM candidate_vote_shards GROUP BY candidate_id) vshard ON vshard.candidate_id = c.id
+    LEFT JOIN candidate_tallies vtally ON vtally.candidate_id = c.id
+"""
+VOTE_TOTAL_SQL = "(c.vote_count + COALESCE(vshard.n, 0) + COALESCE(vtally.votes, 0))"
+
+def tally_sql(guard="TRUE", shards=None, weighted=True):
+    """Statement adding $2[i] votes to candidate $1[i], applied only when `guard` holds.
+
+    With weighted=False there is no $2 and every candidate in $1 gets one vote.
+    """
+    shards = VOTE_COUNTER_SHARDS if shards is None else shards
+    source = "unnest($1::int[], $2::int[]) AS d(id, n)" if weighted else "(SELECT id, 1 AS n FROM unnest($1::int[]) AS id) AS d"
+    if shards > 0:
+        return f"""
+            INSERT INTO candidate_vote_shards (candidate_id, shard, vote_count)
+            SELECT d.id, pg_backend_pid() % {shards}, d.n
+            FROM {source}
+            WHERE {guard}
+            ORDER BY d.id
+            ON CONFLICT (candidate_id, shard) DO UPDATE SET vote_count = candidate_vote_shards.vote_count + EXCLUDED.vote_count
+        """
+    return f"""
+        UPDATE candidates c SET vote_count = c.vote_count + d.n
+        FROM {source}
+        WHERE c.id = d.id AND {guard}
+    """
+
+COMPACT_SQL = """
+    WITH moved AS (
+        DELETE FROM candidate_vote_shards RETURNING candidate_id, vote_count
+    ), sums AS (
+        SELECT candidate_id, SUM(vote_count) AS n FROM moved GROUP BY candidate_id
+    ), folded AS (
+        UPDATE candidates c SET vote_count = c.vote_count + s.n
+        FROM sums s WHERE c.id = s.candidate_id
+        RETURNING c.id
+    )
+    SELECT COUNT(*) FROM folded
+"""
+
+async def compact_vote_shards(db):
+    """Folds all counter slots back into candidates.vote_count. Returns the number of candidates touched."""
+    async with db.transaction():
+        return await db.fetchval(COMPACT_SQL)
+
+async def _compact_forever():
+    while True:
+        await asyncio.sleep(VOTE_COUNTER_COMPACT_SECONDS)
+        try:
+            async with async_database.session() as db:
+                await compact_vote_shards(db)
+        except Exception as e:
+            print(f"Vote counter compaction failed: {e}")
+
+_compactor = None
+
+def start_compactor():
+    global _compactor
+    if VOTE_COUNTER_COMPACT_SECONDS > 0 and _compactor is None:
+        _compactor = asyncio.create_task(_compact_forever())
+
+async def stop_compactor():
+    global _compactor
+    if _compactor is not None:
+        _compactor.cancel()
+        try:
+            await _compactor
+        except asyncio.CancelledError:
+            pass
+        _compactor = None
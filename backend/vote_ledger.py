@@ -0,0 +1,140 @@
+import asyncio
+import os
+
+import async_database
+from http_cache import BUMP_TALLIES_SQL
+from results_cache import results_cache
+from vote_counters import tally_sql
+
+# Append-only vote ledger. With VOTE_LEDGER=1 a ballot only appends rows to vote_ledger inside the
+# hot transaction; a materializer folds new rows into candidate_tallies every LEDGER_MATERIALIZE_MS.
+VOTE_LEDGER = os.environ.get("VOTE_LEDGER", "0").lower() in ("1", "true", "yes")
+LEDGER_MATERIALIZE_MS = float(os.environ.get("LEDGER_MATERIALIZE_MS", "500"))
+
+def record_votes_sql(voter_cte, voter_column):
+    """Statement recording the votes in $1 (candidate ids) for the voter returned by `voter_cte`.
+
+    `voter_column` is the ledger column ("token_id" or "user_id") that receives the voter's id.
+    """
+    if VOTE_LEDGER:
+        return f"""
+            INSERT INTO vote_ledger (election_id, candidate_id, {voter_column})
+            SELECT c.election_id, c.id, v.id
+            FROM {voter_cte} v, candidates c
+            WHERE c.id = ANY($1::int[])
+        """
+    return tally_sql(f"EXISTS (SELECT 1 FROM {voter_cte})", weighted=False)
+
+# Bulk form for the group-commit writer: one row per (candidate, token or user)
+LEDGER_BATCH_SQL = """
+    INSERT INTO vote_ledger (election_id, candidate_id, token_id, user_id)
+    SELECT c.election_id, c.id, d.token_id, d.user_id
+    FROM unnest($1::int[], $2::int[], $3::int[]) AS d(candidate_id, token_id, user_id)
+    JOIN candidates c ON c.id = d.candidate_id
+"""
+
+# Ledger ids are handed out before commit, so they do not arrive in order. The high-water mark is
+# therefore the writing transaction id: every transaction below the snapshot's xmin has finished,
+# so rows with tx_id in [high_water, xmin) are final and no new ones can appear in that range.
+MATERIALIZE_SQL = """
+    WITH horizon AS (
+        SELECT pg_snapshot_xmin(pg_current_snapshot()) AS xmin
+    ), batch AS (
+        SELECT l.candidate_id, l.election_id
+        FROM vote_ledger l, horizon h
+        WHERE l.tx_id >= (SELECT high_water FROM tally_state WHERE name = 'vote_ledger') AND l.tx_id < h.xmin
+    ), agg AS (
+        SELECT b.candidate_id, b.election_id, COUNT(*) AS n
+        FROM batch b JOIN candidates c ON c.id = b.candidate_id
+        GROUP BY b.candidate_id, b.election_id
+    ), applied AS (
+        INSERT INTO candidate_tallies (candidate_id, election_id, votes)
+        SELECT candidate_id, election_id, n FROM agg ORDER BY candidate_id
+        ON CONFLICT (candidate_id) DO UPDATE SET votes = candidate_tallies.votes + EXCLUDED.votes
+    ), moved AS (
+        UPDATE tally_state SET high_water = GREATEST(high_water, (SELECT xmin FROM horizon)), updated_at = CURRENT_TIMESTAMP
+        WHERE name = 'vote_ledger'
+    )
+    SELECT (SELECT COUNT(*) FROM batch) AS consumed, ARRAY(SELECT DISTINCT election_id FROM agg) AS elections
+"""
+
+async def materialize(db):
+    """Folds ledger rows past the high-water mark into candidate_tallies. Returns rows consumed."""
+    async with db.transaction():
+        # Serializes materializers across workers; the next statement sees the latest mark
+        await db.execute("SELECT high_water FROM tally_state WHERE name = 'vote_ledger' FOR UPDATE")
+        row = await db.fetchrow(MATERIALIZE_SQL)
+    if row['elections']:
+        results_cache.invalidate(row['elections'])
+    return row['consumed']
+
+async def recount(db, repair=False):
+    """Full recount from the ledger, compared with the materialized totals.
+
+    Only rows below the current high-water mark are counted, which is exactly what candidate_tallies
+    covers. With repair=True candidate_tallies is rebuilt from the recount and the "tallies" data
+    version is bumped.
+    """
+    async with db.transaction():
+        await db.execute("SELECT high_water FROM tally_state WHERE name = 'vote_ledger' FOR UPDATE")
+        rows = await db.fetch("""
+            WITH counted AS (
+                SELECT candidate_id, election_id, COUNT(*) AS votes
+                FROM vote_ledger
+                WHERE tx_id < (SELECT high_water FROM tally_state WHERE name = 'vote_ledger')
+                GROUP BY candidate_id, election_id
+            )
+            SELECT COALESCE(r.candidate_id, t.candidate_id) AS candidate_id,
+                   COALESCE(r.election_id, t.election_id) AS election_id,
+                   COALESCE(r.votes, 0) AS ledger_votes, COALESCE(t.votes, 0) AS tallied_votes
+            FROM counted r
+            FULL JOIN candidate_tallies t ON t.candidate_id = r.candidate_id
+        """)
+        mismatches = [r for r in rows if r['ledger_votes'] != r['tallied_votes']]
+        if repair and mismatches:
+            await db.execute("DELETE FROM candidate_tallies")
+            await db.execute("""
+                INSERT INTO candidate_tallies (candidate_id, election_id, votes)
+                SELECT l.candidate_id, l.election_id, COUNT(*)
+                FROM vote_ledger l JOIN candidates c ON c.id = l.candidate_id
+                WHERE l.tx_id < (SELECT high_water FROM tally_state WHERE name = 'vote_ledger')
+                GROUP BY l.candidate_id, l.election_id
+            """)
+            # Totals may have gone down: retire every candidate ETag built on the old sums
+            await db.execute(BUMP_TALLIES_SQL)
+    return {
+        "ledgerVotes": sum(r['ledger_votes'] for r in rows),
+        "talliedVotes": sum(r['tallied_votes'] for r in rows),
+        "mismatches": [
+            {"candidateId": r['candidate_id'], "electionId": r['election_id'],
+             "ledgerVotes": r['ledger_votes'], "talliedVotes": r['tallied_votes']}
+            for r in mismatches
+        ],
+        "repaired": bool(repair and mismatches),
+    }
+
+async def _materialize_forever():
+    while True:
+        await asyncio.sleep(LEDGER_MATERIALIZE_MS / 1000)
+        try:
+            async with async_database.session() as db:
+                await materialize(db)
+        except Exception as e:
+            print(f"Ledger materialization failed: {e}")
+
+_materializer = None
+
+def start_materializer():
+    global _materializer
+    if VOTE_LEDGER and _materializer is None:
+        _materializer = asyncio.create_task(_materialize_forever())
+
+async def stop_materializer():
+    global _materializer
+    if _materializer is not None:
+        _materializer.cancel()
+        try:
+            await _materializer
+        except asyncio.CancelledError:
+            pass
+        _materializer = None
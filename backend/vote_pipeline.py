@@ -0,0 +1,157 @@
+import asyncio
+import os
+from collections import Counter
+
+import async_database
+from vote_counters import tally_sql
+from vote_ledger import VOTE_LEDGER, LEDGER_BATCH_SQL
+
+# Opt-in group commit for /vote: validated ballots are queued and written by one task,
+# VOTE_PIPELINE_FLUSH_SIZE ballots or VOTE_PIPELINE_FLUSH_DELAY_MS milliseconds per transaction.
+VOTE_PIPELINE = os.environ.get("VOTE_PIPELINE", "0").lower() in ("1", "true", "yes")
+VOTE_PIPELINE_FLUSH_SIZE = int(os.environ.get("VOTE_PIPELINE_FLUSH_SIZE", "200"))
+VOTE_PIPELINE_FLUSH_DELAY_MS = float(os.environ.get("VOTE_PIPELINE_FLUSH_DELAY_MS", "5"))
+
+class VotePipeline:
+    """Batches ballots into group commits and resolves each caller once its batch is durable."""
+
+    def __init__(self, flush_size=VOTE_PIPELINE_FLUSH_SIZE, flush_delay_ms=VOTE_PIPELINE_FLUSH_DELAY_MS):
+        self.flush_size = flush_size
+        self.flush_delay = flush_delay_ms / 1000
+        self._queue = None
+        self._task = None
+        self._db = None
+
+        self.flushes = 0
+        self.ballots = 0
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._db is not None:
+            await async_database.release_session(self._db)
+            self._db = None
+
+    async def submit(self, kind, voter_id, candidate_ids):
+        """Queues a validated ballot ("token" or "user") and waits until it is committed.
+
+        Returns False when the token/user had already voted by the time the batch was written.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((kind, voter_id, list(candidate_ids), future))
+        return await future
+
+    def stats(self):
+        return {
+            "enabled": self.running,
+            "flushSize": self.flush_size,
+            "flushDelayMs": self.flush_delay * 1000,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "flushes": self.flushes,
+            "ballots": self.ballots,
+            "avgBatch": round(self.ballots / self.flushes, 2) if self.flushes else 0.0,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_delay
+            while len(batch) < self.flush_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch):
+        # The writer keeps its own connection so queued requests can never starve it of one
+        try:
+            if self._db is None:
+                self._db = await async_database.acquire_session()
+            accepted = await self._write(self._db, batch)
+        except Exception as e:
+            if self._db is not None:
+                await async_database.release_session(self._db)
+                self._db = None
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.flushes += 1
+        self.ballots += len(batch)
+        for (*_, future), ok in zip(batch, accepted):
+            if not future.done():
+                future.set_result(ok)
+
+    async def _write(self, db, batch):
+        token_ids = list({v for kind, v, *_ in batch if kind == "token"})
+        user_ids = list({v for kind, v, *_ in batch if kind == "user"})
+
+        async with db.transaction():
+            winners = set()
+            if token_ids:
+                rows = await db.fetch("""
+                    UPDATE voting_tokens SET is_used = TRUE, used_at = CURRENT_TIMESTAMP
+                    WHERE id = ANY($1::int[]) AND is_used = FALSE
+                    RETURNING id
+                """, token_ids)
+                winners.update(("token", r['id']) for r in rows)
+            if user_ids:
+                rows = await db.fetch("""
+                    UPDATE users SET has_voted = TRUE
+                    WHERE id = ANY($1::int[]) AND has_voted = FALSE
+                    RETURNING id
+                """, user_ids)
+                winners.update(("user", r['id']) for r in rows)
+
+            # Coalesce increments: one row per candidate, however many ballots named it.
+            # A voter queued twice in the same batch only counts once (the first ballot wins).
+            accepted = []
+            counted = set()
+            counts = Counter()
+            ledger = []
+            for kind, voter_id, candidate_ids, _ in batch:
+                ok = (kind, voter_id) in winners and (kind, voter_id) not in counted
+                if ok:
+                    counted.add((kind, voter_id))
+                    counts.update(candidate_ids)
+                    ledger.extend((c, voter_id if kind == "token" else None, voter_id if kind == "user" else None)
+                                  for c in candidate_ids)
+                accepted.append(ok)
+            if ledger and VOTE_LEDGER:
+                await db.execute(LEDGER_BATCH_SQL, *(list(col) for col in zip(*ledger)))
+            elif counts:
+                await db.execute(tally_sql(), sorted(counts), [counts[c] for c in sorted(counts)])
+        return accepted
+
+vote_pipeline = VotePipeline()